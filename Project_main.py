@@ -1,5 +1,5 @@
 ## Libraries
-import pandas as pd
+import os
 import random
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -10,72 +10,129 @@ from MS2_COLORS import COLORS
 import math
 from matplotlib.lines import Line2D
 import numpy as np
+from freq_loading import find_freq_files
+from freq_cache import load_freq_files_cached
+from freq_tensor import build_freq_tensor, tensor_mutation_df, tensor_mut_cutoffs
+from mutation_cutoffs import load_position_mask, apply_cutoffs
+from trajectory_index import build_trajectory_index, get_trajectory, get_mutation_trajectories, count_passages
+from trajectory_stats import compute_trajectory_table, select_mutations
+from variant_calling import build_error_model, call_variants, get_called_mutations
+from genome_annotation import load_annotation, annotate_mutations
+from genome_raster import use_raster, get_experiment_palette, draw_raster, RASTER_POINT_THRESHOLD
+from heatmaps import get_heatmap_matrices, get_heatmap_passages, cluster_heatmap, get_passage_matrix, \
+    draw_heatmap
+from profiling import new_profile, profile_stage, write_profile_report
+from sample_registry import attach_sample_metadata, DEFAULT_SAMPLE_SHEET
+from convergence import build_convergence_index, get_convergence_table, get_experiment_mask, find_convergent, \
+    get_intersections, draw_upset, MAX_UPSET_SETS
 
 ## Functions
-def df_cleanup(df, done_by):
+def df_cleanup(df, done_by=None):
     """
     This Function receives a df of a freq file returns the same df with 4 columns added:
     MOI - presenting the MOI of the experiment
     Passage - indicating the passage of each mutation
     Line - Which line of initial bacterial population
     Done_By - indicating the scientist responsible for the experiment
+    (when done_by is None the 'Done_by' column already tagged by load_freq_files is kept)
+    Each distinct 'File' name is parsed once and its values are joined to the rows (see sample_registry).
     return: df_arranged
     """
     df_arranged = df.copy()
-    # Extract the number after the first "p" to a new column 'Passage'
-    df_arranged['Passage'] = df_arranged['File'].str.extract(r'p(\d+)').astype(int)
-    # Extract the letter after the number to a new column 'Line'
-    df_arranged['Line'] = df_arranged['File'].str.extract(r'p\d+([A-Za-z])')
-    # Extract the number after the string "moi" to a new column 'MOI'
-    df_arranged['MOI'] = df_arranged['File'].str.extract(r'moi(\d+)').astype(int)
-    df_arranged['Done_by'] = done_by
-    return df_arranged
+    if done_by is not None:
+        df_arranged['Done_by'] = done_by
+    # Extract the passage (the number after the first "p"), the line (the letter after it) and the MOI
+    # (the number after "moi") of every sample
+    return attach_sample_metadata(df_arranged, columns=['Passage', 'Line', 'MOI'], fix_names=False)
+def arrange_freq_df(freq_df, sample_sheet=None):
+    """
+    This Function receives the joined df of all the freq files (see freq_loading.load_freq_files)
+    and returns it arranged for the analysis: Shir's 'File' names are fixed to match Carmel's,
+    the df_cleanup columns are added and an 'Experiment' column (Done_by-MOI-Line) identifies each experiment.
+    sample_sheet - optional csv (or list of csvs) with the Passage, Line, MOI and Done_by of the samples
+    (see sample_registry.read_sample_sheet), the values it does not give are read from the sample names.
+    The names are fixed and parsed once per sample, and the columns are joined to the rows as categories.
+    return: joined_freq
+    """
+    return attach_sample_metadata(freq_df, sample_sheet)
 def get_mut_column(merged_df):
     """
     This Function receives a merged df of freq files adds a Mutation field:
     Mutation - the mutation written in a formatted way :(N_ref + position + N_mut)
+    The function also accepts a freq tensor (see freq_tensor.build_freq_tensor)
     return: mut_df
     """
+    if isinstance(merged_df, dict):
+        return tensor_mutation_df(merged_df)
     # Add Mutation column
     mut_df = merged_df.copy()
-    mut_df['Full Mutation'] = mut_df['ref_base'] + mut_df['ref_pos'].astype(str) + mut_df['read_base']
+    # The bases are categorical, so cast them to strings before building the 'A1664.0G' label
+    mut_df['Full Mutation'] = mut_df['ref_base'].astype(str) + mut_df['ref_pos'].astype(str) + \
+                              mut_df['read_base'].astype(str)
     # Remove Non Mutations
     mut_df = mut_df[mut_df['read_base'] != mut_df['ref_base']]
     return mut_df
-def mut_cutoffs(mut_df,min_coverage,min_frequency):
+def mut_cutoffs(mut_df,min_coverage,min_frequency,position_mask=None):
     """
     This Function receives a mutants df, a minimum coverage value and a minimum frequency value.
-    It returns the df when it is filtered by these cutoffs
-    In addition, the function will lose mutation from known problematic regions or primer region.
+    It returns a sorted list of the mutations that met these cutoffs in at least one of the passages.
+    In addition, the function will lose mutation from known problematic regions or primer region
+    (listed in MS2_masked_regions.bed, or given as a position mask - see mutation_cutoffs.load_position_mask).
+    The function also accepts a freq tensor (see freq_tensor.build_freq_tensor)
     """
-    filtered_mut_df = mut_df.copy()
     # Lose problematic lines (Primers and Region of known sequencing error)
-    primers = list(range(1, 20)) + list(range(1291, 1304)) + list(range(1179, 1200)) + list(range(2270, 2288)) + \
-              list(range(2167, 2188)) + list(range(3548, 3570))
-    problematic = [17, 18, 19, 20, 21, 22, 23, 183, 188, 189, 190, 196, 274, 317, 364, 452, 762, 2719, 3117, 3133, 3139,
-                   3143, 3146, 3150, 3401, 3539, 3542, 3547]
-    remove_list = primers + problematic
-    filtered_mut_df = filtered_mut_df[~filtered_mut_df['ref_pos'].isin(remove_list)]
+    if position_mask is None:
+        position_mask = load_position_mask()
+    if isinstance(mut_df, dict):
+        return tensor_mut_cutoffs(mut_df, min_coverage, min_frequency, np.flatnonzero(position_mask))
     # Lose only the mutations that has not met the cutoffs in any of the passages.
-    filtered_mut_df = filtered_mut_df[filtered_mut_df['base_count'] >= min_coverage]
-    filtered_mut_df = filtered_mut_df[filtered_mut_df['frequency'] >= min_frequency]
-    relevant_mutations = filtered_mut_df['Full Mutation'].tolist()
-    relevant_mutations = list(set(relevant_mutations))
-    relevant_mutations.sort()
-    return relevant_mutations
+    return apply_cutoffs(mut_df, min_coverage, min_frequency, position_mask)[0]
 def get_color_for_new_mutation(mutation):
     possible_colors = list(mcolors.CSS4_COLORS.keys())
     relevant_colors = [x for x in possible_colors if x not in COLORS.items()]
     picked_color = random.choice(relevant_colors)
     relevant_mut_colors[mutation]=picked_color
     return picked_color
-def create_per_line_figure(df, mutation_lst, output_path):
+def get_mutation_rows(df, mutation_lst):
+    """
+    This function lets the figure functions draw from a freq tensor as well as from a df:
+    a tensor is turned into the long form df of the given mutations only.
+    """
+    if isinstance(df, dict):
+        return tensor_mutation_df(df, mutation_lst)
+    return df
+def save_figure(fig, output_path, dpi=None, fmt=None, show=True):
+    """
+    This function saves a figure to output_path (adding the extension of fmt, e.g. 'png', 'pdf' or 'svg')
+    and presents it. With show=False the figure is closed instead, so batch runs are never blocked.
+    return: the path the figure was saved to
+    """
+    if fmt is not None:
+        output_path = output_path + '.' + fmt
+    fig.savefig(output_path, dpi=dpi, format=fmt)
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+    return output_path
+def get_trajectory_index(df, mutation_lst, trajectory_index=None):
     """
-    This function gets a df of freq files, a list of mutations and a path to save graph to.
+    This function returns the trajectory index the figure functions draw from:
+    the given one, or a new one built from the df (or freq tensor) and the list of mutations.
+    Building the index once and passing it to every figure saves sorting the data again per figure.
     """
+    if trajectory_index is None:
+        trajectory_index = build_trajectory_index(get_mutation_rows(df, mutation_lst), mutation_lst)
+    return trajectory_index
+def create_per_line_figure(df, mutation_lst, output_path, trajectory_index=None, dpi=800, fmt=None, show=True):
+    """
+    This function gets a df of freq files (or a freq tensor), a list of mutations and a path to save graph to.
+    A trajectory index (see trajectory_index.build_trajectory_index) can be given instead of building a new one.
+    dpi, fmt and show are passed to save_figure.
+    """
+    trajectory_index = get_trajectory_index(df, mutation_lst, trajectory_index)
     # Create a list of the different experiments
-    experiments = list(set(df['Experiment']))
-    experiments.sort()
+    experiments = trajectory_index['experiments']
     # Create a dictionary to store unique labels and their corresponding colors
     legend_elements = {}
     # Create ggplot alike plot
@@ -84,10 +141,9 @@ def create_per_line_figure(df, mutation_lst, output_path):
     axes = axes.flatten()
     # Adding the different graphs looping over experiments
     for experiment, ax in zip(experiments, axes):
-        df_exp = df[df['Experiment'] == experiment].copy()
-        df_exp = df_exp.sort_values('Passage')
         for m in mutation_lst:
-            df_exp_mutation = df_exp[df_exp['Full Mutation'] == m].sort_values('Passage').copy()
+            # The trajectory is already sorted by passage
+            df_exp_mutation = get_trajectory(trajectory_index, experiment, m)
             # Adding a unique color to the mutation according to a pre-made dictionary - 'COLORS'
             if m in COLORS:
                 ax.plot('Passage', 'frequency', data=df_exp_mutation, linestyle='-', marker='.', label=m, color=relevant_mut_colors[m])
@@ -101,165 +157,269 @@ def create_per_line_figure(df, mutation_lst, output_path):
         ax.set_title(experiment, fontsize='large')
         ax.set_xlabel('Passage', fontsize='small', color='black')
         ax.set_ylim(0, 1)
-    # Cover the bottom left and bottom center subplots with a white rectangle
-    axes[-2].axis('off')
-    axes[-1].axis('off')
-    # Making sure the y-axis presented only once
-    axes[3].set_ylabel('Frequency', fontsize='small', color='black')
+    # Hide the subplots left without an experiment
+    for ax in axes[len(experiments):]:
+        ax.axis('off')
+    # Making sure the y-axis presented only once (on the middle row)
+    axes[3 * ((len(axes) // 3 - 1) // 2)].set_ylabel('Frequency', fontsize='small', color='black')
     # Create custom legend elements using Line2D
     custom_lines = [Line2D([0], [0], color=color, lw=2) for label, color in legend_elements.items()]
     # Add the custom legend to the figure
     fig.legend(custom_lines, legend_elements.keys(), loc='lower right', ncol=4, fontsize='large')
     # Saving and presenting the graph
-    plt.savefig(output_path, dpi=800)
-    plt.show()
+    save_figure(fig, output_path, dpi, fmt, show)
     return
-def create_per_mutation_figure(df, mutations_list, output_path):
+def get_per_mutation_pages(df, mutations_list, trajectory_index=None, trajectory_table=None):
     """
-    This function gets a df of freq files, a list of mutations and a path to save graph to.
+    This function gets a df of freq files (or a freq tensor) and a list of mutations and returns the pages
+    of the per mutation figure: a list of sublists of up to 9 mutations, each found in more than one passage.
+    When a trajectory table (see trajectory_stats.compute_trajectory_table) is given, it is queried instead.
     """
     # Filter the mutations_list to only include mutations that appear in more than one passage
-    mutations_list = [m for m in mutations_list if df[df['Full Mutation'] == m]['Passage'].nunique() > 1]
-    num_of_pages = math.ceil(len(mutations_list) / 9)
+    if trajectory_table is not None:
+        passage_counts = set(select_mutations(trajectory_table, 'mutation_passages > 1'))
+        mutations_list = [m for m in mutations_list if m in passage_counts]
+    else:
+        trajectory_index = get_trajectory_index(df, mutations_list, trajectory_index)
+        passage_counts = count_passages(trajectory_index)
+        mutations_list = [m for m in mutations_list if passage_counts.get(m, 0) > 1]
     # Divide the mutation into sublists of 9 graphs a page
     n = len(mutations_list)
     sublists = []
     for i in range(0, n, 9):
         sublist = mutations_list[i:i + 9]
         sublists.append(sublist)
-    for page in range(num_of_pages):
-        plt.style.use('ggplot')
-        # Create a subplot for each mutation
-        fig, axes = plt.subplots(nrows=3, ncols=3, figsize=(20, 10))
-        axes = np.array(axes).flatten()  # Flatten the axes array
-        # If there's only one mutation, axes will not be an array, so I convert it to an array
-        if len(sublists[page]) == 1:
-            axes = [axes]
-        for mutation, ax in zip(sublists[page], axes):
-            # Filter the DataFrame for rows where 'Full Mutation' is equal to the mutation and create a copy
-            df_mutation = df[df['Full Mutation'] == mutation].reset_index(drop=True)
-            # Create a line plot for each unique combination of 'Line', 'MOI', and 'Done_by'
-            sns.lineplot(x='Passage', y='frequency', hue='Experiment', ax=ax, data=df_mutation)
-            # Set the title of the subplot to the mutation
-            ax.set_title(mutation)
-            # Set the y-limit to [0, 1]
-            ax.set_ylim(0, 1)
-            # Set x-axis to only contain integers
-            ax.xaxis.set_major_locator(ticker.MaxNLocator(integer=True))
-            # Set legend font size
-            ax.legend(fontsize='small')
-        plt.tight_layout()
-        # Save the figure with a lower dpi
-        plt.savefig(output_path+"_"+str(page), dpi=800)
-        # Show the figure
-        plt.show()
+    return sublists
+def create_per_mutation_page(trajectory_index, page_mutations, output_path, dpi=800, fmt=None, show=True):
+    """
+    This function gets a trajectory index, the (up to 9) mutations of a page and a path to save the page to.
+    """
+    plt.style.use('ggplot')
+    # Create a subplot for each mutation
+    fig, axes = plt.subplots(nrows=3, ncols=3, figsize=(20, 10))
+    axes = np.array(axes).flatten()  # Flatten the axes array
+    for mutation, ax in zip(page_mutations, axes):
+        # Take the rows of the mutation from the trajectory index
+        df_mutation = get_mutation_trajectories(trajectory_index, mutation).reset_index(drop=True)
+        # Create a line plot for each unique combination of 'Line', 'MOI', and 'Done_by'
+        sns.lineplot(x='Passage', y='frequency', hue='Experiment', ax=ax, data=df_mutation,
+                     hue_order=list(df_mutation['Experiment'].unique()))
+        # Set the title of the subplot to the mutation
+        ax.set_title(mutation)
+        # Set the y-limit to [0, 1]
+        ax.set_ylim(0, 1)
+        # Set x-axis to only contain integers
+        ax.xaxis.set_major_locator(ticker.MaxNLocator(integer=True))
+        # Set legend font size
+        ax.legend(fontsize='small')
+    plt.tight_layout()
+    # Save and show the figure
+    return save_figure(fig, output_path, dpi, fmt, show)
+def create_per_mutation_figure(df, mutations_list, output_path, trajectory_index=None, dpi=800, fmt=None, show=True,
+                               trajectory_table=None):
+    """
+    This function gets a df of freq files (or a freq tensor), a list of mutations and a path to save graph to.
+    A trajectory index (see trajectory_index.build_trajectory_index) can be given instead of building a new one,
+    and a trajectory table (see trajectory_stats.compute_trajectory_table) to select the mutations with.
+    dpi, fmt and show are passed to save_figure.
+    """
+    trajectory_index = get_trajectory_index(df, mutations_list, trajectory_index)
+    sublists = get_per_mutation_pages(df, mutations_list, trajectory_index, trajectory_table)
+    for page in range(len(sublists)):
+        create_per_mutation_page(trajectory_index, sublists[page], output_path+"_"+str(page), dpi, fmt, show)
     return
-def create_heatmap_figure(df, mutation_lst, output_path):
-    # Filter the dataframe
-    #mutatin lsr
-    df = df[(df['Passage'] == 0) & (df['Full Mutation'].isin(mutation_lst))]
-    # Pivot the dataframe
-    df_pivot = df.pivot(index='Experiment', columns='Full Mutation', values='frequency')
-    # Create the heatmap
-    plt.figure(figsize=(15, 12))
-    sns.heatmap(df_pivot, cmap=sns.cubehelix_palette(as_cmap=True), vmin=0, vmax=0.1)
+def create_heatmap_figure(df, mutation_lst, output_path, trajectory_index=None, dpi=None, fmt=None, show=True,
+                          passages=(0,), cluster=False, layout='grid'):
+    # passages - the passages to draw (None draws all of them), cluster - order the experiments and mutations
+    # by a hierarchical clustering, layout - 'grid' draws every passage in one figure, 'separate' one figure each
+    # The trajectory index only holds the rows of the mutations in mutation_lst
+    trajectory_index = get_trajectory_index(df, mutation_lst, trajectory_index)
+    # The matrices of all the passages are built once per trajectory index (see heatmaps.py)
+    matrices = get_heatmap_matrices(trajectory_index)
+    passages = get_heatmap_passages(matrices, passages)
+    experiment_order, mutation_order = cluster_heatmap(matrices) if cluster else (None, None)
+    if layout == 'separate':
+        for passage in passages:
+            create_passage_heatmap_figure(matrices, passage, output_path + '_P' + str(passage), cluster, dpi, fmt, show)
+        return
+    # Create the heatmaps in a grid
+    n_columns = max(math.ceil(math.sqrt(len(passages))), 1)
+    n_rows = max(math.ceil(len(passages) / n_columns), 1)
+    fig, axes = plt.subplots(n_rows, n_columns, figsize=(15 * n_columns, 12 * n_rows), squeeze=False)
+    for ax, passage in zip(axes.flat, passages):
+        title = 'Passage {}'.format(passage) if len(passages) > 1 else None
+        draw_heatmap(ax, get_passage_matrix(matrices, passage, experiment_order, mutation_order), title)
+    for ax in axes.flat[len(passages):]:
+        ax.axis('off')
     # Save and show the figure
-    plt.savefig(output_path)
-    plt.show()
+    save_figure(fig, output_path, dpi, fmt, show)
     return
-def create_genome_map_figure(df, mutation_lst, expe_col, output_path):
-    # Filter the dataframe
-    df = df[df['Full Mutation'].isin(mutation_lst)]
+def create_passage_heatmap_figure(matrices, passage, output_path, cluster=False, dpi=None, fmt=None, show=True):
+    # The heatmap of one passage in a figure of its own (the 'separate' layout of create_heatmap_figure)
+    # matrices - heatmap matrices holding the passage (see heatmaps.build_heatmap_matrices and select_passages)
+    experiment_order, mutation_order = cluster_heatmap(matrices) if cluster else (None, None)
+    fig = plt.figure(figsize=(15, 12))
+    draw_heatmap(fig.gca(), get_passage_matrix(matrices, passage, experiment_order, mutation_order),
+                 'Passage {}'.format(passage))
+    # Save and show the figure
+    save_figure(fig, output_path, dpi, fmt, show)
+    return
+def create_convergence_figure(convergence_index, output_path, passage=None, min_experiments=2,
+                              max_sets=MAX_UPSET_SETS, exp_col=None, dpi=800, fmt=None, show=True):
+    # UpSet plot of the experiment sets the mutations were found in (see convergence.build_convergence_index)
+    # passage - draw the mutations of one passage (None counts every passage-qualified mutation)
+    set_bits, set_counts = get_intersections(convergence_index, passage, min_experiments, max_sets)
+    fig = plt.figure(figsize=(max(8, 0.4 * len(set_counts) + 4), 8))
+    draw_upset(fig, convergence_index, set_bits, set_counts, passage, exp_col)
+    # Save and show the figure
+    save_figure(fig, output_path, dpi, fmt, show)
+    return
+def create_genome_map_figure(df, mutation_lst, expe_col, output_path, trajectory_index=None, dpi=800, fmt=None,
+                             show=True, annotation=None, raster=None, raster_threshold=RASTER_POINT_THRESHOLD):
+    # raster - draw the points as one binned image (True), as markers (False) or choose by the number of points (None)
+    # The trajectory index only holds the rows of the mutations in mutation_lst
+    trajectory_index = get_trajectory_index(df, mutation_lst, trajectory_index)
+    df = trajectory_index['df']
+    # The genes are taken from the genome annotation (default: MS2, see genome_annotation.py)
+    if annotation is None:
+        annotation = load_annotation()
     # Group the dataframe and take the maximum frequency for each group
     df_grouped = df.groupby(['Experiment', 'ref_pos'])['frequency'].max().reset_index()
     # Create a list of unique colors for each experiment
     unique_experiments = df_grouped['Experiment'].unique()
     # Create the scatter plot
     fig, ax = plt.subplots(figsize=(15, 4))
-    # Define the x-axis ranges for the different genes
-    gene_ranges = [(1, 1311), (1311, 1727), (1678, 1905), (1761, 3650)]
-    # Define the colors for the different genes
-    gene_colors = ['lightsteelblue', 'darkorchid', 'royalblue', 'mediumaquamarine']
-    # Define the labels for the different genes
-    gene_labels = ['mat', 'cp', 'lys', 'rep']
+    # Define the colors for the different genes (genes of other genomes get the default color cycle)
+    gene_colors = {'mat': 'lightsteelblue', 'cp': 'darkorchid', 'lys': 'royalblue', 'rep': 'mediumaquamarine'}
     # Fill the background colors for the different genes and create custom legend handles
     gene_legend_handles = []
-    for gene_range, gene_color, gene_label in zip(gene_ranges, gene_colors, gene_labels):
-        ax.axvspan(gene_range[0], gene_range[1], facecolor=gene_color, alpha=0.2)
-        gene_legend_handles.append(Patch(facecolor=gene_color, alpha=0.2, label=gene_label))
-    for experiment in unique_experiments:
-        df_experiment = df_grouped[df_grouped['Experiment'] == experiment]
-        ax.scatter(df_experiment['ref_pos'], df_experiment['frequency'], color=expe_col[experiment], label=experiment)
-    ax.set_xlim(1, 3650)
+    for i, gene in enumerate(annotation['genes'].itertuples()):
+        gene_color = gene_colors.get(gene.gene, 'C{}'.format(i))
+        ax.axvspan(gene.start, gene.end, facecolor=gene_color, alpha=0.2)
+        gene_legend_handles.append(Patch(facecolor=gene_color, alpha=0.2, label=gene.gene))
+    if use_raster(len(df_grouped), raster, raster_threshold):
+        # Bin the points into a single image, so the figure has the same size however many points there are
+        extent = (1, len(annotation['sequence']), 0, max(df_grouped['frequency'].max() * 1.05, 0.01))
+        # Every bin takes the color of the experiment with the most points in it
+        codes, palette = get_experiment_palette(df_grouped['Experiment'].to_numpy(), expe_col)
+        draw_raster(ax, df_grouped['ref_pos'].to_numpy(), df_grouped['frequency'].to_numpy(), codes, palette, extent)
+    else:
+        for experiment in unique_experiments:
+            df_experiment = df_grouped[df_grouped['Experiment'] == experiment]
+            ax.scatter(df_experiment['ref_pos'], df_experiment['frequency'], color=expe_col[experiment],
+                       label=experiment)
+    ax.set_xlim(1, len(annotation['sequence']))
     ax.set_xlabel('ref_pos')
     ax.set_ylabel('frequency')
     ax.set_title('Genome Map')
     # Create a legend for the experiments on the left side
-    experiment_legend_handles = [Patch(facecolor=exp_col[experiment], label=experiment) for experiment in unique_experiments]
+    experiment_legend_handles = [Patch(facecolor=expe_col[experiment], label=experiment) for experiment in unique_experiments]
     legend1 = ax.legend(handles=experiment_legend_handles, title='Experiment', loc='center left', bbox_to_anchor=(-0.17, 0.5))
     # Create a legend for the background colors on the right side
     legend2 = ax.legend(handles=gene_legend_handles, title='Genes', loc='center left', bbox_to_anchor=(1.01, 0.5))
     # Add both legends to the plot
     ax.add_artist(legend1)
     ax.add_artist(legend2)
-    # Save the figure
-    plt.savefig(output_path, dpi=800)
-    # Show the figure
-    plt.show()
+    # Save and show the figure
+    save_figure(fig, output_path, dpi, fmt, show)
     return
 
 
 ## Constants and Parameters
-carmel_path = "/Users/adibnzv/Desktop/DESKTOP/SCHOOL/PhD/Year 1/Semester 2/Python for Biologists/Final Project/PythonCourse_Final_Project/DATA/Carmel/Carmel1.csv"
-shir_path = "/Users/adibnzv/Desktop/DESKTOP/SCHOOL/PhD/Year 1/Semester 2/Python for Biologists/Final Project/PythonCourse_Final_Project/DATA/Shir/Shir1.csv"
-export_path = "/Users/adibnzv/Desktop/DESKTOP/SCHOOL/PhD/Year 1/Semester 2/Python for Biologists/Final Project/PythonCourse_Final_Project/Export/"
+# The paths are relative to the project folder (for a configurable run with cached stages see pipeline.py)
+project_path = os.path.dirname(os.path.abspath(__file__))
+data_root = os.path.join(project_path, 'DATA')
+cache_path = os.path.join(project_path, '.freq_cache')
+# Sample sheet with the Passage, Line, MOI and Done_by of the samples (None reads them from the sample names)
+sample_sheet = DEFAULT_SAMPLE_SHEET
+export_path = os.path.join(project_path, 'Export') + os.sep
 min_freq = 0.05
 min_cov = 100
 relevant_mut_colors = COLORS
+# Call the mutations with a binomial test against the error rates of passage 0 instead of using the cutoffs
+variant_calling = False
+alpha = 0.01
+# Render all the figures in parallel with the Agg backend (saved to the Export folder, nothing is shown)
+batch_render = False
+# Record the time, CPU time, memory and rows of every step and figure (saved to Export/profile.json)
+profile_run = False
+# Steps to also run under cProfile, e.g. ['arrange_freq_df'] (saved as Export/<step>.prof)
+cprofile_steps = []
 
 ## Main Code
-# Load the initial freq.csv files into a pandas df
-df_carmel = pd.read_csv(carmel_path)
-df_shir = pd.read_csv(shir_path)
+# The main code is guarded so the freq files can be read by a process pool (the workers re-import this file)
+if __name__ == '__main__':
+    run_profile = new_profile(profile_run, export_path, cprofile_steps)
+
+    # Load every freq file under the data root (one file per sample, one folder per scientist) into a single df
+    # Files that were parsed in a previous run are memory-mapped from the cache folder instead of being parsed again
+    freq_df = profile_stage(run_profile, 'load_freq_files', load_freq_files_cached, find_freq_files(data_root),
+                            cache_path)
+
+    # Fix the sample names, add the sample columns (Passage, Line, MOI) and an Experiment column
+    joined_freq = profile_stage(run_profile, 'arrange_freq_df', arrange_freq_df, freq_df,
+                                sample_sheet)
+
+    # Arrange the freq files as (sample x position x base) arrays
+    freq_tensor = profile_stage(run_profile, 'build_freq_tensor', build_freq_tensor, joined_freq)
+
+    # Add a Mutation column (lines where base_count is zero are left out)
+    Mutation_df = profile_stage(run_profile, 'get_mut_column', get_mut_column, freq_tensor)
+    # add the gene, codon position, amino acid change and effect (synonymous / nonsynonymous) of every mutation
+    Mutation_df = profile_stage(run_profile, 'annotate_mutations', annotate_mutations, Mutation_df)
 
-# Fix Shir's 'File' column to match Carmel's
-# Remove the hyphen after the number
-df_shir['File'] = df_shir['File'].str.replace('-', '', n=1)
-# Insert "_moi10_" after the capitalized letter
-df_shir['File'] = df_shir['File'].str.replace('([A-Z])', r'\1_moi10_', n=1)
+    # create a list of mutation that met the cutoffs (can be found in the parameters section)
+    mut_lst = profile_stage(run_profile, 'mut_cutoffs', mut_cutoffs, freq_tensor, min_cov, min_freq)
+    if variant_calling:
+        # Or a list of the mutations that are significantly above the error rate of passage 0
+        error_model = profile_stage(run_profile, 'build_error_model', build_error_model, joined_freq)
+        called_df = profile_stage(run_profile, 'call_variants', call_variants, joined_freq, error_model, alpha=alpha)
+        mut_lst = get_called_mutations(called_df)
 
-# Clean up the freq files and add relevant data
-df_arr_carmel = df_cleanup(df_carmel, "Carmel")
-df_arr_shir = df_cleanup(df_shir, "Shir")
+    # create a dictionary to color-code the different experiments
+    exp_col = {'Carmel-1-A': 'brown', 'Carmel-1-B': 'rosybrown', 'Carmel-10-A': 'darkgreen',
+               'Carmel-10-B': 'seagreen', 'Shir-10-A': 'silver',
+               'Shir-10-B': 'gray', 'Shir-10-C': 'black'}
 
-# Create a Joined Freq File and remove lines where base_count is zero
-joined_freq = pd.concat([df_arr_carmel, df_arr_shir])
-joined_freq = joined_freq[joined_freq['base_count'] != 0].reset_index(drop=True)
+    # Sort the rows of the relevant mutations once for all the figures
+    traj_index = profile_stage(run_profile, 'build_trajectory_index', build_trajectory_index, Mutation_df, mut_lst)
 
-# Create Uniq Identifier for each Experiment
-joined_freq['Experiment'] = joined_freq['Done_by'] + "-" + \
-                            joined_freq['MOI'].astype(str) + "-" \
-                            + joined_freq['Line'].astype(str)
+    # Summarize the trajectory of every relevant mutation in every experiment (first passage, max frequency, slope...)
+    traj_table = profile_stage(run_profile, 'compute_trajectory_table', compute_trajectory_table, Mutation_df, min_freq,
+                               mutation_lst=mut_lst)
 
-# Add a Mutation column
-Mutation_df = get_mut_column(joined_freq)
+    # Index the experiments every mutation met the cutoffs in at every passage, to find the convergent mutations
+    conv_index = profile_stage(run_profile, 'build_convergence_index', build_convergence_index, freq_tensor, min_cov,
+                               min_freq, mutation_lst=mut_lst)
+    # e.g. the mutations of all the MOI-10 lines and no MOI-1 line
+    conv_table = get_convergence_table(conv_index, find_convergent(conv_index, get_experiment_mask(conv_index, MOI=10),
+                                                                   get_experiment_mask(conv_index, MOI=1)))
 
-# create a list of mutation that met the cutoffs (can be found in the parameters section)
-mut_lst = mut_cutoffs(Mutation_df,min_cov,min_freq)
+    if batch_render:
+        # Render every figure (and every page of the per mutation figure) in a process pool
+        from figure_rendering import make_render_jobs, render_figures
+        render_jobs = make_render_jobs(traj_index, mut_lst, exp_col, export_path, convergence_index=conv_index)
+        profile_stage(run_profile, 'render_figures', render_figures, render_jobs, profile=run_profile)
+    else:
+        # Create Graph per Line and save them to the Export folder:
+        #profile_stage(run_profile, 'per_line_figure', create_per_line_figure, Mutation_df, mut_lst, export_path + 'Figure1',
+        #              traj_index)
 
-# create a dictionary to color-code the different experiments
-exp_col = {'Carmel-1-A': 'brown', 'Carmel-1-B': 'rosybrown', 'Carmel-10-A': 'darkgreen',
-           'Carmel-10-B': 'seagreen', 'Shir-10-A': 'silver',
-           'Shir-10-B': 'gray', 'Shir-10-C': 'black'}
+        # Create Graph per Mutation and save them to the Export folder:
+        #profile_stage(run_profile, 'per_mutation_figure', create_per_mutation_figure, Mutation_df, mut_lst,
+        #              export_path + 'Figure2', traj_index, trajectory_table=traj_table)
 
-# Create Graph per Line and save them to the Export folder:
-#create_per_line_figure(Mutation_df, mut_lst, export_path + 'Figure1')
+        # Create Heatmap for passage 0
+        profile_stage(run_profile, 'heatmap_figure', create_heatmap_figure, Mutation_df, mut_lst, export_path + 'Figure3',
+                      traj_index)
 
-# Create Graph per Mutation and save them to the Export folder:
-#create_per_mutation_figure(Mutation_df, mut_lst, export_path + 'Figure2')
+        # Create a graph of position of mutation along the genome of MS2
+        #profile_stage(run_profile, 'genome_map_figure', create_genome_map_figure, Mutation_df, mut_lst, exp_col,
+        #              export_path + 'Figure4', traj_index)
 
-# Create Heatmap for passage 0
-create_heatmap_figure(Mutation_df, mut_lst, export_path + 'Figure3')
+        # Create an UpSet plot of the mutations shared by experiments
+        #profile_stage(run_profile, 'convergence_figure', create_convergence_figure, conv_index, export_path + 'Figure5',
+        #              exp_col=exp_col)
 
-# Create a graph of position of mutation along the genome of MS2
-#create_genome_map_figure(Mutation_df, mut_lst,exp_col, export_path + 'Figure4')
\ No newline at end of file
+    if profile_run:
+        write_profile_report(run_profile, export_path + 'profile.json')
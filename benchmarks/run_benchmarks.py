@@ -0,0 +1,165 @@
+## Libraries
+import os
+import re
+import sys
+import json
+import time
+import platform
+import statistics
+import argparse
+import tempfile
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+# The benchmarks run the project's modules from the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Project_main
+from freq_loading import find_freq_files, load_freq_files
+from freq_tensor import build_freq_tensor
+from trajectory_index import build_trajectory_index
+from profiling import get_rows
+from synthetic_freqs import generate_freq_files
+
+## Constants
+# Timings only compare on the machine they were taken on, so every machine keeps its own baselines
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+# Every stage is run this many times and its median time and memory are kept
+DEFAULT_REPEATS = 3
+# Parameters of generate_freq_files for every scale (samples = lines * MOIs * passages)
+SCALES = {'small': {'n_lines': 2, 'passages': (0, 5, 10), 'mois': (1, 10), 'genome_length': 3569},
+          'medium': {'n_lines': 4, 'passages': (0, 5, 10, 15), 'mois': (1, 10), 'genome_length': 3569},
+          'large': {'n_lines': 8, 'passages': (0, 5, 10, 15, 20), 'mois': (1, 10), 'genome_length': 3569},
+          'long_genome': {'n_lines': 2, 'passages': (0, 10), 'mois': (1, 10), 'genome_length': 100000}}
+MIN_COV = 100
+MIN_FREQ = 0.05
+FIGURE_DPI = 100
+# A stage is flagged when it is this many times slower (or bigger) than its baseline
+TOLERANCE = 1.5
+# Differences below these are noise and never flagged
+MIN_SECONDS = 0.05
+MIN_PEAK_MB = 5
+
+
+## Functions
+def measure(function, *args, **kwargs):
+    """
+    This Function receives a function and its arguments, runs it and returns its result,
+    the wall time it took (seconds) and the peak memory allocated while it ran (MB, measured with tracemalloc).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, seconds, peak_mb
+def get_machine_name():
+    """
+    This Function returns a name for this machine (system, architecture, number of cores and host name),
+    used as the name of its baselines file.
+    """
+    name = '{}-{}-{}cpu-{}'.format(platform.system(), platform.machine(), os.cpu_count(), platform.node())
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+def get_baselines_path(machine=None):
+    """
+    This Function returns the path of the baselines of a machine (default: this one).
+    """
+    return os.path.join(BASELINES_DIR, '{}.json'.format(machine or get_machine_name()))
+def run_scale(scale, output_dir, figures=True, repeats=DEFAULT_REPEATS):
+    """
+    This Function receives a scale (a key of SCALES), generates its synthetic freq files in output_dir
+    and times every stage of the analysis on them (the median of repeats runs of every stage).
+    return: results - a dictionary of stage -> {'seconds', 'peak_mb', 'rows'}
+    """
+    generate_freq_files(output_dir, **SCALES[scale])
+    freq_paths = find_freq_files(output_dir)
+    results = {}
+    def run(stage, function, *args, **kwargs):
+        measures = [measure(function, *args, **kwargs) for _ in range(repeats)]
+        result = measures[-1][0]
+        seconds = statistics.median(seconds for _, seconds, _ in measures)
+        peak_mb = statistics.median(peak_mb for _, _, peak_mb in measures)
+        # Figures return their output path, which has no rows (see profiling.get_rows)
+        rows = get_rows(result) if not isinstance(result, dict) else None
+        results[stage] = {'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 2), 'rows': rows}
+        print('{:<12} {:<22} {:>9.3f}s {:>10.1f}MB  rows={}'.format(scale, stage, seconds, peak_mb, rows))
+        return result
+    freq_df = run('load_freq_files', load_freq_files, freq_paths, 1)
+    joined_freq = run('arrange_freq_df', Project_main.arrange_freq_df, freq_df)
+    nonzero_freq = joined_freq[joined_freq['base_count'] != 0].reset_index(drop=True)
+    mutation_df = run('get_mut_column', Project_main.get_mut_column, nonzero_freq)
+    freq_tensor = run('build_freq_tensor', build_freq_tensor, joined_freq)
+    run('get_mut_column_tensor', Project_main.get_mut_column, freq_tensor)
+    mut_lst = run('mut_cutoffs', Project_main.mut_cutoffs, mutation_df, MIN_COV, MIN_FREQ)
+    run('mut_cutoffs_tensor', Project_main.mut_cutoffs, freq_tensor, MIN_COV, MIN_FREQ)
+    trajectory_index = run('trajectory_index', build_trajectory_index, mutation_df, mut_lst)
+    if figures:
+        exp_col = {experiment: 'C{}'.format(i) for i, experiment in enumerate(trajectory_index['experiments'])}
+        figure_path = os.path.join(output_dir, 'figure')
+        run('per_line_figure', Project_main.create_per_line_figure, None, mut_lst, figure_path, trajectory_index,
+            dpi=FIGURE_DPI, show=False)
+        # Only the first page of the per mutation figure, so its time does not depend on the number of pages
+        pages = Project_main.get_per_mutation_pages(None, mut_lst, trajectory_index)
+        if pages:
+            run('per_mutation_page', Project_main.create_per_mutation_page, trajectory_index, pages[0], figure_path,
+                dpi=FIGURE_DPI, show=False)
+        run('heatmap_figure', Project_main.create_heatmap_figure, None, mut_lst, figure_path, trajectory_index,
+            dpi=FIGURE_DPI, show=False)
+        run('genome_map_figure', Project_main.create_genome_map_figure, None, mut_lst, exp_col, figure_path,
+            trajectory_index, dpi=FIGURE_DPI, show=False, raster=False)
+        run('genome_map_raster', Project_main.create_genome_map_figure, None, mut_lst, exp_col, figure_path,
+            trajectory_index, dpi=FIGURE_DPI, show=False, raster=True)
+    return results
+def find_regressions(results, baselines):
+    """
+    This Function receives the results of a run and the stored baselines and returns a list of messages,
+    one for every stage that got slower or bigger than its baseline by more than TOLERANCE.
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            baseline = baselines.get(scale, {}).get(stage)
+            if baseline is None:
+                continue
+            if result['seconds'] > max(baseline['seconds'] * TOLERANCE, baseline['seconds'] + MIN_SECONDS):
+                regressions.append('{} {}: {:.3f}s (baseline {:.3f}s)'.format(scale, stage, result['seconds'],
+                                                                             baseline['seconds']))
+            if result['peak_mb'] > max(baseline['peak_mb'] * TOLERANCE, baseline['peak_mb'] + MIN_PEAK_MB):
+                regressions.append('{} {}: {:.1f}MB (baseline {:.1f}MB)'.format(scale, stage, result['peak_mb'],
+                                                                               baseline['peak_mb']))
+    return regressions
+
+
+## Main Code
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time and memory-profile every stage on synthetic freq files.')
+    parser.add_argument('--scales', nargs='*', default=['small'], choices=list(SCALES))
+    parser.add_argument('--no-figures', action='store_true', help='skip the figure functions')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help='runs of every stage (the median is kept)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baselines of this machine')
+    args = parser.parse_args()
+    results = {}
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as output_dir:
+            results[scale] = run_scale(scale, output_dir, not args.no_figures, args.repeats)
+    baselines_path = get_baselines_path()
+    baselines = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines.update(results)
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(baselines_path, 'w') as f:
+            json.dump(baselines, f, indent=1)
+        print('Baselines saved to {}'.format(baselines_path))
+    elif not baselines:
+        print('No baselines for this machine yet, run again with --save-baseline to store them '
+              '({})'.format(baselines_path))
+    else:
+        regressions = find_regressions(results, baselines)
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,104 @@
+## Libraries
+import os
+import itertools
+import numpy as np
+import pandas as pd
+from freq_loading import FILE_BASES, FREQ_COLUMNS
+
+## Constants
+MS2_GENOME_LENGTH = 3569
+
+
+## Functions
+def make_reference(genome_length, rng):
+    """
+    This Function receives a genome length and a random generator and returns a random reference
+    as an array of base indexes (1-4, an index into FILE_BASES).
+    """
+    return rng.integers(1, 5, genome_length)
+def make_mutations(reference, n_mutations, rng):
+    """
+    This Function receives a reference and the number of 'real' mutations and returns their position indexes
+    and mutant base indexes (always different from the reference base).
+    """
+    positions = rng.choice(len(reference), size=min(n_mutations, len(reference)), replace=False)
+    mutant_bases = (reference[positions] - 1 + rng.integers(1, 4, len(positions))) % 4 + 1
+    return positions, mutant_bases
+def make_freq_table(reference, mutation_positions, mutation_bases, mutation_freqs, rng, mean_coverage=5000,
+                    error_rate=1e-3, insertion_rate=0.01):
+    """
+    This Function receives a reference, the 'real' mutations and their frequencies in the sample and returns
+    a synthetic freq table with the schema of the freq files in DATA/ (5 rows per position, plus a few insertions).
+    Every other base gets a random sequencing error frequency around error_rate.
+    return: freq_df
+    """
+    genome_length = len(reference)
+    coverage = rng.poisson(mean_coverage, genome_length).astype(float)
+    freqs = rng.gamma(1.0, error_rate / 4, (genome_length, len(FILE_BASES)))
+    freqs[mutation_positions, mutation_bases] += mutation_freqs
+    # The reference base takes whatever frequency is left
+    freqs[np.arange(genome_length), reference] = 0
+    freqs = np.clip(freqs, 0, 1)
+    freqs = freqs / np.maximum(freqs.sum(axis=1, keepdims=True), 1)
+    freqs[np.arange(genome_length), reference] = 1 - freqs.sum(axis=1)
+    base_count = np.round(freqs * coverage[:, np.newaxis])
+    frequency = base_count / np.maximum(coverage[:, np.newaxis], 1)
+    base_rank = np.argsort(np.argsort(-base_count, axis=1, kind='stable'), axis=1, kind='stable')
+    has_reads = base_count > 0
+    freq_df = pd.DataFrame({'ref_pos': np.repeat(np.arange(1, genome_length + 1, dtype=float), len(FILE_BASES)),
+                            'read_base': np.tile(FILE_BASES, genome_length),
+                            'ref_base': np.repeat(np.array(FILE_BASES)[reference], len(FILE_BASES)),
+                            'base_count': base_count.ravel(),
+                            'overlap_ratio': np.where(has_reads, rng.uniform(0, 1, has_reads.shape), 0).ravel(),
+                            'avg_qscore': np.where(has_reads, rng.normal(35, 2, has_reads.shape), 0).round(1).ravel(),
+                            'coverage': np.repeat(coverage, len(FILE_BASES)),
+                            'frequency': frequency.ravel(),
+                            'base_rank': base_rank.ravel().astype(float),
+                            'probability': (1 - np.exp(-base_count)).ravel()})
+    # Insertions are written after the position they follow, e.g. 18.001, with '-' as the reference base
+    insertion_positions = np.flatnonzero(rng.random(genome_length) < insertion_rate)
+    insertion_count = rng.integers(1, 50, len(insertion_positions)).astype(float)
+    insertions_df = pd.DataFrame({'ref_pos': insertion_positions + 1.001,
+                                  'read_base': np.array(FILE_BASES[1:])[rng.integers(0, 4, len(insertion_positions))],
+                                  'ref_base': '-', 'base_count': insertion_count, 'overlap_ratio': 1.0,
+                                  'avg_qscore': rng.normal(33, 2, len(insertion_positions)).round(1),
+                                  'coverage': coverage[insertion_positions],
+                                  'frequency': insertion_count / np.maximum(coverage[insertion_positions], 1),
+                                  'base_rank': 4.0, 'probability': 1 - np.exp(-insertion_count)})
+    freq_df = pd.concat([freq_df, insertions_df]).sort_values('ref_pos', kind='stable').reset_index(drop=True)
+    return freq_df[FREQ_COLUMNS]
+def make_trajectories(n_mutations, passages, rng):
+    """
+    This Function receives the number of 'real' mutations and the list of passages and returns their frequencies
+    in one line, shaped (passages, mutations): each mutation starts low and drifts up or down on a logit scale.
+    """
+    logit = rng.normal(-5, 1.5, n_mutations)
+    trajectories = []
+    for passage in passages:
+        trajectories.append(1 / (1 + np.exp(-logit)))
+        logit = logit + rng.normal(0.3, 1.0, n_mutations)
+    return np.array(trajectories)
+def generate_freq_files(output_dir, n_lines=2, passages=(0, 5, 10, 15), mois=(1, 10), genome_length=MS2_GENOME_LENGTH,
+                        n_mutations=50, mean_coverage=5000, done_by='Carmel', seed=0):
+    """
+    This Function writes a synthetic set of freq files to output_dir/<done_by>/ named like Carmel's samples
+    (e.g. p5A-moi10_parallel.tsv), one per (line, MOI, passage) - n_lines * len(mois) * len(passages) samples.
+    genome_length - 3569 for MS2, can be raised to 100kb+ to test larger genomes
+    return: the list of paths of the files written
+    """
+    rng = np.random.default_rng(seed)
+    reference = make_reference(genome_length, rng)
+    mutation_positions, mutation_bases = make_mutations(reference, n_mutations, rng)
+    sample_dir = os.path.join(output_dir, done_by)
+    os.makedirs(sample_dir, exist_ok=True)
+    freq_paths = []
+    lines = [chr(ord('A') + i) for i in range(n_lines)]
+    for line, moi in itertools.product(lines, mois):
+        trajectories = make_trajectories(len(mutation_positions), passages, rng)
+        for passage, mutation_freqs in zip(passages, trajectories):
+            freq_df = make_freq_table(reference, mutation_positions, mutation_bases, mutation_freqs, rng,
+                                      mean_coverage)
+            freq_path = os.path.join(sample_dir, 'p{}{}-moi{}_parallel.tsv'.format(passage, line, moi))
+            freq_df.to_csv(freq_path, sep='\t', index=False)
+            freq_paths.append(freq_path)
+    return freq_paths
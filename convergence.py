@@ -0,0 +1,255 @@
+## Libraries
+import numpy as np
+import pandas as pd
+from matplotlib.ticker import MaxNLocator
+from freq_tensor import get_mutation_mask, mutation_labels, mutation_ids
+from mutation_cutoffs import load_position_mask, is_masked, apply_cutoffs
+
+## Constants
+# Experiments are kept as bits of uint64 words (bit e % 64 of word e // 64 is experiment e)
+WORD_BITS = 64
+# The experiment columns queries can select by (see get_experiment_mask)
+EXPERIMENT_COLUMNS = ['Done_by', 'MOI', 'Line']
+# Number of intersections (bars) drawn in the UpSet figure
+MAX_UPSET_SETS = 30
+
+
+## Functions
+def pack_bits(bool_matrix):
+    """
+    This Function receives a boolean matrix (a row per item, a column per experiment) and returns it as bitsets:
+    a uint64 matrix with one row per item and one word per 64 experiments.
+    """
+    bool_matrix = np.atleast_2d(np.asarray(bool_matrix, dtype=bool))
+    n_words = max(1, -(-bool_matrix.shape[1] // WORD_BITS))
+    padded = np.zeros((bool_matrix.shape[0], n_words * WORD_BITS), dtype=bool)
+    padded[:, :bool_matrix.shape[1]] = bool_matrix
+    return np.packbits(padded, axis=1, bitorder='little').view('<u8').astype(np.uint64)
+def unpack_bits(bits, n_columns):
+    """
+    This Function receives bitsets (see pack_bits) and the number of experiments and returns the boolean matrix.
+    """
+    bytes_matrix = np.ascontiguousarray(np.atleast_2d(bits).astype('<u8')).view(np.uint8)
+    return np.unpackbits(bytes_matrix, axis=1, count=n_columns, bitorder='little').astype(bool)
+def count_bits(bits):
+    """
+    This Function receives bitsets and returns the number of set bits in every row (experiments per item).
+    """
+    bits = np.atleast_2d(bits)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int64)
+    # numpy < 2.0 has no popcount, the bytes are unpacked instead
+    return np.unpackbits(np.ascontiguousarray(bits).view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+def get_sample_presence(df, min_coverage, min_frequency, position_mask, mutation_lst=None):
+    """
+    This Function receives a freq tensor or a mutants df, the cutoffs and a position mask and returns
+    which mutation met the cutoffs in which sample (the same filtering as mut_cutoffs):
+    sample_experiments, sample_passages - the experiment and passage of every sample (row)
+    passed - a boolean (samples x mutations) array
+    mutations - the label of every mutation (column)
+    experiment_info - a df of the Done_by, MOI and Line of every experiment
+    """
+    if isinstance(df, dict):
+        samples = df['samples']
+        # Cells that were not read are 0 in the tensor, they must not pass a min_coverage of 0
+        passed = (df['base_count'] >= min_coverage) & (df['frequency'] >= min_frequency) & (df['base_count'] > 0)
+        passed &= get_mutation_mask(df)[np.newaxis]
+        passed[:, is_masked(df['positions'], position_mask)] = False
+        passed = passed.reshape(len(samples), -1)
+        if mutation_lst is None:
+            selected_ids = np.flatnonzero(passed.any(axis=0))
+        else:
+            selected_ids = np.unique(mutation_ids(df, mutation_lst))
+        return samples['Experiment'].to_numpy(), samples['Passage'].to_numpy(), passed[:, selected_ids], \
+               np.asarray(mutation_labels(df, selected_ids), dtype=object), get_experiment_info(samples)
+    relevant_mutations, pass_matrix = apply_cutoffs(df, min_coverage, min_frequency, position_mask)
+    if mutation_lst is not None:
+        pass_matrix = pass_matrix.loc[:, pass_matrix.columns.isin(mutation_lst)]
+    return pass_matrix.index.get_level_values('Experiment').to_numpy(), \
+           pass_matrix.index.get_level_values('Passage').to_numpy(), pass_matrix.to_numpy(), \
+           pass_matrix.columns.to_numpy(dtype=object), get_experiment_info(df)
+def get_experiment_info(df):
+    """
+    This Function receives a df with an 'Experiment' column and returns a df (indexed by Experiment)
+    of the experiment columns it has (Done_by, MOI, Line).
+    """
+    columns = [column for column in EXPERIMENT_COLUMNS if column in df.columns]
+    experiment_info = df[['Experiment'] + columns].drop_duplicates('Experiment')
+    experiment_info = experiment_info.astype({'Experiment': str}).set_index('Experiment')
+    return experiment_info.astype({column: str for column in columns if column != 'MOI'})
+def build_convergence_index(df, min_coverage, min_frequency, position_mask=None, mutation_lst=None):
+    """
+    This Function receives a freq tensor (or a mutants df), a minimum coverage value and a minimum frequency value
+    (and optionally a position mask and a list of mutations to keep, e.g. the called mutations) and returns the
+    convergence index: for every passage-qualified mutation (a mutation at a passage) the bitset of the experiments
+    it met the cutoffs in. The bitsets are built from the (sample, mutation) pairs that passed, with one
+    bitwise_or per pair, so the index never holds a dense passages x experiments x mutations array.
+    return: convergence_index - a dictionary of:
+            experiments, experiment_info, passages, mutations - the experiments, passages and mutation labels
+            key_passage, key_mutation - the passage code and mutation code of every key (sorted by both)
+            bits - a (keys x words) uint64 array, the experiments every key was found in
+            sampled - a (passages x words) uint64 array, the experiments that have a sample of every passage
+    """
+    if position_mask is None:
+        position_mask = load_position_mask()
+    sample_experiments, sample_passages, passed, mutations, experiment_info = \
+        get_sample_presence(df, min_coverage, min_frequency, position_mask, mutation_lst)
+    experiment_codes, experiments = pd.factorize(np.asarray(sample_experiments).astype(str), sort=True)
+    passage_codes, passages = pd.factorize(np.asarray(sample_passages), sort=True)
+    n_words = max(1, -(-len(experiments) // WORD_BITS))
+    experiment_bits = np.left_shift(np.uint64(1), (experiment_codes % WORD_BITS).astype(np.uint64))
+    # Number every (passage, mutation) pair that passed in at least one sample
+    sample_idx, mutation_idx = np.nonzero(passed)
+    keys, key_codes = np.unique(passage_codes[sample_idx] * passed.shape[1] + mutation_idx, return_inverse=True)
+    bits = np.zeros((len(keys), n_words), dtype=np.uint64)
+    np.bitwise_or.at(bits, (key_codes.reshape(-1), experiment_codes[sample_idx] // WORD_BITS),
+                     experiment_bits[sample_idx])
+    sampled = np.zeros((len(passages), n_words), dtype=np.uint64)
+    np.bitwise_or.at(sampled, (passage_codes, experiment_codes // WORD_BITS), experiment_bits)
+    key_passage, key_mutation = np.divmod(keys, passed.shape[1])
+    return {'experiments': np.asarray(experiments, dtype=object),
+            'experiment_info': experiment_info.reindex(np.asarray(experiments)),
+            'passages': np.asarray(passages), 'mutations': mutations, 'key_passage': key_passage,
+            'key_mutation': key_mutation, 'bits': bits, 'sampled': sampled}
+def get_experiment_mask(convergence_index, experiments=None, **values):
+    """
+    This Function receives a convergence index and either a list of experiments or experiment column values
+    (e.g. MOI=10 or Done_by='Shir', a list of values for any of them) and returns the bitset of the experiments.
+    """
+    experiment_info = convergence_index['experiment_info']
+    selected = np.ones(len(convergence_index['experiments']), dtype=bool)
+    if experiments is not None:
+        selected &= np.isin(convergence_index['experiments'], list(experiments))
+    for column, value in values.items():
+        value = value if isinstance(value, (list, tuple, set)) else [value]
+        selected &= experiment_info[column].isin(list(value)).to_numpy()
+    return pack_bits(selected[np.newaxis])[0]
+def get_passage_keys(convergence_index, passage=None):
+    """
+    This Function returns which keys of a convergence index are of the given passage (all of them for None).
+    """
+    if passage is None:
+        return np.ones(len(convergence_index['bits']), dtype=bool)
+    return convergence_index['passages'][convergence_index['key_passage']] == passage
+def count_experiments(convergence_index, mask=None):
+    """
+    This Function receives a convergence index and optionally an experiment bitset (see get_experiment_mask)
+    and returns the number of experiments (of the mask) every key was found in.
+    """
+    bits = convergence_index['bits']
+    return count_bits(bits if mask is None else bits & mask)
+def find_shared(convergence_index, min_experiments=2, mask=None, passage=None):
+    """
+    This Function receives a convergence index and returns which keys were found in at least min_experiments
+    experiments (of the mask, e.g. min_experiments=3 for the mutations of 3 lines or more).
+    """
+    return (count_experiments(convergence_index, mask) >= min_experiments) & get_passage_keys(convergence_index,
+                                                                                              passage)
+def find_convergent(convergence_index, include, exclude=None, passage=None):
+    """
+    This Function receives a convergence index and experiment bitsets (see get_experiment_mask) and returns
+    which keys were found in all the include experiments that have a sample of the key's passage and in none of
+    the exclude experiments - e.g. include=MOI 10 and exclude=MOI 1 for the mutations of all the MOI-10 lines
+    and no MOI-1 line.
+    """
+    bits = convergence_index['bits']
+    required = include & convergence_index['sampled'][convergence_index['key_passage']]
+    found = ((bits & required) == required).all(axis=1) & (required != 0).any(axis=1)
+    if exclude is not None:
+        found &= ~(bits & exclude).any(axis=1)
+    return found & get_passage_keys(convergence_index, passage)
+def get_jaccard_matrix(convergence_index, passage=None):
+    """
+    This Function receives a convergence index and returns a df of the Jaccard similarity of every pair of
+    experiments: the keys (of a passage, or all of them) found in both / the keys found in either
+    (NaN when neither of them has a key).
+    Every experiment is turned into a bitset over the keys, so a pair costs an AND and a popcount per word.
+    return: jaccard_df
+    """
+    experiments = convergence_index['experiments']
+    keys = unpack_bits(convergence_index['bits'], len(experiments))[get_passage_keys(convergence_index, passage)]
+    experiment_keys = pack_bits(keys.T)
+    sizes = count_bits(experiment_keys)
+    intersections = np.array([count_bits(experiment_keys & row) for row in experiment_keys]).reshape(
+        len(experiments), len(experiments))
+    unions = sizes[:, np.newaxis] + sizes[np.newaxis, :] - intersections
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jaccard = np.where(unions > 0, intersections / unions, np.nan)
+    return pd.DataFrame(jaccard, index=pd.Index(experiments, name='Experiment'), columns=experiments)
+def get_convergence_table(convergence_index, selected=None, min_experiments=2):
+    """
+    This Function receives a convergence index and optionally which keys to take (see find_shared and
+    find_convergent, default: the keys found in at least min_experiments experiments) and returns a table with
+    a row per key: Passage, Full Mutation, n_experiments, the number of experiments of every MOI,
+    first_passage (the first passage the mutation was selected at) and the experiments it was found in.
+    return: convergence_table
+    """
+    if selected is None:
+        selected = find_shared(convergence_index, min_experiments)
+    bits = convergence_index['bits'][selected]
+    experiments = convergence_index['experiments']
+    convergence_table = pd.DataFrame({
+        'Passage': convergence_index['passages'][convergence_index['key_passage'][selected]],
+        'Full Mutation': convergence_index['mutations'][convergence_index['key_mutation'][selected]],
+        'n_experiments': count_bits(bits)})
+    experiment_info = convergence_index['experiment_info']
+    if 'MOI' in experiment_info.columns:
+        for moi in sorted(experiment_info['MOI'].unique()):
+            convergence_table['n_MOI_{}'.format(moi)] = count_bits(
+                bits & get_experiment_mask(convergence_index, MOI=moi))
+    convergence_table['first_passage'] = convergence_table.groupby('Full Mutation')['Passage'].transform('min')
+    found = unpack_bits(bits, len(experiments))
+    convergence_table['Experiments'] = [';'.join(experiments[row]) for row in found]
+    return convergence_table
+def get_intersections(convergence_index, passage=None, min_experiments=2, max_sets=MAX_UPSET_SETS):
+    """
+    This Function receives a convergence index and returns the distinct experiment sets of its keys (of a passage,
+    or all of them) with at least min_experiments experiments, and the number of keys of every set,
+    the largest max_sets sets first.
+    return: set_bits, set_counts
+    """
+    bits = convergence_index['bits'][find_shared(convergence_index, min_experiments, passage=passage)]
+    if len(bits) == 0:
+        return bits, np.zeros(0, dtype=np.int64)
+    set_bits, set_counts = np.unique(bits, axis=0, return_counts=True)
+    order = np.argsort(-set_counts, kind='stable')[:max_sets]
+    return set_bits[order], set_counts[order]
+def draw_upset(fig, convergence_index, set_bits, set_counts, passage=None, exp_col=None):
+    """
+    This Function receives a matplotlib figure, a convergence index and experiment sets (see get_intersections)
+    and draws an UpSet plot on the figure: the number of keys of every set (top), the experiments of every set
+    (dots, bottom) and the number of keys of every experiment (left). Only the experiments of the sets are drawn.
+    """
+    experiments = convergence_index['experiments']
+    set_matrix = unpack_bits(set_bits, len(experiments)) if len(set_bits) else np.zeros((0, len(experiments)), bool)
+    shown = np.flatnonzero(set_matrix.any(axis=0))[::-1]
+    passage_keys = get_passage_keys(convergence_index, passage)
+    experiment_sizes = unpack_bits(convergence_index['bits'][passage_keys], len(experiments)).sum(axis=0)
+    grid = fig.add_gridspec(2, 2, width_ratios=[1, 4], height_ratios=[2, 1], wspace=0.02, hspace=0.05,
+                            right=0.8)
+    ax_sets = fig.add_subplot(grid[0, 1])
+    ax_matrix = fig.add_subplot(grid[1, 1], sharex=ax_sets)
+    ax_sizes = fig.add_subplot(grid[1, 0], sharey=ax_matrix)
+    x = np.arange(len(set_counts))
+    ax_sets.bar(x, set_counts, color='dimgray')
+    ax_sets.set_ylabel('Mutations')
+    ax_sets.yaxis.set_major_locator(MaxNLocator(integer=True))
+    ax_sets.tick_params(axis='x', labelbottom=False)
+    # A gray dot for every experiment and a black one for the experiments of the set, joined by a line
+    y = np.arange(len(shown))
+    grid_x, grid_y = np.meshgrid(x, y)
+    ax_matrix.scatter(grid_x.ravel(), grid_y.ravel(), color='lightgray', s=30)
+    for column in x:
+        members = np.flatnonzero(set_matrix[column, shown])
+        ax_matrix.plot([column] * len(members), members, color='black', marker='o', markersize=5)
+    ax_matrix.set_yticks(y)
+    ax_matrix.set_yticklabels(experiments[shown])
+    ax_matrix.tick_params(axis='y', labelleft=False, labelright=True)
+    ax_matrix.set_xticks([])
+    colors = [exp_col.get(experiment, 'dimgray') for experiment in experiments[shown]] if exp_col else 'dimgray'
+    ax_sizes.barh(y, experiment_sizes[shown], color=colors)
+    ax_sizes.invert_xaxis()
+    ax_sizes.set_xlabel('Mutations')
+    ax_sizes.tick_params(axis='y', labelleft=False)
+    title = 'Mutations shared by experiments'
+    ax_sets.set_title(title if passage is None else '{} (passage {})'.format(title, passage))
@@ -0,0 +1,149 @@
+## Libraries
+import os
+import matplotlib
+import pandas as pd
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import Project_main
+from trajectory_index import build_trajectory_index, get_mutation_trajectories
+from heatmaps import get_heatmap_matrices, get_heatmap_passages, cluster_heatmap, select_passages
+from convergence import MAX_UPSET_SETS
+from profiling import new_profile, profile_stage, get_profile_settings
+
+## Constants
+# File name and default save settings of every figure (fmt=None saves a png, like plt.savefig does)
+# raster - draw the genome map as a binned image (None switches to it above genome_raster.RASTER_POINT_THRESHOLD)
+# passages, cluster, layout - see Project_main.create_heatmap_figure (passages=None draws every passage)
+# passage, min_experiments, max_sets - see Project_main.create_convergence_figure
+FIGURE_SETTINGS = {'per_line': {'name': 'Figure1', 'dpi': 800, 'fmt': None},
+                   'per_mutation': {'name': 'Figure2', 'dpi': 800, 'fmt': None},
+                   'heatmap': {'name': 'Figure3', 'dpi': None, 'fmt': None, 'passages': [0], 'cluster': False,
+                               'layout': 'grid'},
+                   'genome_map': {'name': 'Figure4', 'dpi': 800, 'fmt': None, 'raster': None},
+                   'convergence': {'name': 'Figure5', 'dpi': 800, 'fmt': None, 'passage': None, 'min_experiments': 2,
+                                   'max_sets': MAX_UPSET_SETS}}
+
+
+## Functions
+def use_headless_backend():
+    """
+    This Function switches matplotlib to the non-interactive Agg backend, so figures are only saved to files.
+    """
+    matplotlib.use('Agg')
+def get_figure_settings(figure, figure_settings=None):
+    """
+    This Function receives a figure name (a key of FIGURE_SETTINGS) and optionally a dictionary of
+    figure -> settings to override (e.g. {'heatmap': {'dpi': 300, 'fmt': 'pdf'}}) and returns the figure's settings.
+    """
+    settings = dict(FIGURE_SETTINGS[figure])
+    if figure_settings and figure in figure_settings:
+        settings.update(figure_settings[figure])
+    return settings
+def make_render_jobs(trajectory_index, mutation_lst, exp_col, export_path, figures=None, figure_settings=None,
+                     annotation=None, convergence_index=None):
+    """
+    This Function receives a trajectory index, the list of mutations that met the cutoffs, the experiment colors,
+    the export folder and optionally the figures to render (default: all of FIGURE_SETTINGS), their settings,
+    the genome annotation of the genome map (see genome_annotation.load_annotation, default: MS2)
+    and the convergence index of the convergence figure (see convergence.build_convergence_index,
+    without it the default figures leave the convergence figure out).
+    It returns a list of render jobs - one per figure, and one per page of the per mutation figure.
+    Each page job only carries the rows of its own 9 mutations.
+    return: jobs
+    """
+    if figures is None:
+        figures = [figure for figure in FIGURE_SETTINGS if figure != 'convergence' or convergence_index is not None]
+    jobs = []
+    for figure in figures:
+        settings = get_figure_settings(figure, figure_settings)
+        output_path = os.path.join(export_path, settings['name'])
+        save_kwargs = {'dpi': settings['dpi'], 'fmt': settings['fmt'], 'show': False}
+        if figure == 'per_mutation':
+            pages = Project_main.get_per_mutation_pages(None, mutation_lst, trajectory_index)
+            for page, page_mutations in enumerate(pages):
+                page_df = pd.concat([get_mutation_trajectories(trajectory_index, m) for m in page_mutations])
+                page_index = build_trajectory_index(page_df, page_mutations)
+                jobs.append((Project_main.create_per_mutation_page,
+                             dict(trajectory_index=page_index, page_mutations=page_mutations,
+                                  output_path=output_path + "_" + str(page), **save_kwargs)))
+        elif figure == 'per_line':
+            jobs.append((Project_main.create_per_line_figure,
+                         dict(df=None, mutation_lst=mutation_lst, output_path=output_path,
+                              trajectory_index=trajectory_index, **save_kwargs)))
+        elif figure == 'heatmap':
+            # The matrices are built here once, so the jobs do not build them again
+            matrices = get_heatmap_matrices(trajectory_index)
+            if settings['cluster']:
+                cluster_heatmap(matrices)
+            # A passage that is not in the data stops here, before any figure is rendered
+            passages = get_heatmap_passages(matrices, settings['passages'])
+            if settings['layout'] == 'separate':
+                # One job per passage, carrying the matrix of its passage only
+                for passage in passages:
+                    jobs.append((Project_main.create_passage_heatmap_figure,
+                                 dict(matrices=select_passages(matrices, [passage]), passage=passage,
+                                      output_path=output_path + '_P' + str(passage), cluster=settings['cluster'],
+                                      **save_kwargs)))
+            else:
+                jobs.append((Project_main.create_heatmap_figure,
+                             dict(df=None, mutation_lst=mutation_lst, output_path=output_path,
+                                  trajectory_index=trajectory_index, passages=passages,
+                                  cluster=settings['cluster'], **save_kwargs)))
+        elif figure == 'genome_map':
+            jobs.append((Project_main.create_genome_map_figure,
+                         dict(df=None, mutation_lst=mutation_lst, expe_col=exp_col, output_path=output_path,
+                              trajectory_index=trajectory_index, annotation=annotation,
+                              raster=settings['raster'], **save_kwargs)))
+        elif figure == 'convergence':
+            if convergence_index is None:
+                raise ValueError('The convergence figure needs a convergence index')
+            jobs.append((Project_main.create_convergence_figure,
+                         dict(convergence_index=convergence_index, output_path=output_path,
+                              passage=settings['passage'], min_experiments=settings['min_experiments'],
+                              max_sets=settings['max_sets'], exp_col=exp_col, **save_kwargs)))
+        else:
+            raise ValueError('Unknown figure: {}'.format(figure))
+    return jobs
+def run_render_job(job):
+    """
+    This Function receives a render job (a figure function and its arguments) and renders it.
+    """
+    figure_function, kwargs = job
+    figure_function(**kwargs)
+    return kwargs['output_path']
+def run_profiled_render_job(job, profile_settings):
+    """
+    This Function receives a render job and the settings of a run profile (see profiling.get_profile_settings),
+    renders the job and records it (as 'figure-<file name>', with the time and memory of the process it ran in).
+    return: output_path, record
+    """
+    job_profile = new_profile(**profile_settings)
+    stage = 'figure-' + os.path.basename(job[1]['output_path'])
+    output_path = profile_stage(job_profile, stage, run_render_job, job)
+    record = job_profile['stages'][0]
+    record['part_of'] = 'figures'
+    return output_path, record
+def render_figures(jobs, processes=None, profile=None):
+    """
+    This Function receives a list of render jobs and renders them in parallel using a process pool
+    with the Agg backend (nothing is shown on screen).
+    processes - number of worker processes (None uses every core, 1 renders the jobs one after another)
+    profile - a run profile (see profiling.new_profile) to add a record of every job to
+    return: the output path of every job
+    """
+    use_headless_backend()
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    render_job = run_render_job
+    if profile is not None and profile['enabled']:
+        render_job = partial(run_profiled_render_job, profile_settings=get_profile_settings(profile))
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes, initializer=use_headless_backend) as executor:
+            results = list(executor.map(render_job, jobs))
+    else:
+        results = [render_job(job) for job in jobs]
+    if render_job is run_render_job:
+        return results
+    profile['stages'].extend(record for output_path, record in results)
+    return [output_path for output_path, record in results]
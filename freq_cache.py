@@ -0,0 +1,214 @@
+## Libraries
+import os
+import re
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from freq_loading import read_freq_file, join_freq_dfs, tag_samples, FREQ_DTYPES, INT_COLUMNS
+
+## Constants
+MANIFEST_NAME = 'manifest.json'
+COLUMNS_INFO_NAME = 'columns.json'
+HASH_CHUNK_SIZE = 1 << 20
+# Bump when read_freq_file or the way the columns are saved changes, so the old entries are parsed again
+# (the dtypes are part of the format as well, so changing FREQ_DTYPES or INT_COLUMNS does it by itself)
+CACHE_VERSION = 1
+CACHE_FORMAT = hashlib.blake2b(json.dumps([CACHE_VERSION, {column: str(dtype) for column, dtype in FREQ_DTYPES.items()},
+                                           INT_COLUMNS]).encode(), digest_size=8).hexdigest()
+LENGTHS_NAME = 'lengths.json'
+# Names of the cache entry folders (the keys) and of the joined entry folders (the files of a run joined one after
+# another), other files and folders of the cache folder are left alone
+ENTRY_NAME_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+JOINED_PREFIX = 'joined-'
+JOINED_NAME_PATTERN = re.compile(r'^joined-[0-9a-f]{32}$')
+
+
+## Functions
+def hash_file_content(path):
+    """
+    This Function receives a path of a file and returns the blake2b hash of its content (read in 1MB chunks).
+    """
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+def read_manifest(cache_dir):
+    """
+    This Function receives the cache folder and returns its manifest - a dictionary of
+    source path -> {'size', 'mtime_ns', 'content_hash', 'format', 'key'} of every freq file that was already cached.
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+def write_manifest(cache_dir, manifest):
+    """
+    This Function receives the cache folder and a manifest dictionary and saves it (through a temporary file,
+    so an interrupted run never leaves a broken manifest behind).
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+def get_cache_key(path, manifest):
+    """
+    This Function receives a path of a freq file and the cache manifest and returns the file's manifest record.
+    The cache key is built from the path, the size and the content hash of the file and the cache format
+    (CACHE_FORMAT), so entries written by an older parser are never loaded.
+    The content is only re-hashed when the size or modification time differ from the ones in the manifest.
+    return: record
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    record = manifest.get(abs_path)
+    if record is not None and record['size'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns:
+        if record.get('format') == CACHE_FORMAT:
+            return record
+        content_hash = record['content_hash']
+    else:
+        content_hash = hash_file_content(abs_path)
+    key = hashlib.blake2b('{}|{}|{}|{}'.format(abs_path, stat.st_size, content_hash, CACHE_FORMAT).encode(),
+                          digest_size=16).hexdigest()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'content_hash': content_hash, 'format': CACHE_FORMAT,
+            'key': key}
+def save_columns(entry_dir, df):
+    """
+    This Function receives a folder and a df and saves every column of the df as a separate .npy file.
+    Categorical columns are saved as their integer codes, and their categories are kept in columns.json.
+    """
+    os.makedirs(entry_dir, exist_ok=True)
+    columns_info = []
+    for column in df.columns:
+        values = df[column]
+        info = {'name': column, 'file': '{}.npy'.format(len(columns_info))}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            info['categories'] = values.cat.categories.tolist()
+            values = values.cat.codes
+        np.save(os.path.join(entry_dir, info['file']), values.to_numpy())
+        columns_info.append(info)
+    # columns.json is written last, so an entry without it is an unfinished one
+    with open(os.path.join(entry_dir, COLUMNS_INFO_NAME), 'w') as f:
+        json.dump(columns_info, f)
+def load_columns(entry_dir, mmap=True):
+    """
+    This Function receives a folder written by save_columns and returns the df saved in it.
+    With mmap=True the numeric columns are memory-mapped instead of being read into memory.
+    return: df
+    """
+    with open(os.path.join(entry_dir, COLUMNS_INFO_NAME)) as f:
+        columns_info = json.load(f)
+    columns = {}
+    for info in columns_info:
+        values = np.load(os.path.join(entry_dir, info['file']), mmap_mode='r' if mmap else None)
+        if 'categories' in info:
+            values = pd.Categorical.from_codes(values, categories=info['categories'])
+        columns[info['name']] = values
+    return pd.DataFrame(columns, copy=False)
+def is_cached(cache_dir, record):
+    """
+    This Function receives the cache folder and a manifest record and checks whether its entry was fully written.
+    """
+    return os.path.exists(os.path.join(cache_dir, record['key'], COLUMNS_INFO_NAME))
+def get_joined_key(records):
+    """
+    This Function receives the manifest records of the freq files of a run (in order) and returns the key of
+    their joined entry.
+    """
+    return hashlib.blake2b(json.dumps([record['key'] for record in records]).encode(), digest_size=16).hexdigest()
+def save_joined_columns(joined_dir, entry_dirs):
+    """
+    This Function receives a folder and the entry folders of several freq files (see save_columns) and saves their
+    columns joined one after another - one .npy file per column, filled through a memory map one file at a time,
+    so the files are never all in memory at once. Categorical columns are saved as codes of the union of their
+    categories, and the number of rows of every file is kept in lengths.json.
+    """
+    os.makedirs(joined_dir, exist_ok=True)
+    entry_dfs = [load_columns(entry_dir) for entry_dir in entry_dirs]
+    lengths = [len(entry_df) for entry_df in entry_dfs]
+    columns_info = []
+    for column in entry_dfs[0].columns:
+        info = {'name': column, 'file': '{}.npy'.format(len(columns_info))}
+        if isinstance(entry_dfs[0][column].dtype, pd.CategoricalDtype):
+            info['categories'] = list(dict.fromkeys(category for entry_df in entry_dfs
+                                                    for category in entry_df[column].cat.categories))
+            dtype = np.min_scalar_type(-max(len(info['categories']), 1))
+        else:
+            dtype = np.result_type(*[entry_df[column].dtype for entry_df in entry_dfs])
+        values = np.lib.format.open_memmap(os.path.join(joined_dir, info['file']), mode='w+', dtype=dtype,
+                                           shape=(sum(lengths),))
+        start = 0
+        for entry_df, length in zip(entry_dfs, lengths):
+            if 'categories' in info:
+                # Map the codes of the file to the codes of the union (-1, a missing value, stays -1)
+                code_map = np.array([info['categories'].index(category)
+                                     for category in entry_df[column].cat.categories] + [-1], dtype=dtype)
+                values[start:start + length] = code_map[entry_df[column].cat.codes.to_numpy()]
+            else:
+                values[start:start + length] = entry_df[column].to_numpy()
+            start += length
+        values.flush()
+        del values
+        columns_info.append(info)
+    with open(os.path.join(joined_dir, LENGTHS_NAME), 'w') as f:
+        json.dump(lengths, f)
+    # columns.json is written last, so an entry without it is an unfinished one
+    with open(os.path.join(joined_dir, COLUMNS_INFO_NAME), 'w') as f:
+        json.dump(columns_info, f)
+def prune_cache(cache_dir, manifest, joined_key=None):
+    """
+    This Function receives the cache folder, its manifest and the key of the joined entry in use and deletes
+    the entries that no manifest record points at (entries of files that changed or were deleted, or of an older
+    cache format) and the other joined entries.
+    return: the names of the deleted entries
+    """
+    keys = {record['key'] for record in manifest.values()}
+    pruned = [name for name in os.listdir(cache_dir) if os.path.isdir(os.path.join(cache_dir, name)) and
+              ((ENTRY_NAME_PATTERN.match(name) and name not in keys) or
+               (JOINED_NAME_PATTERN.match(name) and name != JOINED_PREFIX + str(joined_key)))]
+    for name in pruned:
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    return pruned
+def load_freq_files_cached(freq_paths, cache_dir, processes=None):
+    """
+    This Function receives a list of freq file paths and a cache folder and works like load_freq_files:
+    only the files that are new or were changed since the last run are parsed (in parallel) and written to the cache.
+    The columns of all the files are then joined on disk (only when a file changed) and memory-mapped from there,
+    so the numeric columns are never copied into memory.
+    Entries the manifest no longer points at are deleted, and so are the records of files that no longer exist.
+    return: joined_df
+    """
+    if not freq_paths:
+        return join_freq_dfs([], [])
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = read_manifest(cache_dir)
+    records = [get_cache_key(path, manifest) for path in freq_paths]
+    # Parse only the files that are missing from the cache
+    missing = [i for i, record in enumerate(records) if not is_cached(cache_dir, record)]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(missing))
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parsed_dfs = list(executor.map(read_freq_file, [freq_paths[i] for i in missing]))
+    else:
+        parsed_dfs = [read_freq_file(freq_paths[i]) for i in missing]
+    for i, parsed_df in zip(missing, parsed_dfs):
+        save_columns(os.path.join(cache_dir, records[i]['key']), parsed_df)
+    # Update the manifest with the records of this run and lose the records of deleted files
+    for path, record in zip(freq_paths, records):
+        manifest[os.path.abspath(path)] = record
+    manifest = {path: record for path, record in manifest.items() if os.path.exists(path)}
+    write_manifest(cache_dir, manifest)
+    joined_key = get_joined_key(records)
+    joined_dir = os.path.join(cache_dir, JOINED_PREFIX + joined_key)
+    if not os.path.exists(os.path.join(joined_dir, COLUMNS_INFO_NAME)):
+        save_joined_columns(joined_dir, [os.path.join(cache_dir, record['key']) for record in records])
+    prune_cache(cache_dir, manifest, joined_key)
+    with open(os.path.join(joined_dir, LENGTHS_NAME)) as f:
+        lengths = json.load(f)
+    return tag_samples(load_columns(joined_dir), lengths, freq_paths)
@@ -0,0 +1,102 @@
+## Libraries
+import os
+import glob
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+## Constants
+# Every base a freq file can report, '-' standing for a deletion
+BASES = ['A', 'C', 'G', 'T', '-']
+BASE_DTYPE = pd.CategoricalDtype(BASES)
+# The order a freq file lists the bases of a position in (the deletion first)
+FILE_BASES = ['-', 'A', 'C', 'G', 'T']
+# The columns of a freq file, in order
+FREQ_COLUMNS = ['ref_pos', 'read_base', 'ref_base', 'base_count', 'overlap_ratio', 'avg_qscore', 'coverage',
+                'frequency', 'base_rank', 'probability']
+# Compact dtypes used when parsing a freq file (counts are written as floats, e.g. '6.0', so they are parsed as
+# floats and cast to integers right after). ref_pos stays float64 since insertions are written as fractions of
+# the position they follow (e.g. 18.001, 18.002)
+FREQ_DTYPES = {'ref_pos': 'float64', 'read_base': BASE_DTYPE, 'ref_base': BASE_DTYPE, 'base_count': 'float32',
+               'overlap_ratio': 'float32', 'avg_qscore': 'float32', 'coverage': 'float32', 'frequency': 'float32',
+               'base_rank': 'float32', 'probability': 'float32'}
+INT_COLUMNS = ['base_count', 'coverage']
+
+
+## Functions
+def find_freq_files(data_root, pattern='*.tsv'):
+    """
+    This Function receives a data root folder (e.g. DATA/) and returns a sorted list of every freq file under it.
+    The files are expected to be saved in one sub folder per scientist, e.g. DATA/Shir/Shir0A.tsv
+    return: freq_paths
+    """
+    freq_paths = glob.glob(os.path.join(data_root, '**', pattern), recursive=True)
+    # Skip office lock files and such (e.g. '~$Shir1.xlsx')
+    freq_paths = [path for path in freq_paths if not os.path.basename(path).startswith('~$')]
+    freq_paths.sort()
+    return freq_paths
+def get_sample_id(path):
+    """
+    This Function receives a path of a freq file and returns its sample ID (the file name without extension).
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+def get_done_by(path):
+    """
+    This Function receives a path of a freq file and returns the scientist that did the experiment
+    (the name of the folder holding the file).
+    """
+    return os.path.basename(os.path.dirname(os.path.abspath(path)))
+def read_freq_file(path):
+    """
+    This Function receives a path of a single freq file (tab separated) and returns it as a df with compact dtypes:
+    float32 for the float columns, int32 for base_count and coverage and categories for the bases
+    (ref_pos is kept as float64 so insertion positions such as 18.001 stay exact).
+    return: freq_df
+    """
+    freq_df = pd.read_csv(path, sep='\t', dtype=FREQ_DTYPES)
+    for column in INT_COLUMNS:
+        if column in freq_df.columns:
+            freq_df[column] = freq_df[column].astype('int32')
+    return freq_df
+def load_freq_files(freq_paths, processes=None):
+    """
+    This Function receives a list of freq file paths and reads them in parallel using a process pool.
+    Each file is tagged with its sample ID ('File') and the scientist responsible for it ('Done_by'),
+    and all files are joined with a single concat.
+    processes - number of worker processes (None uses every core, 1 reads the files one after another)
+    return: joined_df
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(freq_paths))
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            chunksize = max(1, len(freq_paths) // (processes * 4))
+            freq_dfs = list(executor.map(read_freq_file, freq_paths, chunksize=chunksize))
+    else:
+        freq_dfs = [read_freq_file(path) for path in freq_paths]
+    return join_freq_dfs(freq_dfs, freq_paths)
+def join_freq_dfs(freq_dfs, freq_paths):
+    """
+    This Function receives a list of freq dfs and the paths they were read from and joins them into one df.
+    'File' and 'Done_by' are added as categorical columns built from per-file codes, so the tagging costs
+    one small array per file instead of one string per row.
+    return: joined_df
+    """
+    if not freq_dfs:
+        return pd.DataFrame(columns=list(FREQ_DTYPES) + ['File', 'Done_by'])
+    joined_df = pd.concat(freq_dfs, ignore_index=True)
+    return tag_samples(joined_df, [len(freq_df) for freq_df in freq_dfs], freq_paths)
+def tag_samples(joined_df, lengths, freq_paths):
+    """
+    This Function receives a df of freq files joined one after another, the number of rows of every file and the
+    paths they were read from, and adds the 'File' and 'Done_by' columns to it (see join_freq_dfs).
+    return: joined_df
+    """
+    sample_codes = np.repeat(np.arange(len(freq_paths)), lengths)
+    # Factorize the per-file tags and spread their codes over the rows of each file
+    file_codes, file_categories = pd.factorize(pd.Series([get_sample_id(path) for path in freq_paths]))
+    joined_df['File'] = pd.Categorical.from_codes(file_codes[sample_codes], categories=file_categories)
+    done_by_codes, done_by_categories = pd.factorize(pd.Series([get_done_by(path) for path in freq_paths]))
+    joined_df['Done_by'] = pd.Categorical.from_codes(done_by_codes[sample_codes], categories=done_by_categories)
+    return joined_df
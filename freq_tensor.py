@@ -0,0 +1,114 @@
+## Libraries
+import numpy as np
+import pandas as pd
+from freq_loading import BASES, BASE_DTYPE
+from sample_registry import get_sample_codes
+
+## Constants
+# Columns that describe a whole sample (the same value on every row of a freq file)
+SAMPLE_COLUMNS = ['File', 'Done_by', 'Passage', 'Line', 'MOI', 'Experiment']
+# The columns that tell the samples apart
+SAMPLE_KEYS = ['File', 'Done_by', 'Experiment']
+N_BASES = len(BASES)
+
+
+## Functions
+def get_base_codes(bases):
+    """
+    This Function receives a series of bases and returns their integer codes (the index of each base in BASES).
+    """
+    return bases.astype(BASE_DTYPE).cat.codes.to_numpy()
+def build_freq_tensor(df):
+    """
+    This Function receives a df of freq files (after df_cleanup) and returns a dictionary of dense arrays:
+    samples - a df with one row per sample (File, Done_by and Experiment) holding its sample columns
+    (Passage, Line, MOI...)
+    positions - the sorted ref_pos values (insertions such as 18.001 get a position of their own)
+    ref_base - the reference base code of each position
+    frequency, base_count - arrays shaped (samples, positions, 5 bases incl. deletion)
+    coverage - array shaped (samples, positions), since the coverage of a position is the same for all 5 bases
+    return: tensor
+    """
+    # Two scientists can use the same file name, and a stock shared by several experiments is a sample of each
+    sample_codes, sample_ids = get_sample_codes(df, [column for column in SAMPLE_KEYS if column in df.columns])
+    sample_columns = [column for column in SAMPLE_COLUMNS if column in df.columns]
+    samples = df[sample_columns].iloc[np.unique(sample_codes, return_index=True)[1]].reset_index(drop=True)
+    positions = np.unique(df['ref_pos'].to_numpy())
+    position_idx = np.searchsorted(positions, df['ref_pos'].to_numpy())
+    base_idx = get_base_codes(df['read_base'])
+    shape = (len(sample_ids), len(positions), N_BASES)
+    frequency = np.zeros(shape, dtype='float32')
+    base_count = np.zeros(shape, dtype='int32')
+    coverage = np.zeros(shape[:2], dtype='int32')
+    frequency[sample_codes, position_idx, base_idx] = df['frequency'].to_numpy()
+    base_count[sample_codes, position_idx, base_idx] = df['base_count'].to_numpy()
+    coverage[sample_codes, position_idx] = df['coverage'].to_numpy()
+    ref_base = np.zeros(len(positions), dtype='int8')
+    ref_base[position_idx] = get_base_codes(df['ref_base'])
+    return {'samples': samples, 'positions': positions, 'ref_base': ref_base,
+            'frequency': frequency, 'base_count': base_count, 'coverage': coverage}
+def get_mutation_mask(tensor):
+    """
+    This Function receives a freq tensor and returns a boolean array shaped (positions, 5 bases)
+    that is True wherever the base differs from the reference base (i.e. a mutation).
+    """
+    return np.arange(N_BASES)[np.newaxis, :] != tensor['ref_base'][:, np.newaxis]
+def mutation_labels(tensor, mutation_ids):
+    """
+    This Function receives a freq tensor and an array of mutation IDs (position index * 5 + base code)
+    and returns their labels in the 'A1664.0G' format.
+    """
+    position_idx, base_idx = np.divmod(np.asarray(mutation_ids), N_BASES)
+    bases = np.array(BASES, dtype=object)
+    return list(bases[tensor['ref_base'][position_idx]] + tensor['positions'][position_idx].astype(str).astype(object)
+                + bases[base_idx])
+def mutation_ids(tensor, labels):
+    """
+    This Function receives a freq tensor and a list of mutation labels ('A1664.0G') and returns their mutation IDs.
+    Labels of positions that are not in the tensor are dropped.
+    """
+    labels = pd.Series(list(labels), dtype=object)
+    positions = labels.str[1:-1].astype(float).to_numpy()
+    position_idx = np.searchsorted(tensor['positions'], positions).clip(max=len(tensor['positions']) - 1)
+    found = tensor['positions'][position_idx] == positions
+    base_idx = get_base_codes(labels.str[-1])
+    return (position_idx * N_BASES + base_idx)[found]
+def tensor_mut_cutoffs(tensor, min_coverage, min_frequency, remove_positions=()):
+    """
+    This Function receives a freq tensor, a minimum coverage value, a minimum frequency value and the positions to lose
+    and returns a sorted list of the mutations that met the cutoffs in at least one sample (same as mut_cutoffs).
+    """
+    # Cells that were not read are 0 in the tensor, they must not pass a min_coverage of 0
+    passed = (tensor['base_count'] >= min_coverage) & (tensor['frequency'] >= min_frequency) & \
+             (tensor['base_count'] > 0)
+    passed = passed.any(axis=0) & get_mutation_mask(tensor)
+    passed[np.isin(tensor['positions'], list(remove_positions))] = False
+    return sorted(mutation_labels(tensor, np.flatnonzero(passed)))
+def tensor_mutation_df(tensor, mutation_lst=None):
+    """
+    This Function receives a freq tensor and optionally a list of mutations and returns the long form df
+    that get_mut_column returns (one row per sample and mutation with a base_count above zero).
+    'Mutation ID' holds the integer code of each mutation and 'Full Mutation' is categorical,
+    so the label strings are only built once per mutation.
+    return: mut_df
+    """
+    if mutation_lst is None:
+        selected_ids = np.flatnonzero((tensor['base_count'] > 0).any(axis=0) & get_mutation_mask(tensor))
+    else:
+        selected_ids = np.unique(mutation_ids(tensor, mutation_lst))
+    position_idx, base_idx = np.divmod(selected_ids, N_BASES)
+    base_count = tensor['base_count'][:, position_idx, base_idx]
+    # Keep only the (sample, mutation) pairs that were actually read
+    sample_idx, selected_idx = np.nonzero(base_count)
+    position_idx, base_idx = position_idx[selected_idx], base_idx[selected_idx]
+    mut_df = tensor['samples'].iloc[sample_idx].reset_index(drop=True)
+    mut_df['ref_pos'] = tensor['positions'][position_idx]
+    mut_df['read_base'] = pd.Categorical.from_codes(base_idx, dtype=BASE_DTYPE)
+    mut_df['ref_base'] = pd.Categorical.from_codes(tensor['ref_base'][position_idx], dtype=BASE_DTYPE)
+    mut_df['base_count'] = base_count[sample_idx, selected_idx]
+    mut_df['coverage'] = tensor['coverage'][sample_idx, position_idx]
+    mut_df['frequency'] = tensor['frequency'][sample_idx, position_idx, base_idx]
+    mut_df['Mutation ID'] = selected_ids[selected_idx]
+    mut_df['Full Mutation'] = pd.Categorical.from_codes(selected_idx, categories=mutation_labels(tensor, selected_ids))
+    mut_df['Full Mutation'] = mut_df['Full Mutation'].cat.remove_unused_categories()
+    return mut_df
@@ -0,0 +1,296 @@
+## Libraries
+import io
+import os
+import re
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+## Constants
+PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ANNOTATION_PATH = os.path.join(PROJECT_PATH, 'MS2_annotation.gff3')
+DEFAULT_FASTA_PATH = os.path.join(PROJECT_PATH, 'MS2_reference.fasta')
+GENBANK_EXTENSIONS = ['.gb', '.gbk', '.genbank']
+GFF_COLUMNS = ['seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes']
+GENE_COLUMNS = ['gene', 'start', 'end', 'strand', 'product']
+# Codes of the bases in a codon (any other letter, e.g. N, gets 4)
+CODON_BASES = 'ACGT'
+# The standard genetic code, codons ordered AAA, AAC, AAG, AAT, ACA, ...
+AMINO_ACIDS = np.array(list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVV*Y*YSSSS*CWCLFLF') + ['X'])
+# Every amino acid once, and the code of the amino acid of every codon ('fs' is the last code)
+AA_LETTERS, AA_CODES = np.unique(np.append(AMINO_ACIDS, 'fs'), return_inverse=True)
+EFFECTS = ['frameshift', 'synonymous', 'nonsense', 'stop_lost', 'nonsynonymous']
+
+
+## Functions
+def read_fasta(fasta_path):
+    """
+    This Function receives a path of a fasta file and returns a dictionary of sequence name -> sequence
+    (the name is the first word of the header line, the sequences are in upper case).
+    """
+    sequences = {}
+    name = None
+    with open(fasta_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                sequences[name] = []
+            elif line and name is not None:
+                sequences[name].append(line.upper())
+    return {name: ''.join(lines) for name, lines in sequences.items()}
+def get_genes_df(seqid, start, end, strand, gene, product):
+    """
+    This Function receives the columns of the genes (as lists or arrays) and returns them as a genes df
+    sorted by start, with 1-based start and end positions (end included).
+    """
+    genes_df = pd.DataFrame({'seqid': seqid, 'gene': gene, 'start': start, 'end': end, 'strand': strand,
+                             'product': product})
+    genes_df = genes_df.astype({'start': int, 'end': int})
+    return genes_df.sort_values(['start', 'end'], kind='stable').reset_index(drop=True)
+def read_gff(gff_path, feature_types=('CDS',)):
+    """
+    This Function receives a path of a GFF3 file and returns its features of the given types as a genes df.
+    The gene name is taken from the Name, gene or ID attribute (the first one found).
+    A CDS with a phase starts phase bases after its start (or before its end on the - strand).
+    """
+    with open(gff_path) as f:
+        # The features end where an embedded fasta section starts
+        text = f.read().split('##FASTA')[0]
+    gff_df = pd.read_csv(io.StringIO(text), sep='\t', comment='#', header=None, names=GFF_COLUMNS,
+                         dtype={'seqid': str, 'phase': str})
+    gff_df = gff_df[gff_df['type'].isin(feature_types)]
+    attributes = gff_df['attributes'].fillna('')
+    gene = attributes.str.extract(r'(?:^|;)Name=([^;]+)')[0]
+    for key in ['gene', 'ID']:
+        gene = gene.fillna(attributes.str.extract(r'(?:^|;){}=([^;]+)'.format(key))[0])
+    product = attributes.str.extract(r'(?:^|;)product=([^;]+)')[0]
+    phase = pd.to_numeric(gff_df['phase'], errors='coerce').fillna(0).astype(int)
+    plus_strand = gff_df['strand'] != '-'
+    start = gff_df['start'] + np.where(plus_strand, phase, 0)
+    end = gff_df['end'] - np.where(plus_strand, 0, phase)
+    return get_genes_df(gff_df['seqid'].to_numpy(), start.to_numpy(), end.to_numpy(),
+                        np.where(plus_strand, '+', '-'), gene.to_numpy(), product.to_numpy())
+def read_genbank(genbank_path, feature_types=('CDS',)):
+    """
+    This Function receives a path of a GenBank file (one record) and returns its genes df and its sequence.
+    Only simple locations are read (e.g. 130..1311, complement(1761..3398), <1..>200),
+    a joined location raises a ValueError.
+    return: genes_df, (name, sequence)
+    """
+    with open(genbank_path) as f:
+        text = f.read()
+    name = re.search(r'^LOCUS\s+(\S+)', text, re.M).group(1)
+    features_text, origin_text = text.split('\nORIGIN')[0].split('\nFEATURES')[-1], text.split('\nORIGIN')[-1]
+    sequence = re.sub(r'[^A-Za-z]', '', origin_text.split('//')[0]).upper()
+    rows = []
+    # A feature line has 5 spaces, the feature key and its location
+    for feature in re.split(r'\n(?=     \S)', features_text)[1:]:
+        feature_type, location = feature.split()[:2]
+        if feature_type not in feature_types:
+            continue
+        if 'join' in location or 'order' in location:
+            raise ValueError('Joined locations are not supported: {}'.format(location))
+        start, end = re.search(r'<?(\d+)\.\.>?(\d+)', location).groups()
+        qualifiers = dict(re.findall(r'/(\w+)="([^"]*)"', feature))
+        gene = qualifiers.get('gene', qualifiers.get('locus_tag', qualifiers.get('protein_id')))
+        rows.append((name, int(start), int(end), '-' if 'complement' in location else '+', gene,
+                     qualifiers.get('product')))
+    genes_df = get_genes_df(*zip(*rows)) if rows else get_genes_df([], [], [], [], [], [])
+    return genes_df, (name, sequence)
+def get_ranges(starts, counts):
+    """
+    This Function receives arrays of range starts and lengths and returns all the ranges one after the other
+    (e.g. starts [2, 7] and counts [3, 2] return [2, 3, 4, 7, 8]) without a loop.
+    """
+    counts = np.asarray(counts)
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(np.asarray(starts) - offsets, counts) + np.arange(counts.sum())
+def build_interval_index(genes_df):
+    """
+    This Function receives a genes df and builds an index of the genome's segments: the borders of all
+    the genes cut the genome into segments that are covered by the same genes, so overlapping genes
+    (e.g. lys over the end of cp and the start of rep) are found with a single searchsorted.
+    return: interval_index - a dictionary of breakpoints (segment i is [breakpoints[i], breakpoints[i+1])),
+            offsets and segment_genes (the genes of segment i are segment_genes[offsets[i]:offsets[i+1]])
+    """
+    starts = genes_df['start'].to_numpy()
+    ends = genes_df['end'].to_numpy() + 1
+    breakpoints = np.unique(np.concatenate([starts, ends]))
+    first_segment = np.searchsorted(breakpoints, starts)
+    counts = np.searchsorted(breakpoints, ends) - first_segment
+    segments = get_ranges(first_segment, counts)
+    genes = np.repeat(np.arange(len(genes_df)), counts)
+    order = np.argsort(segments, kind='stable')
+    offsets = np.searchsorted(segments[order], np.arange(max(len(breakpoints), 1)))
+    return {'breakpoints': breakpoints, 'offsets': offsets, 'segment_genes': genes[order]}
+def find_genes(positions, interval_index):
+    """
+    This Function receives an array of (integer) positions and an interval index and returns every
+    (position, gene) hit as two arrays: the index of the position and the index of the gene (in the genes df).
+    A position in more than one gene gets a hit per gene, a position outside all genes gets none.
+    """
+    breakpoints, offsets = interval_index['breakpoints'], interval_index['offsets']
+    segment = np.searchsorted(breakpoints, positions, side='right') - 1
+    in_segment = (segment >= 0) & (segment < len(breakpoints) - 1)
+    segment = np.where(in_segment, segment, 0)
+    n_hits = np.where(in_segment, offsets[segment + 1] - offsets[segment], 0)
+    rows = np.repeat(np.arange(len(positions)), n_hits)
+    return rows, interval_index['segment_genes'][get_ranges(offsets[segment], n_hits)]
+@lru_cache(maxsize=None)
+def load_annotation(annotation_path=DEFAULT_ANNOTATION_PATH, fasta_path=DEFAULT_FASTA_PATH, seqid=None):
+    """
+    This Function receives a path of a GFF3 or GenBank annotation file, a path of the reference fasta
+    (not needed for a GenBank file with a sequence) and optionally the name of the sequence to use
+    (default: the first one). The annotation is loaded once per set of files and reused by later calls.
+    return: annotation - a dictionary of seqid, sequence, genes (a genes df) and index (see build_interval_index)
+    """
+    if os.path.splitext(annotation_path)[1].lower() in GENBANK_EXTENSIONS:
+        genes_df, (name, sequence) = read_genbank(annotation_path)
+        sequences = {name: sequence} if sequence else {}
+    else:
+        genes_df = read_gff(annotation_path)
+        sequences = {}
+    if fasta_path is not None:
+        sequences = read_fasta(fasta_path)
+    if not sequences:
+        raise ValueError('No reference sequence was found for {}'.format(annotation_path))
+    if seqid is None:
+        seqid = next(iter(sequences))
+    genes_df = genes_df[genes_df['seqid'] == seqid].reset_index(drop=True)
+    return {'seqid': seqid, 'sequence': sequences[seqid], 'genes': genes_df[GENE_COLUMNS],
+            'index': build_interval_index(genes_df)}
+def get_char_codes(bases):
+    """
+    This Function receives an array (or a string) of single letters and returns their character codes (uint8).
+    """
+    if isinstance(bases, str):
+        return np.frombuffer(bases.encode(), dtype=np.uint8)
+    if isinstance(bases, np.ndarray) and bases.dtype == np.uint8:
+        return bases
+    return np.asarray(bases).astype('U1').view(np.uint32).astype(np.uint8)
+def get_base_codes(bases):
+    """
+    This Function receives an array (or a string) of bases and returns their codes: A=0, C=1, G=2, T=3, other=4.
+    """
+    lookup = np.full(256, 4, dtype=np.int8)
+    for code, base in enumerate(CODON_BASES):
+        lookup[ord(base)] = code
+        lookup[ord(base.lower())] = code
+    return lookup[get_char_codes(bases)]
+def get_codons_categorical(codon_codes):
+    """
+    This Function receives an (n, 3) array of base codes and returns the codons as a categorical
+    (the 125 possible codons are only turned into text once).
+    """
+    letters = np.array(list(CODON_BASES + 'N'))
+    all_codons = [a + b + c for a in letters for b in letters for c in letters]
+    codon_idx = codon_codes[:, 0] * 25 + codon_codes[:, 1] * 5 + codon_codes[:, 2]
+    return pd.Categorical.from_codes(codon_idx, all_codons)
+def get_codon_index(codon_codes):
+    """
+    This Function receives an (n, 3) array of base codes and returns the index of every codon in AMINO_ACIDS
+    (codons with an unknown base get the index of 'X').
+    """
+    codon_index = codon_codes[:, 0] * 16 + codon_codes[:, 1] * 4 + codon_codes[:, 2]
+    return np.where((codon_codes < 4).all(axis=1), codon_index, len(AMINO_ACIDS) - 1)
+def get_mutation_annotations(ref_pos, ref_base, read_base, annotation=None):
+    """
+    This Function receives arrays of ref_pos, ref_base and read_base (one item per mutation) and an annotation
+    (see load_annotation, default: MS2) and returns one row per (mutation, gene it falls in):
+    row - the index of the mutation in the arrays
+    gene, strand, codon_number - the gene and the number of the codon (from the start of the gene)
+    codon_position - the position of the mutation in the codon (1-3)
+    ref_codon, alt_codon, ref_aa, alt_aa, aa_change - the codon and amino acid before and after the mutation
+    effect - synonymous, nonsynonymous, nonsense, stop_lost or frameshift (insertions and deletions)
+    Everything is computed on whole arrays, mutations outside all genes have no rows.
+    return: annotations_df
+    """
+    if annotation is None:
+        annotation = load_annotation()
+    ref_pos = np.asarray(ref_pos, dtype=float)
+    positions = np.floor(ref_pos).astype(np.int64)
+    rows, gene_idx = find_genes(positions, annotation['index'])
+    genes_df = annotation['genes']
+    position = positions[rows]
+    start = genes_df['start'].to_numpy()[gene_idx]
+    end = genes_df['end'].to_numpy()[gene_idx]
+    minus_strand = genes_df['strand'].to_numpy()[gene_idx] == '-'
+    # Offset of the mutation from the first base of the gene, in the gene's direction
+    offset = np.where(minus_strand, end - position, position - start)
+    codon_position = offset % 3
+    codon_offsets = (offset - codon_position)[:, None] + np.arange(3)
+    codon_ref_pos = np.where(minus_strand[:, None], end[:, None] - codon_offsets, start[:, None] + codon_offsets)
+    sequence_codes = get_base_codes(annotation['sequence'])
+    in_sequence = (codon_ref_pos >= 1) & (codon_ref_pos <= len(sequence_codes))
+    ref_codon = np.where(in_sequence, sequence_codes[np.clip(codon_ref_pos - 1, 0, len(sequence_codes) - 1)], 4)
+    read_chars = get_char_codes(read_base)[rows]
+    alt_base = get_base_codes(read_chars)
+    # On the - strand the gene reads the complementary bases (A<->T, C<->G)
+    ref_codon = np.where(minus_strand[:, None] & (ref_codon < 4), 3 - ref_codon, ref_codon)
+    alt_base = np.where(minus_strand & (alt_base < 4), 3 - alt_base, alt_base)
+    alt_codon = ref_codon.copy()
+    alt_codon[np.arange(len(rows)), codon_position] = alt_base
+    # Amino acids are kept as codes into AA_LETTERS (the last one, 'fs', marks a frameshift)
+    ref_aa = AA_CODES[get_codon_index(ref_codon)]
+    alt_aa = AA_CODES[get_codon_index(alt_codon)]
+    codon_number = offset // 3 + 1
+    # Insertions (ref_base '-', e.g. ref_pos 18.001) and deletions (read_base '-') shift the reading frame
+    frameshift = (read_chars == ord('-')) | (get_char_codes(ref_base)[rows] == ord('-')) | \
+                 (ref_pos[rows] != position)
+    alt_aa = np.where(frameshift, AA_CODES[-1], alt_aa)
+    stop = np.searchsorted(AA_LETTERS, '*')
+    effect = np.select([frameshift, ref_aa == alt_aa, alt_aa == stop, ref_aa == stop], [0, 1, 2, 3], 4)
+    # The amino acid changes are only turned into text once per distinct (ref_aa, codon_number, alt_aa)
+    change_keys, change_codes = np.unique((codon_number * 32 + ref_aa) * 32 + alt_aa, return_inverse=True)
+    change_texts = ['{}{}{}'.format(AA_LETTERS[key // 32 % 32], key // 1024, AA_LETTERS[key % 32])
+                    for key in change_keys]
+    genes = pd.Categorical(genes_df['gene'].to_numpy())
+    return pd.DataFrame({'row': rows, 'gene': pd.Categorical.from_codes(genes.codes[gene_idx], genes.categories),
+                         'strand': pd.Categorical.from_codes(minus_strand.astype(np.int8), ['+', '-']),
+                         'codon_number': codon_number, 'codon_position': codon_position + 1,
+                         'ref_codon': get_codons_categorical(ref_codon),
+                         'alt_codon': get_codons_categorical(np.where(frameshift[:, None], ref_codon, alt_codon)),
+                         'ref_aa': pd.Categorical.from_codes(ref_aa, AA_LETTERS),
+                         'alt_aa': pd.Categorical.from_codes(alt_aa, AA_LETTERS),
+                         'aa_change': pd.Categorical.from_codes(change_codes.ravel(), change_texts),
+                         'effect': pd.Categorical.from_codes(effect, EFFECTS)})
+def get_mutation_annotation_table(mut_df, annotation=None):
+    """
+    This Function receives a mutants df and an annotation (see load_annotation) and returns one row per
+    Full Mutation with its gene, codon_position, aa_change and effect. A mutation in overlapping genes
+    gets the values of every gene joined by ';' (e.g. 'lys;rep'), a mutation outside all genes is 'intergenic'.
+    Every mutation is annotated once, however many rows of it the df has.
+    return: annotation_table
+    """
+    mutation_df = mut_df.drop_duplicates('Full Mutation')[['Full Mutation', 'ref_pos', 'ref_base', 'read_base']]
+    annotations_df = get_mutation_annotations(mutation_df['ref_pos'].to_numpy(),
+                                              mutation_df['ref_base'].astype(str).to_numpy(),
+                                              mutation_df['read_base'].astype(str).to_numpy(), annotation)
+    columns = ['gene', 'codon_position', 'aa_change', 'effect']
+    annotations_df = annotations_df[['row'] + columns].astype(dict(row=int, **{column: str for column in columns}))
+    # Most mutations are in a single gene and are copied as they are, only the ones in overlapping genes are joined
+    rows = annotations_df['row'].to_numpy()
+    single = np.bincount(rows, minlength=len(mutation_df))[rows] == 1
+    joined = annotations_df[~single].groupby('row', sort=True)[columns].agg(';'.join)
+    annotation_table = pd.concat([annotations_df[single].set_index('row')[columns], joined])
+    annotation_table = annotation_table.reindex(np.arange(len(mutation_df)))
+    annotation_table['gene'] = annotation_table['gene'].fillna('')
+    annotation_table['effect'] = annotation_table['effect'].fillna('intergenic')
+    annotation_table.insert(0, 'Full Mutation', mutation_df['Full Mutation'].astype(str).to_numpy())
+    return annotation_table.reset_index(drop=True)
+def annotate_mutations(mut_df, annotation=None):
+    """
+    This Function receives a mutants df and an annotation (see load_annotation, default: MS2) and returns
+    the df with the gene, codon_position, aa_change and effect columns of every row
+    (categorical columns - see get_mutation_annotation_table).
+    """
+    annotation_table = get_mutation_annotation_table(mut_df, annotation)
+    # Map the rows through their mutation codes, so the labels are only compared once per mutation
+    mutation_codes, mutations = pd.factorize(mut_df['Full Mutation'])
+    mutation_idx = pd.Index(annotation_table['Full Mutation']).get_indexer(mutations.astype(str))[mutation_codes]
+    mut_df = mut_df.copy()
+    for column in ['gene', 'codon_position', 'aa_change', 'effect']:
+        values = pd.Categorical(annotation_table[column])
+        mut_df[column] = pd.Categorical.from_codes(values.codes[mutation_idx], values.categories)
+    return mut_df
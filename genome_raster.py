@@ -0,0 +1,73 @@
+## Libraries
+import numpy as np
+import pandas as pd
+import matplotlib.colors as mcolors
+
+## Constants
+# Above this number of points the genome map is drawn as an image instead of one marker per point
+RASTER_POINT_THRESHOLD = 50000
+# Number of (ref_pos, frequency) bins of the image
+RASTER_SHAPE = (1000, 200)
+# Alpha of a bin with a single point (the bin with the most points gets an alpha of 1)
+MIN_ALPHA = 0.4
+
+
+## Functions
+def use_raster(n_points, raster=None, threshold=RASTER_POINT_THRESHOLD):
+    """
+    This Function decides whether a figure with n_points points is drawn as an image:
+    raster - True or False to choose, None to switch automatically when n_points is above the threshold.
+    """
+    if raster is None:
+        return n_points > threshold
+    return raster
+def get_bin_index(values, low, high, n_bins):
+    """
+    This Function receives an array of values and a range and returns the bin of every value (n_bins equal bins,
+    values outside the range are put in the first or last bin).
+    """
+    bin_index = ((np.asarray(values, dtype=float) - low) / (high - low) * n_bins).astype(np.int64)
+    return np.clip(bin_index, 0, n_bins - 1)
+def rasterize_points(x, y, codes, palette, extent, shape=RASTER_SHAPE, min_alpha=MIN_ALPHA):
+    """
+    This Function receives the x and y of the points, the experiment code of every point, the RGB color of every
+    experiment (a (experiments, 3) array), the extent of the image (x_min, x_max, y_min, y_max) and its shape
+    (x bins, y bins), and bins the points into an RGBA image: a bin gets the color of the experiment with the most
+    points in it (so every color is one of the legend) and its alpha grows with the log of the number of points
+    in it (empty bins are transparent).
+    The image is built with bincount, so its size does not depend on the number of points.
+    return: image - an (y bins, x bins, 4) array (row 0 is the lowest y, for imshow with origin='lower')
+    """
+    x_bins, y_bins = shape
+    pixel = get_bin_index(y, extent[2], extent[3], y_bins) * x_bins + get_bin_index(x, extent[0], extent[1], x_bins)
+    n_pixels, n_experiments = x_bins * y_bins, len(palette)
+    # Points per (bin, experiment) - the dominant experiment of a bin is the one with the most points
+    experiment_counts = np.bincount(pixel * n_experiments + np.asarray(codes),
+                                    minlength=n_pixels * n_experiments).reshape(n_pixels, n_experiments)
+    counts = experiment_counts.sum(axis=1)
+    image = np.zeros((n_pixels, 4))
+    filled = counts > 0
+    image[filled, :3] = np.asarray(palette)[experiment_counts[filled].argmax(axis=1)]
+    if filled.any():
+        density = np.log1p(counts[filled]) / np.log1p(counts.max())
+        image[filled, 3] = min_alpha + (1 - min_alpha) * density
+    return image.reshape(y_bins, x_bins, 4)
+def get_experiment_palette(experiments, experiment_colors):
+    """
+    This Function receives an array of the experiment of every point and a dictionary of experiment -> color
+    and returns the experiment code of every point and an (experiments, 3) array of RGB colors
+    (each color is converted once per experiment).
+    return: codes, palette
+    """
+    codes, names = pd.factorize(experiments)
+    palette = np.array([mcolors.to_rgb(experiment_colors[name]) for name in names]).reshape(-1, 3)
+    return codes, palette
+def draw_raster(ax, x, y, codes, palette, extent, shape=RASTER_SHAPE, zorder=2):
+    """
+    This Function receives a matplotlib axis and the points of a scatter plot with their experiments
+    (see rasterize_points) and draws them on the axis as a single image.
+    """
+    image = rasterize_points(x, y, codes, palette, extent, shape)
+    ax.imshow(image, extent=extent, origin='lower', aspect='auto', interpolation='nearest', zorder=zorder)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
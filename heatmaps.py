@@ -0,0 +1,111 @@
+## Libraries
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from scipy.spatial.distance import pdist
+from scipy.cluster.hierarchy import linkage, leaves_list
+
+## Constants
+HEATMAP_VMAX = 0.1
+# Above this number of rows (or columns) only some of the labels are shown
+MAX_TICK_LABELS = 100
+
+
+## Functions
+def build_heatmap_matrices(df, mutation_lst=None, aggfunc='max'):
+    """
+    This Function receives a mutants df (or the df of a trajectory index) and optionally a list of mutations
+    and builds the Experiment x Full Mutation frequency matrix of every passage in a single pivot_table.
+    Duplicate (Passage, Experiment, Full Mutation) rows are combined with aggfunc (the highest frequency),
+    and a mutation that was not read in an experiment is NaN.
+    return: matrices - a dictionary of passages, experiments, mutations and values (passages x experiments x mutations)
+    """
+    if mutation_lst is not None:
+        df = df[df['Full Mutation'].isin(mutation_lst)]
+    table = df.pivot_table(index=['Passage', 'Experiment'], columns='Full Mutation', values='frequency',
+                           aggfunc=aggfunc, observed=True)
+    passages = sorted(table.index.get_level_values('Passage').unique())
+    experiments = sorted(table.index.get_level_values('Experiment').unique())
+    # Every passage gets a row for every experiment, so the matrices can be stacked into one array
+    table = table.reindex(pd.MultiIndex.from_product([passages, experiments]))
+    values = table.to_numpy(dtype='float32').reshape(len(passages), len(experiments), table.shape[1])
+    return {'passages': passages, 'experiments': experiments, 'mutations': [str(m) for m in table.columns],
+            'values': values, 'orders': {}}
+def get_heatmap_matrices(trajectory_index):
+    """
+    This Function receives a trajectory index and returns its heatmap matrices (see build_heatmap_matrices).
+    The matrices are built on the first call and kept in the trajectory index, so drawing the heatmaps again
+    (other passages, colors or layout) does not build them again.
+    """
+    if 'heatmap_matrices' not in trajectory_index:
+        trajectory_index['heatmap_matrices'] = build_heatmap_matrices(trajectory_index['df'])
+    return trajectory_index['heatmap_matrices']
+def get_cluster_order(features, metric='euclidean', method='average'):
+    """
+    This Function receives a 2D array (a row per item) and returns the order of the rows in a hierarchical
+    clustering (missing values count as 0). The distances of all the pairs are computed at once with pdist.
+    """
+    if len(features) < 3:
+        return np.arange(len(features))
+    distances = pdist(np.nan_to_num(features.astype(float)), metric=metric)
+    return leaves_list(linkage(distances, method=method))
+def cluster_heatmap(matrices, metric='euclidean', method='average'):
+    """
+    This Function receives heatmap matrices and returns the clustered order of the experiments and of the mutations.
+    The frequencies of all the passages are clustered together, so every passage is drawn in the same order.
+    The orders are kept in the matrices, so each metric and method is only clustered once.
+    return: experiment_order, mutation_order
+    """
+    key = (metric, method)
+    if key not in matrices['orders']:
+        values = matrices['values']
+        experiment_features = values.transpose(1, 0, 2).reshape(values.shape[1], -1)
+        mutation_features = values.transpose(2, 0, 1).reshape(values.shape[2], -1)
+        matrices['orders'][key] = (get_cluster_order(experiment_features, metric, method),
+                                   get_cluster_order(mutation_features, metric, method))
+    return matrices['orders'][key]
+def get_heatmap_passages(matrices, passages=None):
+    """
+    This Function receives heatmap matrices and the passages to draw (None for all of them) and returns them,
+    raising a ValueError when one of them is not in the data (so a heatmap is never saved empty).
+    """
+    if passages is None:
+        return list(matrices['passages'])
+    missing = [passage for passage in passages if passage not in matrices['passages']]
+    if missing:
+        raise ValueError('No heatmap data for passage(s) {} (the passages are: {})'.format(
+            ', '.join(map(str, missing)), ', '.join(map(str, matrices['passages']))))
+    return list(passages)
+def select_passages(matrices, passages):
+    """
+    This Function receives heatmap matrices and a list of passages and returns the matrices of those passages only
+    (with the clustered orders already computed, which were clustered over all the passages),
+    e.g. to send a single passage to a render job.
+    """
+    passage_idx = [matrices['passages'].index(passage) for passage in passages]
+    return {'passages': list(passages), 'experiments': matrices['experiments'], 'mutations': matrices['mutations'],
+            'values': matrices['values'][passage_idx], 'orders': dict(matrices['orders'])}
+def get_passage_matrix(matrices, passage, experiment_order=None, mutation_order=None):
+    """
+    This Function receives heatmap matrices and a passage and returns the passage's matrix as a df
+    (with the rows and columns in the given orders).
+    """
+    matrix_df = pd.DataFrame(matrices['values'][matrices['passages'].index(passage)],
+                             index=matrices['experiments'], columns=matrices['mutations'])
+    if experiment_order is not None:
+        matrix_df = matrix_df.iloc[experiment_order]
+    if mutation_order is not None:
+        matrix_df = matrix_df.iloc[:, mutation_order]
+    return matrix_df
+def draw_heatmap(ax, matrix_df, title=None, vmin=0, vmax=HEATMAP_VMAX, cmap=None, cbar=True):
+    """
+    This Function receives a matplotlib axis and a matrix df and draws it as a heatmap on the axis.
+    """
+    if cmap is None:
+        cmap = sns.cubehelix_palette(as_cmap=True)
+    xticklabels = True if matrix_df.shape[1] <= MAX_TICK_LABELS else 'auto'
+    yticklabels = True if matrix_df.shape[0] <= MAX_TICK_LABELS else 'auto'
+    sns.heatmap(matrix_df, ax=ax, cmap=cmap, vmin=vmin, vmax=vmax, cbar=cbar, xticklabels=xticklabels,
+                yticklabels=yticklabels)
+    if title is not None:
+        ax.set_title(title)
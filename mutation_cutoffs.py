@@ -0,0 +1,109 @@
+## Libraries
+import os
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+## Constants
+# Primer regions and positions of known sequencing errors of MS2
+DEFAULT_MASK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MS2_masked_regions.bed')
+
+
+## Functions
+def read_mask_regions(bed_path):
+    """
+    This Function receives a path of a BED like file (chrom, start, end and optionally a name, '#' for comments)
+    and returns its regions as a df. Like in BED, start is 0-based and end is excluded.
+    return: regions_df
+    """
+    regions_df = pd.read_csv(bed_path, sep='\t', comment='#', header=None)
+    regions_df = regions_df.iloc[:, :4]
+    regions_df.columns = ['chrom', 'start', 'end', 'name'][:regions_df.shape[1]]
+    return regions_df
+@lru_cache(maxsize=None)
+def load_position_mask(bed_path=DEFAULT_MASK_PATH):
+    """
+    This Function receives a path of a BED like file and returns a boolean array indexed by ref_pos (1-based)
+    that is True for every masked position. The mask is built once per file and reused by later calls.
+    return: position_mask
+    """
+    regions_df = read_mask_regions(bed_path)
+    position_mask = np.zeros(regions_df['end'].max() + 1, dtype=bool)
+    # Mark the regions with a +1/-1 at their borders and sum them up, instead of looping over every position
+    borders = np.zeros(len(position_mask) + 1, dtype=int)
+    np.add.at(borders, regions_df['start'].to_numpy() + 1, 1)
+    np.add.at(borders, regions_df['end'].to_numpy() + 1, -1)
+    position_mask[:] = np.cumsum(borders)[:-1] > 0
+    position_mask.flags.writeable = False
+    return position_mask
+def is_masked(ref_pos, position_mask):
+    """
+    This Function receives an array of ref_pos values and a position mask and returns which of them are masked.
+    Insertions (e.g. 18.001) are not masked, the same as filtering the masked positions with isin.
+    """
+    ref_pos = np.asarray(ref_pos)
+    int_pos = ref_pos.astype(int)
+    in_mask = (int_pos == ref_pos) & (int_pos >= 0) & (int_pos < len(position_mask))
+    return in_mask & position_mask[np.where(in_mask, int_pos, 0)]
+def get_row_cutoffs(mut_df, min_coverage, min_frequency, experiment_cutoffs=None):
+    """
+    This Function receives a mutants df, the default cutoffs and optionally a dictionary of
+    experiment -> (min_coverage, min_frequency) and returns the coverage and frequency cutoff of every row.
+    """
+    row_coverage = np.full(len(mut_df), min_coverage, dtype=float)
+    row_frequency = np.full(len(mut_df), min_frequency, dtype=float)
+    if experiment_cutoffs:
+        cutoffs_df = pd.DataFrame.from_dict(experiment_cutoffs, orient='index', columns=['min_cov', 'min_freq'])
+        experiment_idx = cutoffs_df.index.get_indexer(mut_df['Experiment'])
+        has_cutoffs = experiment_idx >= 0
+        row_coverage[has_cutoffs] = cutoffs_df['min_cov'].to_numpy()[experiment_idx[has_cutoffs]]
+        row_frequency[has_cutoffs] = cutoffs_df['min_freq'].to_numpy()[experiment_idx[has_cutoffs]]
+    return row_coverage, row_frequency
+def apply_cutoffs(mut_df, min_coverage, min_frequency, position_mask=None, experiment_cutoffs=None):
+    """
+    This Function receives a mutants df, a minimum coverage value and a minimum frequency value
+    (and optionally a position mask and per experiment cutoffs, see get_row_cutoffs).
+    The coverage, frequency and mask filters are applied together in a single pass over the df.
+    It returns:
+    relevant_mutations - a sorted list of the mutations that met the cutoffs in at least one sample
+    pass_matrix - a boolean df with an (Experiment, Passage) row and a column per relevant mutation,
+                  True where the mutation met the cutoffs
+    """
+    if position_mask is None:
+        position_mask = load_position_mask()
+    row_coverage, row_frequency = get_row_cutoffs(mut_df, min_coverage, min_frequency, experiment_cutoffs)
+    passed = (mut_df['base_count'].to_numpy() >= row_coverage) & (mut_df['frequency'].to_numpy() >= row_frequency) & \
+             ~is_masked(mut_df['ref_pos'].to_numpy(), position_mask)
+    # Number the (Experiment, Passage) groups of the whole df, so groups where nothing passed still get a row
+    group_codes, groups = pd.MultiIndex.from_frame(mut_df[['Experiment', 'Passage']]).factorize()
+    mutation_codes, relevant_mutations = pd.factorize(mut_df['Full Mutation'][passed], sort=True)
+    pass_matrix = np.zeros((len(groups), len(relevant_mutations)), dtype=bool)
+    pass_matrix[group_codes[passed], mutation_codes] = True
+    pass_matrix = pd.DataFrame(pass_matrix, index=pd.MultiIndex.from_tuples(groups, names=['Experiment', 'Passage']),
+                               columns=pd.Index(np.asarray(relevant_mutations), name='Full Mutation')).sort_index()
+    return list(relevant_mutations), pass_matrix
+def sweep_cutoffs(mut_df, coverage_values, frequency_values, position_mask=None):
+    """
+    This Function receives a mutants df and lists of min_coverage and min_frequency values and returns a df
+    (min_cov rows, min_freq columns) holding the number of mutations that pass each pair of cutoffs.
+    Each row is binned once by the cutoffs it passes, so the df is never filtered again per pair.
+    return: sweep_df
+    """
+    if position_mask is None:
+        position_mask = load_position_mask()
+    coverage_values = np.sort(np.asarray(coverage_values))
+    frequency_values = np.sort(np.asarray(frequency_values))
+    unmasked = ~is_masked(mut_df['ref_pos'].to_numpy(), position_mask)
+    mutation_codes, mutations = pd.factorize(mut_df['Full Mutation'][unmasked])
+    # Number of cutoffs each row passes, e.g. 2 means it passes the 2 lowest coverage cutoffs
+    coverage_bin = np.searchsorted(coverage_values, mut_df['base_count'].to_numpy()[unmasked], side='right')
+    frequency_bin = np.searchsorted(frequency_values, mut_df['frequency'].to_numpy()[unmasked], side='right')
+    passes_any = (coverage_bin > 0) & (frequency_bin > 0)
+    # Mark the strictest pair every row passes and spread it to all the looser pairs
+    passed = np.zeros((len(mutations), len(coverage_values), len(frequency_values)), dtype=bool)
+    passed[mutation_codes[passes_any], coverage_bin[passes_any] - 1, frequency_bin[passes_any] - 1] = True
+    passed = np.logical_or.accumulate(passed[:, ::-1, :], axis=1)[:, ::-1, :]
+    passed = np.logical_or.accumulate(passed[:, :, ::-1], axis=2)[:, :, ::-1]
+    sweep_df = pd.DataFrame(passed.sum(axis=0), index=pd.Index(coverage_values, name='min_cov'),
+                            columns=pd.Index(frequency_values, name='min_freq'))
+    return sweep_df
@@ -0,0 +1,374 @@
+## Libraries
+import os
+import re
+import gzip
+import glob
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from freq_loading import BASES, FREQ_COLUMNS, get_sample_id
+from genome_annotation import read_fasta, get_ranges, DEFAULT_FASTA_PATH
+
+## Constants
+N_BASES = len(BASES)
+DELETION_CODE = BASES.index('-')
+# Code of a read base that is not counted (e.g. N)
+OTHER_CODE = N_BASES
+CIGAR_OPS = 'MIDNSHP=X'
+# Reads that are unmapped, secondary, failed the QC, duplicates or supplementary are skipped
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400 | 0x800
+# A base quality of 255 means the quality is missing (the base is counted, but not in avg_qscore)
+MISSING_QUALITY = 255
+DEFAULT_MIN_QSCORE = 30
+DEFAULT_MIN_MAPQ = 0
+# Number of reads accumulated together
+DEFAULT_BATCH_SIZE = 20000
+ALIGNMENT_PATTERNS = ['*.bam', '*.sam']
+
+
+## Functions
+def get_base_lookup(letters):
+    """
+    This Function receives the letters of a sequence alphabet and returns an array of their base codes
+    (the index in BASES, OTHER_CODE for any other letter).
+    """
+    return np.array([BASES.index(letter) if letter in BASES[:DELETION_CODE] else OTHER_CODE for letter in letters],
+                    dtype=np.int8)
+def get_sam_lookup():
+    """
+    This Function returns an array of the base code of every byte of a SAM sequence (upper or lower case).
+    """
+    lookup = np.full(256, OTHER_CODE, dtype=np.int8)
+    for code, base in enumerate(BASES[:DELETION_CODE]):
+        lookup[ord(base)] = code
+        lookup[ord(base.lower())] = code
+    return lookup
+def parse_cigar(cigar):
+    """
+    This Function receives a SAM CIGAR string (e.g. '10S90M2I48M') and returns two arrays: the ops
+    (as indexes in CIGAR_OPS) and their lengths.
+    """
+    operations = re.findall(r'(\d+)([MIDNSHP=X])', cigar)
+    lengths = np.array([int(length) for length, op in operations], dtype=np.int64)
+    return np.array([CIGAR_OPS.index(op) for length, op in operations], dtype=np.int8), lengths
+def read_sam_records(sam_path):
+    """
+    This Function receives a path of a SAM file and yields its alignments one at a time as tuples of
+    (flag, pos, mapq, cigar ops, cigar lengths, base codes, qualities, mate pos, template length)
+    (positions are 0-based).
+    """
+    lookup = get_sam_lookup()
+    with open(sam_path) as f:
+        for line in f:
+            if line.startswith('@'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 11 or fields[5] == '*' or fields[9] == '*':
+                continue
+            ops, lengths = parse_cigar(fields[5])
+            bases = lookup[np.frombuffer(fields[9].encode(), dtype=np.uint8)]
+            if fields[10] == '*':
+                qualities = np.full(len(bases), MISSING_QUALITY, dtype=np.uint8)
+            else:
+                qualities = np.frombuffer(fields[10].encode(), dtype=np.uint8) - 33
+            yield (int(fields[1]), int(fields[3]) - 1, int(fields[4]), ops, lengths, bases, qualities,
+                   int(fields[7]) - 1, int(fields[8]))
+def read_bam_records(bam_path):
+    """
+    This Function receives a path of a BAM file and yields its alignments like read_sam_records.
+    BAM is a series of gzip blocks (BGZF), so it is read as one gzip stream and the records are unpacked with struct.
+    """
+    nibble_lookup = get_base_lookup('=ACMGRSVTWYHKDBN')
+    with gzip.open(bam_path, 'rb') as f:
+        if f.read(4) != b'BAM\x01':
+            raise ValueError('Not a BAM file: {}'.format(bam_path))
+        # Skip the header text and the reference names
+        header_length, = struct.unpack('<i', f.read(4))
+        f.read(header_length)
+        n_references, = struct.unpack('<i', f.read(4))
+        for _ in range(n_references):
+            name_length, = struct.unpack('<i', f.read(4))
+            f.read(name_length + 4)
+        while True:
+            size_bytes = f.read(4)
+            if len(size_bytes) < 4:
+                break
+            block_size, = struct.unpack('<i', size_bytes)
+            data = f.read(block_size)
+            (reference_id, pos, name_length, mapq, _, n_cigar, flag, seq_length, _, mate_pos,
+             template_length) = struct.unpack_from('<iiBBHHHiiii', data)
+            offset = 32 + name_length
+            cigar = np.frombuffer(data, dtype='<u4', count=n_cigar, offset=offset)
+            offset += 4 * n_cigar
+            packed = np.frombuffer(data, dtype=np.uint8, count=(seq_length + 1) // 2, offset=offset)
+            offset += (seq_length + 1) // 2
+            qualities = np.frombuffer(data, dtype=np.uint8, count=seq_length, offset=offset)
+            if n_cigar == 0 or seq_length == 0:
+                continue
+            # Every byte holds two bases, 4 bits each
+            nibbles = np.stack([packed >> 4, packed & 15], axis=1).ravel()[:seq_length]
+            yield (flag, pos, mapq, (cigar & 15).astype(np.int8), (cigar >> 4).astype(np.int64),
+                   nibble_lookup[nibbles], qualities, mate_pos, template_length)
+def read_alignment_records(alignment_path):
+    """
+    This Function receives a path of a SAM or BAM file and yields its alignments (see read_sam_records).
+    """
+    if alignment_path.endswith('.bam'):
+        return read_bam_records(alignment_path)
+    return read_sam_records(alignment_path)
+def new_pileup(genome_length):
+    """
+    This Function returns empty pileup arrays for a genome: counts, quality sums, quality counts and overlap
+    counts of every (position, base) and a list of the insertion tables of every batch.
+    """
+    shape = (genome_length, N_BASES)
+    return {'counts': np.zeros(shape, dtype=np.int64), 'quality_sum': np.zeros(shape),
+            'quality_count': np.zeros(shape, dtype=np.int64), 'overlap': np.zeros(shape, dtype=np.int64),
+            'insertions': []}
+def get_mate_overlap(flag, pos, end, mate_pos, template_length):
+    """
+    This Function receives the flag, start, end (excluded), mate start and template length of a read and
+    returns the part of the read its mate also covers (start, end excluded; start >= end when there is none).
+    The mate's end is taken from the template length for the left read and estimated from the read's own
+    length for the right one.
+    """
+    if not flag & 0x1 or flag & 0x8 or template_length == 0:
+        return 0, 0
+    if pos <= mate_pos:
+        mate_end = pos + abs(template_length)
+    else:
+        mate_end = mate_pos + (end - pos)
+    return max(pos, mate_pos), min(end, mate_end)
+def add_batch(pileup, batch, min_qscore):
+    """
+    This Function receives pileup arrays and a batch of alignments and adds the bases of the batch to the pileup.
+    The CIGAR of every read is only walked to find its aligned blocks, the bases of all the blocks
+    of the batch are then counted together with bincount.
+    """
+    genome_length = len(pileup['counts'])
+    matches, deletions, insertions, overlaps = [], [], [], []
+    sequences, qualities = [], []
+    read_offset = 0
+    for read, (flag, pos, _, ops, lengths, bases, base_qualities, mate_pos, template_length) in enumerate(batch):
+        ref, query = pos, read_offset
+        for op, length in zip(ops.tolist(), lengths.tolist()):
+            if op in (0, 7, 8):
+                matches.append((ref, query, length, read))
+                ref += length
+                query += length
+            elif op == 1:
+                # An insertion follows the last aligned reference position (1-based: ref)
+                insertions.append((ref, query, length, read))
+                query += length
+            elif op == 2:
+                deletions.append((ref, length, read))
+                ref += length
+            elif op == 3:
+                ref += length
+            elif op == 4:
+                query += length
+        overlaps.append(get_mate_overlap(flag, pos, ref, mate_pos, template_length))
+        sequences.append(bases)
+        qualities.append(base_qualities)
+        read_offset += len(bases)
+    if not sequences:
+        return
+    sequence = np.concatenate(sequences)
+    quality = np.concatenate(qualities)
+    overlaps = np.array(overlaps, dtype=np.int64).reshape(-1, 2)
+    # Matched bases (positions are 0-based here)
+    matches = np.array(matches, dtype=np.int64).reshape(-1, 4)
+    positions = get_ranges(matches[:, 0], matches[:, 2])
+    query_idx = get_ranges(matches[:, 1], matches[:, 2])
+    reads = np.repeat(matches[:, 3], matches[:, 2])
+    add_observations(pileup, positions, sequence[query_idx], quality[query_idx], overlaps[reads], min_qscore)
+    # Deleted positions count as '-' (they have no quality)
+    deletions = np.array(deletions, dtype=np.int64).reshape(-1, 3)
+    positions = get_ranges(deletions[:, 0], deletions[:, 1])
+    reads = np.repeat(deletions[:, 2], deletions[:, 1])
+    add_observations(pileup, positions, np.full(len(positions), DELETION_CODE),
+                     np.full(len(positions), MISSING_QUALITY), overlaps[reads], min_qscore)
+    # Inserted bases are counted per (position they follow, place in the insertion, base)
+    insertions = np.array(insertions, dtype=np.int64).reshape(-1, 4)
+    if len(insertions):
+        query_idx = get_ranges(insertions[:, 1], insertions[:, 2])
+        anchors = np.repeat(insertions[:, 0], insertions[:, 2])
+        places = query_idx - np.repeat(insertions[:, 1], insertions[:, 2]) + 1
+        reads = np.repeat(insertions[:, 3], insertions[:, 2])
+        base, base_quality = sequence[query_idx], quality[query_idx]
+        in_overlap = (anchors - 1 >= overlaps[reads, 0]) & (anchors - 1 < overlaps[reads, 1])
+        kept = (base < OTHER_CODE) & ((base_quality >= min_qscore) | (base_quality == MISSING_QUALITY)) & \
+               (anchors >= 1) & (anchors <= genome_length)
+        has_quality = base_quality != MISSING_QUALITY
+        insertion_df = pd.DataFrame({'anchor': anchors, 'place': places, 'base': base, 'count': 1,
+                                     'quality_sum': np.where(has_quality, base_quality, 0),
+                                     'quality_count': has_quality.astype(int), 'overlap': in_overlap.astype(int)})
+        pileup['insertions'].append(insertion_df[kept].groupby(['anchor', 'place', 'base']).sum())
+def add_observations(pileup, positions, bases, base_qualities, read_overlaps, min_qscore):
+    """
+    This Function receives the (0-based) positions, base codes and qualities of observed bases and the
+    mate overlap of the read of each one, and adds the ones that pass the quality cutoff to the pileup arrays.
+    """
+    genome_length = len(pileup['counts'])
+    has_quality = base_qualities != MISSING_QUALITY
+    kept = (bases < OTHER_CODE) & ((base_qualities >= min_qscore) | ~has_quality) & \
+           (positions >= 0) & (positions < genome_length)
+    in_overlap = (positions >= read_overlaps[:, 0]) & (positions < read_overlaps[:, 1])
+    cells = positions[kept] * N_BASES + bases[kept]
+    size = genome_length * N_BASES
+    pileup['counts'] += np.bincount(cells, minlength=size).reshape(genome_length, N_BASES)
+    pileup['overlap'] += np.bincount(cells, weights=in_overlap[kept], minlength=size).reshape(
+        genome_length, N_BASES).astype(np.int64)
+    pileup['quality_sum'] += np.bincount(cells, weights=np.where(has_quality, base_qualities, 0)[kept],
+                                         minlength=size).reshape(genome_length, N_BASES)
+    pileup['quality_count'] += np.bincount(cells, weights=has_quality[kept], minlength=size).reshape(
+        genome_length, N_BASES).astype(np.int64)
+def get_base_ranks(counts):
+    """
+    This Function receives the counts of the bases (a (positions, 5) array) and returns the rank of every base
+    in its position: the number of other bases with at least as many reads (0 for the most common base).
+    """
+    return (counts[:, None, :] >= counts[:, :, None]).sum(axis=2) - 1
+def get_freq_columns(counts, coverage, quality_sum, quality_count, overlap):
+    """
+    This Function receives the count, coverage, quality and overlap arrays of rows of a freq table and returns
+    the overlap_ratio, avg_qscore, frequency and probability columns (0 where a base was not read; the
+    avg_qscore of a base read without qualities, such as a deletion, is inf like in the upstream freq files).
+    """
+    read = counts > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlap_ratio = np.where(read, overlap / counts, 0)
+        avg_qscore = np.where(read, np.where(quality_count > 0, quality_sum / quality_count, np.inf), 0)
+        frequency = np.where(coverage > 0, counts / coverage, 0)
+    probability = 1 - np.exp(-counts.astype(float))
+    return overlap_ratio, np.round(avg_qscore, 1), frequency, probability
+def pileup_to_freq_df(pileup, reference):
+    """
+    This Function receives filled pileup arrays and the reference sequence and returns the freq table:
+    5 rows (-, A, C, G, T) for every position of the reference and a row for every inserted base
+    (ref_pos 18.001 is the first base inserted after position 18, its ref_base is '-').
+    return: freq_df
+    """
+    counts = pileup['counts']
+    genome_length = len(counts)
+    coverage = counts.sum(axis=1)
+    overlap_ratio, avg_qscore, frequency, probability = get_freq_columns(
+        counts, coverage[:, None], pileup['quality_sum'], pileup['quality_count'], pileup['overlap'])
+    ref_bases = np.array(list(reference[:genome_length]))
+    freq_df = pd.DataFrame({'ref_pos': np.repeat(np.arange(1, genome_length + 1), N_BASES).astype(float),
+                            'read_base': np.tile(BASES, genome_length), 'ref_base': np.repeat(ref_bases, N_BASES),
+                            'base_count': counts.ravel().astype(float), 'overlap_ratio': overlap_ratio.ravel(),
+                            'avg_qscore': avg_qscore.ravel(), 'coverage': np.repeat(coverage, N_BASES).astype(float),
+                            'frequency': frequency.ravel(), 'base_rank': get_base_ranks(counts).ravel().astype(float),
+                            'probability': probability.ravel()})
+    if pileup['insertions']:
+        insertion_df = pd.concat(pileup['insertions']).groupby(level=[0, 1, 2]).sum().reset_index()
+        insertion_counts = insertion_df['count'].to_numpy()
+        anchor_coverage = coverage[insertion_df['anchor'].to_numpy() - 1]
+        overlap_ratio, avg_qscore, frequency, probability = get_freq_columns(
+            insertion_counts, anchor_coverage, insertion_df['quality_sum'].to_numpy(),
+            insertion_df['quality_count'].to_numpy(), insertion_df['overlap'].to_numpy())
+        # Rank the inserted bases of each (position, place) like the bases of a position
+        place_codes = pd.factorize(insertion_df['anchor'] * 1000 + insertion_df['place'])[0]
+        place_counts = np.zeros((place_codes.max() + 1, N_BASES), dtype=np.int64)
+        place_counts[place_codes, insertion_df['base'].to_numpy()] = insertion_counts
+        base_rank = get_base_ranks(place_counts)[place_codes, insertion_df['base'].to_numpy()]
+        insertion_rows = pd.DataFrame({'ref_pos': insertion_df['anchor'] + insertion_df['place'] / 1000,
+                                       'read_base': np.array(BASES)[insertion_df['base'].to_numpy()],
+                                       'ref_base': '-', 'base_count': insertion_counts.astype(float),
+                                       'overlap_ratio': overlap_ratio, 'avg_qscore': avg_qscore,
+                                       'coverage': anchor_coverage.astype(float), 'frequency': frequency,
+                                       'base_rank': base_rank.astype(float), 'probability': probability})
+        freq_df = pd.concat([freq_df, insertion_rows], ignore_index=True)
+    # Sort like the upstream freq files: by position, then '-', A, C, G, T
+    return freq_df.sort_values(['ref_pos', 'read_base'], kind='stable').reset_index(drop=True)[FREQ_COLUMNS]
+def alignment_to_freq_df(alignment_path, reference, min_qscore=DEFAULT_MIN_QSCORE, min_mapq=DEFAULT_MIN_MAPQ,
+                         batch_size=DEFAULT_BATCH_SIZE):
+    """
+    This Function receives a path of a SAM or BAM file of reads aligned to the reference (a single sequence)
+    and the reference sequence, and returns the freq table of the reads (see pileup_to_freq_df).
+    The reads are streamed in batches of batch_size, so only the pileup arrays and one batch are in memory.
+    Bases with a quality below min_qscore and reads with a mapping quality below min_mapq are not counted.
+    return: freq_df
+    """
+    pileup = new_pileup(len(reference))
+    batch = []
+    for record in read_alignment_records(alignment_path):
+        if record[0] & SKIP_FLAGS or record[2] < min_mapq:
+            continue
+        batch.append(record)
+        if len(batch) == batch_size:
+            add_batch(pileup, batch, min_qscore)
+            batch = []
+    add_batch(pileup, batch, min_qscore)
+    return pileup_to_freq_df(pileup, reference)
+def write_freq_file(freq_df, freq_path):
+    """
+    This Function receives a freq table and saves it as a tab separated freq file (written to a temporary
+    file first, so a half written file is never read).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(freq_path)), exist_ok=True)
+    freq_df.to_csv(freq_path + '.tmp', sep='\t', index=False)
+    os.replace(freq_path + '.tmp', freq_path)
+def make_freq_file(job):
+    """
+    This Function receives a job (alignment path, freq path, reference, min_qscore, min_mapq),
+    makes the freq file of the alignment and returns its path.
+    """
+    alignment_path, freq_path, reference, min_qscore, min_mapq = job
+    write_freq_file(alignment_to_freq_df(alignment_path, reference, min_qscore, min_mapq), freq_path)
+    return freq_path
+def find_alignment_files(alignment_root):
+    """
+    This Function receives a folder and returns a sorted list of every SAM and BAM file under it.
+    """
+    alignment_paths = []
+    for pattern in ALIGNMENT_PATTERNS:
+        alignment_paths += glob.glob(os.path.join(alignment_root, '**', pattern), recursive=True)
+    return sorted(alignment_paths)
+def get_freq_path(alignment_path, alignment_root, data_root):
+    """
+    This Function returns the path of the freq file of an alignment: the same sub folder (the scientist)
+    under data_root, with the sample ID of the alignment and a .tsv extension.
+    """
+    sub_folder = os.path.relpath(os.path.dirname(os.path.abspath(alignment_path)), os.path.abspath(alignment_root))
+    return os.path.normpath(os.path.join(data_root, sub_folder, get_sample_id(alignment_path) + '.tsv'))
+def update_freq_files(alignment_root, data_root, fasta_path=DEFAULT_FASTA_PATH, processes=None,
+                      min_qscore=DEFAULT_MIN_QSCORE, min_mapq=DEFAULT_MIN_MAPQ):
+    """
+    This Function receives a folder of alignments (one sub folder per scientist, e.g. Alignments/Shir/Shir0A.bam)
+    and makes the freq file of every alignment under data_root (e.g. DATA/Shir/Shir0A.tsv) in parallel
+    using a process pool. Freq files that are newer than their alignment are not made again.
+    processes - number of worker processes (None uses every core, 1 makes the files one after another)
+    return: the paths of the freq files that were made
+    """
+    reference = next(iter(read_fasta(fasta_path).values()))
+    jobs = []
+    for alignment_path in find_alignment_files(alignment_root):
+        freq_path = get_freq_path(alignment_path, alignment_root, data_root)
+        if not os.path.exists(freq_path) or os.path.getmtime(freq_path) < os.path.getmtime(alignment_path):
+            jobs.append((alignment_path, freq_path, reference, min_qscore, min_mapq))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(make_freq_file, jobs))
+    return [make_freq_file(job) for job in jobs]
+
+
+## Main Code
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make freq files from SAM/BAM alignments to the reference.')
+    parser.add_argument('alignment_root', help='folder of the alignments (one sub folder per scientist)')
+    parser.add_argument('data_root', help='folder to save the freq files to (e.g. DATA)')
+    parser.add_argument('--fasta', default=DEFAULT_FASTA_PATH, help='reference fasta (default: MS2)')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--min-qscore', type=int, default=DEFAULT_MIN_QSCORE)
+    parser.add_argument('--min-mapq', type=int, default=DEFAULT_MIN_MAPQ)
+    args = parser.parse_args()
+    freq_paths = update_freq_files(args.alignment_root, args.data_root, args.fasta, args.processes,
+                                   args.min_qscore, args.min_mapq)
+    print('Made {} freq files'.format(len(freq_paths)))
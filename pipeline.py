@@ -0,0 +1,311 @@
+## Libraries
+import os
+import json
+import pickle
+import hashlib
+import argparse
+from freq_loading import find_freq_files
+from freq_cache import load_freq_files_cached, read_manifest, get_cache_key
+from freq_tensor import build_freq_tensor
+from mutation_cutoffs import load_position_mask, DEFAULT_MASK_PATH
+from trajectory_index import build_trajectory_index
+from heatmaps import build_heatmap_matrices
+from convergence import build_convergence_index, get_convergence_table
+from sample_registry import DEFAULT_SAMPLE_SHEET
+from pileup import update_freq_files
+from profiling import new_profile, profile_stage, write_profile_report
+from trajectory_stats import compute_trajectory_table, DEFAULT_FIXATION_THRESHOLD
+from variant_calling import build_error_model, call_variants, get_called_mutations
+from genome_annotation import load_annotation, get_mutation_annotation_table, DEFAULT_ANNOTATION_PATH, \
+    DEFAULT_FASTA_PATH
+import Project_main
+import figure_rendering
+
+## Constants
+DEFAULT_CONFIG = {'data_root': 'DATA', 'cache_dir': '.freq_cache', 'export_path': 'Export', 'processes': None,
+                  'min_cov': 100, 'min_freq': 0.05, 'mask_path': DEFAULT_MASK_PATH, 'experiment_colors': {},
+                  'figures': {'heatmap': {}}, 'fixation_threshold': DEFAULT_FIXATION_THRESHOLD,
+                  'trajectory_table': None, 'variant_calling': None, 'annotation_path': DEFAULT_ANNOTATION_PATH,
+                  'fasta_path': DEFAULT_FASTA_PATH, 'alignment_root': None, 'sample_sheet': DEFAULT_SAMPLE_SHEET,
+                  'convergence_table': None}
+PATH_KEYS = ['data_root', 'cache_dir', 'export_path', 'mask_path', 'trajectory_table', 'annotation_path',
+             'fasta_path', 'alignment_root', 'sample_sheet', 'convergence_table']
+# Params that are files: their content is hashed, so editing the file runs the stages that use it again
+FILE_PARAMS = ['mask_path', 'annotation_path', 'fasta_path', 'sample_sheet']
+# Every stage: the stages it reads from and the config values it depends on
+STAGES = {'load': {'inputs': [], 'params': []},
+          'arrange': {'inputs': ['load'], 'params': ['sample_sheet']},
+          'mutations': {'inputs': ['arrange'], 'params': []},
+          'calls': {'inputs': ['arrange'], 'params': ['variant_calling', 'mask_path']},
+          'cutoffs': {'inputs': ['mutations', 'calls'], 'params': ['min_cov', 'min_freq', 'mask_path']},
+          'trajectories': {'inputs': ['mutations', 'cutoffs'], 'params': []},
+          'heatmaps': {'inputs': ['trajectories'], 'params': []},
+          'convergence': {'inputs': ['mutations', 'cutoffs'], 'params': ['min_cov', 'min_freq', 'mask_path']},
+          'annotation': {'inputs': ['mutations'], 'params': ['annotation_path', 'fasta_path']},
+          'analytics': {'inputs': ['mutations', 'cutoffs', 'annotation'],
+                        'params': ['min_freq', 'fixation_threshold']}}
+# Stages whose output is not pickled: the freq files are already cached as .npy columns (see freq_cache.py)
+UNPICKLED_STAGES = ['load']
+
+
+## Functions
+def load_config(config_path):
+    """
+    This Function receives a path of a json config file and returns the config dictionary
+    (missing values are taken from DEFAULT_CONFIG, relative paths are relative to the config file's folder).
+    return: config
+    """
+    with open(config_path) as f:
+        config = dict(DEFAULT_CONFIG, **json.load(f))
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    for key in PATH_KEYS:
+        if config[key] is not None:
+            config[key] = os.path.join(config_dir, config[key])
+    return config
+def hash_json(value):
+    """
+    This Function receives a json-able value and returns a short hash of it.
+    """
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+def get_param_value(config, param):
+    """
+    This Function receives the config and a parameter name and returns the value the stage keys are built from
+    (for files, such as the mask, it is the hash of their content).
+    """
+    if param in FILE_PARAMS and config[param] is not None:
+        with open(config[param], 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    return config[param]
+def get_stage_inputs(config, stage):
+    """
+    This Function returns the stages a stage reads from (the calls stage only reads the freq df when
+    variant calling is turned on in the config).
+    """
+    if stage == 'calls' and config['variant_calling'] is None:
+        return []
+    return STAGES[stage]['inputs']
+def get_stage_keys(config):
+    """
+    This Function receives the config and returns a dictionary of stage -> key.
+    The key of a stage is a hash of its params and of the keys of its inputs, and the key of the load stage
+    is a hash of the path, size and content hash of every freq file - so a key only changes when something
+    the stage depends on changed.
+    return: stage_keys
+    """
+    freq_paths = find_freq_files(config['data_root'])
+    manifest = read_manifest(config['cache_dir'])
+    stage_keys = {'load': hash_json([[path, get_cache_key(path, manifest)['key']] for path in freq_paths])}
+    for stage, stage_info in STAGES.items():
+        if stage == 'load':
+            continue
+        params = {param: get_param_value(config, param) for param in stage_info['params']}
+        inputs = [stage_keys[input_stage] for input_stage in get_stage_inputs(config, stage)]
+        stage_keys[stage] = hash_json({'stage': stage, 'params': params, 'inputs': inputs})
+    return stage_keys
+def get_stage_path(config, stage, key):
+    """
+    This Function returns the path the output of a stage with the given key is cached in.
+    """
+    return os.path.join(config['cache_dir'], 'stages', '{}-{}.pkl'.format(stage, key))
+def prune_stage_outputs(config, stage, key):
+    """
+    This Function removes the cached outputs of a stage other than the one with the given key (the newest),
+    so changing the config does not leave an output behind for every value it had.
+    """
+    stage_dir = os.path.join(config['cache_dir'], 'stages')
+    keep_name = os.path.basename(get_stage_path(config, stage, key))
+    for name in os.listdir(stage_dir):
+        if name.startswith(stage + '-') and name.endswith('.pkl') and name != keep_name:
+            os.remove(os.path.join(stage_dir, name))
+def get_annotation(config):
+    """
+    This Function returns the genome annotation of the annotation_path and fasta_path in the config.
+    """
+    return load_annotation(config['annotation_path'], config['fasta_path'])
+def run_stage(config, stage, inputs):
+    """
+    This Function receives the config, a stage name and the outputs of the stage's inputs and runs the stage.
+    return: the output of the stage
+    """
+    if stage == 'load':
+        return load_freq_files_cached(find_freq_files(config['data_root']), config['cache_dir'], config['processes'])
+    if stage == 'arrange':
+        return Project_main.arrange_freq_df(inputs['load'], config['sample_sheet'])
+    if stage == 'mutations':
+        freq_tensor = build_freq_tensor(inputs['arrange'])
+        return {'tensor': freq_tensor, 'Mutation_df': Project_main.get_mut_column(freq_tensor)}
+    if stage == 'calls':
+        # Variant calling settings: error_model ('passage0' or 'qscore'), model ('binomial' or 'betabinomial'),
+        # alpha and concentration
+        settings = config['variant_calling']
+        if settings is None:
+            return None
+        error_model = None
+        if settings.get('error_model', 'passage0') == 'passage0':
+            error_model = build_error_model(inputs['arrange'])
+        called_df = call_variants(inputs['arrange'], error_model, settings.get('model', 'binomial'),
+                                  settings.get('alpha', 0.01), settings.get('concentration', 1000),
+                                  position_mask=load_position_mask(config['mask_path']))
+        # Only the called rows are cached, the cutoffs stage takes its mutations from them
+        return called_df[called_df['call'].to_numpy()].reset_index(drop=True)
+    if stage == 'cutoffs':
+        # With variant calling the relevant mutations are the called ones, otherwise the ones that met the cutoffs
+        if inputs['calls'] is not None:
+            return get_called_mutations(inputs['calls'])
+        position_mask = load_position_mask(config['mask_path'])
+        return Project_main.mut_cutoffs(inputs['mutations']['tensor'], config['min_cov'], config['min_freq'],
+                                        position_mask)
+    if stage == 'trajectories':
+        return build_trajectory_index(inputs['mutations']['Mutation_df'], inputs['cutoffs'])
+    if stage == 'heatmaps':
+        return build_heatmap_matrices(inputs['trajectories']['df'])
+    if stage == 'convergence':
+        # The experiments every relevant mutation met the cutoffs in, at every passage
+        return build_convergence_index(inputs['mutations']['tensor'], config['min_cov'], config['min_freq'],
+                                       load_position_mask(config['mask_path']), inputs['cutoffs'])
+    if stage == 'annotation':
+        return get_mutation_annotation_table(inputs['mutations']['Mutation_df'], get_annotation(config))
+    if stage == 'analytics':
+        trajectory_table = compute_trajectory_table(inputs['mutations']['Mutation_df'], config['min_freq'],
+                                                    config['fixation_threshold'], inputs['cutoffs'])
+        # Add the gene, codon position, amino acid change and effect of every mutation
+        trajectory_table['Full Mutation'] = trajectory_table['Full Mutation'].astype(str)
+        return trajectory_table.merge(inputs['annotation'], on='Full Mutation', how='left')
+    raise ValueError('Unknown stage: {}'.format(stage))
+def get_stage_output(config, stage, stage_keys, outputs, force=(), profile=None):
+    """
+    This Function returns the output of a stage: from the outputs already computed in this run,
+    from the stage cache, or by running the stage (its inputs are fetched the same way, so only the stages
+    that changed - and the ones after them - are run again).
+    profile - a run profile (see profiling.new_profile) to record the stages that are run in
+    """
+    if stage in outputs:
+        return outputs[stage]
+    stage_path = get_stage_path(config, stage, stage_keys[stage])
+    pickled = stage not in UNPICKLED_STAGES
+    if pickled and stage not in force and os.path.exists(stage_path):
+        with open(stage_path, 'rb') as f:
+            outputs[stage] = pickle.load(f)
+        return outputs[stage]
+    inputs = {input_stage: get_stage_output(config, input_stage, stage_keys, outputs, force, profile)
+              for input_stage in get_stage_inputs(config, stage)}
+    print('Running stage: {}'.format(stage))
+    outputs[stage] = profile_stage(profile, stage, run_stage, config, stage, inputs)
+    if pickled:
+        os.makedirs(os.path.dirname(stage_path), exist_ok=True)
+        with open(stage_path + '.tmp', 'wb') as f:
+            pickle.dump(outputs[stage], f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(stage_path + '.tmp', stage_path)
+        prune_stage_outputs(config, stage, stage_keys[stage])
+    return outputs[stage]
+def get_figure_key(config, figure, stage_keys):
+    """
+    This Function returns the key of a figure: a hash of the keys of the stages it draws from,
+    the experiment colors and the figure's settings.
+    """
+    return hash_json({'figure': figure,
+                      'inputs': [stage_keys['trajectories'], stage_keys['cutoffs'], stage_keys['annotation']],
+                      'colors': config['experiment_colors'],
+                      'settings': figure_rendering.get_figure_settings(figure, config['figures'])})
+def is_figure_cached(config, figure, figure_key):
+    """
+    This Function checks whether a figure with the given key was already rendered and its files still exist.
+    """
+    marker_path = os.path.join(config['cache_dir'], 'stages', 'figure-{}.json'.format(figure))
+    if not os.path.exists(marker_path):
+        return False
+    with open(marker_path) as f:
+        marker = json.load(f)
+    return marker['key'] == figure_key and all(os.path.exists(path) for path in marker['outputs'])
+def save_figure_marker(config, figure, figure_key, outputs):
+    """
+    This Function saves the key and the output files of a rendered figure.
+    """
+    with open(os.path.join(config['cache_dir'], 'stages', 'figure-{}.json'.format(figure)), 'w') as f:
+        json.dump({'key': figure_key, 'outputs': outputs}, f)
+def get_saved_path(output_path, fmt):
+    """
+    This Function returns the path matplotlib saves a figure to (a png is used when no format is given).
+    """
+    return output_path + '.' + (fmt or 'png')
+def run_pipeline(config, force=(), profile=None):
+    """
+    This Function receives the config and runs the pipeline: (alignments -> freq files, when an alignment_root
+    is set in the config) -> load -> arrange -> mutations -> cutoffs ->
+    trajectories -> figures (and analytics / convergence, when a trajectory_table / convergence_table path is set
+    in the config).
+    Stages and figures whose inputs did not change since the last run are not run again.
+    force - stages to run even if they are cached ('figures' renders all the figures again)
+    profile - a run profile (see profiling.new_profile) to record every stage and the figure rendering in
+    return: outputs - the output of every stage that was used in this run
+    """
+    if config['alignment_root'] is not None:
+        # Make the freq files of new or changed alignments, the load stage then sees them like any freq file
+        profile_stage(profile, 'freq_files', update_freq_files, config['alignment_root'], config['data_root'],
+                      config['fasta_path'], config['processes'])
+    stage_keys = get_stage_keys(config)
+    outputs = {}
+    os.makedirs(config['export_path'], exist_ok=True)
+    os.makedirs(os.path.join(config['cache_dir'], 'stages'), exist_ok=True)
+    if config['trajectory_table'] is not None:
+        trajectory_table = get_stage_output(config, 'analytics', stage_keys, outputs, force, profile)
+        trajectory_table.to_csv(config['trajectory_table'], index=False)
+    if config['convergence_table'] is not None:
+        # The mutations found in 2 experiments or more at a passage
+        convergence_index = get_stage_output(config, 'convergence', stage_keys, outputs, force, profile)
+        get_convergence_table(convergence_index).to_csv(config['convergence_table'], index=False)
+    # Find the figures whose inputs changed
+    figure_keys = {}
+    for figure in config['figures']:
+        figure_key = get_figure_key(config, figure, stage_keys)
+        if 'figures' not in force and not set(force) & set(STAGES) and is_figure_cached(config, figure, figure_key):
+            print('Figure is up to date: {}'.format(figure))
+        else:
+            figure_keys[figure] = figure_key
+    if not figure_keys:
+        return outputs
+    trajectory_index = get_stage_output(config, 'trajectories', stage_keys, outputs, force, profile)
+    mut_lst = get_stage_output(config, 'cutoffs', stage_keys, outputs, force, profile)
+    if 'heatmap' in figure_keys:
+        # Re-styling the heatmap only draws it again, the matrices come from the stage cache
+        trajectory_index['heatmap_matrices'] = get_stage_output(config, 'heatmaps', stage_keys, outputs, force, profile)
+    convergence_index = None
+    if 'convergence' in figure_keys:
+        convergence_index = get_stage_output(config, 'convergence', stage_keys, outputs, force, profile)
+    # Render all the figures that changed in one process pool
+    jobs = {figure: figure_rendering.make_render_jobs(trajectory_index, mut_lst, config['experiment_colors'],
+                                                      config['export_path'], [figure], config['figures'],
+                                                      get_annotation(config), convergence_index)
+            for figure in figure_keys}
+    print('Rendering figures: {}'.format(', '.join(figure_keys)))
+    output_paths = profile_stage(profile, 'figures', figure_rendering.render_figures, sum(jobs.values(), []),
+                                 config['processes'], profile)
+    for figure, figure_key in figure_keys.items():
+        figure_paths, output_paths = output_paths[:len(jobs[figure])], output_paths[len(jobs[figure]):]
+        fmt = figure_rendering.get_figure_settings(figure, config['figures'])['fmt']
+        save_figure_marker(config, figure, figure_key, [get_saved_path(path, fmt) for path in figure_paths])
+    return outputs
+
+
+## Main Code
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the MS2 mutation analysis pipeline from a json config file.')
+    parser.add_argument('config', help='path of the json config file (see pipeline_config.json)')
+    parser.add_argument('--force', nargs='*', default=[], choices=list(STAGES) + ['figures'],
+                        help='stages to run again even if their output is cached')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='REPORT',
+                        help='record the time and memory of every stage (default report: <export_path>/profile.json)')
+    parser.add_argument('--cprofile', nargs='*', default=[],
+                        help='stages to also run under cProfile (saved next to the report as <stage>.prof): '
+                             '{}, or figure-<file name> for one figure (e.g. figure-Figure3)'
+                             .format(', '.join(list(STAGES) + ['figures', 'freq_files'])))
+    args = parser.parse_args()
+    config = load_config(args.config)
+    if args.profile is None and not args.cprofile:
+        run_pipeline(config, args.force)
+    else:
+        report_path = args.profile or os.path.join(config['export_path'], 'profile.json')
+        run_profile = new_profile(output_dir=os.path.dirname(os.path.abspath(report_path)),
+                                  cprofile_stages=args.cprofile)
+        run_pipeline(config, args.force, run_profile)
+        write_profile_report(run_profile, report_path)
@@ -0,0 +1,153 @@
+## Libraries
+import os
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows, the RSS columns are left empty there
+    resource = None
+
+## Constants
+SUMMARY_COLUMNS = ['stage', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_mb', 'rss_mb', 'max_rss_mb',
+                   'children_max_rss_mb', 'rows']
+# The peak memory of every stage that is running (outermost first) as seen before its nested stages reset the
+# tracemalloc peak, so a stage's peak also covers the stages it ran
+OPEN_STAGE_PEAKS = []
+
+
+## Functions
+def new_profile(enabled=True, output_dir='.', cprofile_stages=(), trace_memory=True):
+    """
+    This Function returns a new run profile (pass it to profile_stage for every step of a run):
+    enabled - when False profile_stage only calls the functions, so the switch costs nothing
+    output_dir - the folder the cProfile dumps are saved to
+    cprofile_stages - names of the stages to also run under cProfile (saved as <output_dir>/<stage>.prof)
+    trace_memory - record the peak memory allocated by every stage with tracemalloc (slows the stages a little)
+    """
+    return {'enabled': enabled, 'output_dir': output_dir, 'cprofile_stages': set(cprofile_stages),
+            'trace_memory': trace_memory, 'stages': []}
+def get_rss_mb():
+    """
+    This Function returns the current resident memory of the process in MB (None when it can't be read).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+def get_max_rss_mb(who='self'):
+    """
+    This Function returns the highest resident memory the process reached so far in MB (None without resource).
+    who - 'self', or 'children' for the largest of the finished child processes (e.g. process pool workers)
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+def get_children_cpu_s():
+    """
+    This Function returns the CPU time (user + system) of the finished child processes so far (None without resource).
+    Process pool workers are counted once the pool is shut down.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+def get_rows(result):
+    """
+    This Function returns the number of rows of a stage's result (a df, a list or a dict holding a df),
+    or None when the result has no rows.
+    """
+    if isinstance(result, dict):
+        for key in ['df', 'Mutation_df']:
+            if key in result:
+                return get_rows(result[key])
+        return None
+    if hasattr(result, '__len__') and not isinstance(result, str):
+        return len(result)
+    return None
+def profile_stage(profile, stage, function, /, *args, **kwargs):
+    """
+    This Function receives a run profile, a stage name and a function with its arguments, runs the function
+    and records its wall time, CPU time, peak memory (tracemalloc), resident memory and number of result rows
+    in the profile. Without a profile (None, or a disabled one) it only runs the function.
+    The arguments of profile_stage itself are positional only, so the function can take a 'profile' keyword too.
+    The CPU time includes the child processes the stage ran (children_cpu_s, e.g. a process pool). tracemalloc only
+    sees this process, so the memory of the workers is in children_max_rss_mb (the largest worker of the run so far).
+    return: the result of the function
+    """
+    if profile is None or not profile['enabled']:
+        return function(*args, **kwargs)
+    trace_memory = profile['trace_memory']
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif trace_memory:
+        # Keep the peak of the stage this one runs in before resetting it
+        if OPEN_STAGE_PEAKS:
+            OPEN_STAGE_PEAKS[-1] = max(OPEN_STAGE_PEAKS[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    OPEN_STAGE_PEAKS.append(0)
+    profiler = cProfile.Profile() if stage in profile['cprofile_stages'] else None
+    wall_start, cpu_start, children_cpu_start = time.perf_counter(), time.process_time(), get_children_cpu_s()
+    try:
+        if profiler is not None:
+            result = profiler.runcall(function, *args, **kwargs)
+        else:
+            result = function(*args, **kwargs)
+    finally:
+        peak = max(OPEN_STAGE_PEAKS.pop(), tracemalloc.get_traced_memory()[1] if trace_memory else 0)
+    wall_s, cpu_s = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    children_cpu_s = None if children_cpu_start is None else get_children_cpu_s() - children_cpu_start
+    if OPEN_STAGE_PEAKS:
+        OPEN_STAGE_PEAKS[-1] = max(OPEN_STAGE_PEAKS[-1], peak)
+    record = {'stage': stage, 'wall_s': wall_s, 'cpu_s': cpu_s + (children_cpu_s or 0),
+              'children_cpu_s': children_cpu_s,
+              'peak_mb': peak / 2 ** 20 if trace_memory else None,
+              'rss_mb': get_rss_mb(), 'max_rss_mb': get_max_rss_mb(),
+              'children_max_rss_mb': get_max_rss_mb('children'), 'rows': get_rows(result)}
+    if started_tracing:
+        tracemalloc.stop()
+    if profiler is not None:
+        os.makedirs(profile['output_dir'], exist_ok=True)
+        record['cprofile'] = os.path.join(profile['output_dir'], '{}.prof'.format(stage))
+        profiler.dump_stats(record['cprofile'])
+    profile['stages'].append(record)
+    return result
+def get_profile_settings(profile):
+    """
+    This Function returns the settings of a run profile without its records, to profile a job in another process
+    (see new_profile(**settings)).
+    """
+    return {'enabled': profile['enabled'], 'output_dir': profile['output_dir'],
+            'cprofile_stages': sorted(profile['cprofile_stages']), 'trace_memory': profile['trace_memory']}
+def format_profile_summary(profile):
+    """
+    This Function receives a run profile and returns a summary table of its stages (slowest first) as text.
+    """
+    row_format = '{:<28} {:>9} {:>9} {:>14} {:>9} {:>9} {:>10} {:>19} {:>10}'
+    lines = [row_format.format(*SUMMARY_COLUMNS)]
+    for record in sorted(profile['stages'], key=lambda record: record['wall_s'], reverse=True):
+        values = [record[column] for column in SUMMARY_COLUMNS[1:]]
+        texts = ['-' if value is None else '{:.2f}'.format(value) if isinstance(value, float) else str(value)
+                 for value in values]
+        lines.append(row_format.format(record['stage'], *texts))
+    # The figure records are parts of the figures stage, so they are not added to the total
+    total = sum(record['wall_s'] for record in profile['stages'] if not record.get('part_of'))
+    lines.append('{:<28} {:>9.2f}'.format('total', total))
+    return '\n'.join(lines)
+def write_profile_report(profile, report_path):
+    """
+    This Function receives a run profile and saves it as a json report (the stages in the order they ran),
+    and prints the summary table.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump({'stages': profile['stages'], 'cprofile_stages': sorted(profile['cprofile_stages'])}, f, indent=1)
+    print(format_profile_summary(profile))
+    print('Profile report saved to {}'.format(report_path))
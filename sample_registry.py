@@ -0,0 +1,161 @@
+## Libraries
+import os
+import re
+import numpy as np
+import pandas as pd
+
+## Constants
+# The Passage, Line and MOI of the samples bundled under DATA/ (their names do not hold them)
+DEFAULT_SAMPLE_SHEET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Files on Freqs', 'sample_sheet.csv')
+# The sample columns read from a sample name (or a sample sheet)
+SAMPLE_COLUMNS = ['Passage', 'Line', 'MOI']
+INT_SAMPLE_COLUMNS = ['Passage', 'MOI']
+# The number after the first "p", the letter after it and the number after "moi" (e.g. p10A_moi1_parallel)
+PASSAGE_PATTERN = re.compile(r'p(\d+)')
+LINE_PATTERN = re.compile(r'p\d+([A-Za-z])')
+MOI_PATTERN = re.compile(r'moi(\d+)')
+# The leading token of Shir's sample names (e.g. p10-B_founder_effect): the passage, a hyphen and a single
+# capitalized line letter
+SHIR_NAME_PATTERN = re.compile(r'^(p\d+)-([A-Z])(?![A-Za-z0-9])')
+
+
+## Functions
+def fix_sample_name(sample_id, done_by):
+    """
+    This Function receives a sample ID and the scientist that did the experiment and returns the sample name
+    in Carmel's format: Shir's names (e.g. p10-B_founder_effect) lose the hyphen after the number and get
+    "_moi10_" after the capitalized letter (p10B_moi10__founder_effect). Other names (including Shir's names
+    that are not in this format, e.g. Shir0A or p10-Bx) are returned as they are.
+    """
+    if done_by == 'Shir':
+        # Remove the hyphen after the number and insert "_moi10_" after the line letter
+        return SHIR_NAME_PATTERN.sub(r'\1\2_moi10_', sample_id, count=1)
+    return sample_id
+def parse_sample_name(sample_name):
+    """
+    This Function receives a sample name and returns a dictionary of its Passage, Line and MOI
+    (None for the ones that are not in the name).
+    """
+    passage = PASSAGE_PATTERN.search(sample_name)
+    line = LINE_PATTERN.search(sample_name)
+    moi = MOI_PATTERN.search(sample_name)
+    return {'Passage': int(passage.group(1)) if passage else None, 'Line': line.group(1) if line else None,
+            'MOI': int(moi.group(1)) if moi else None}
+def read_sample_sheet(sheet_paths):
+    """
+    This Function receives the path of a sample sheet csv (or a list of paths) and returns it as a df indexed by
+    the sample ID ('File' column, the freq file name without extension). The other columns are optional:
+    Passage, Line, MOI and Done_by - the values that are missing are read from the sample name.
+    A sample shared by several experiments (e.g. the passage 0 stock of all the lines) is listed once per experiment.
+    Lines starting with '#' are comments.
+    The sample lists in 'Files on Freqs/unique_exp_*.csv' are sample sheets with only the 'File' column.
+    return: sample_sheet
+    """
+    if isinstance(sheet_paths, str):
+        sheet_paths = [sheet_paths]
+    sheets = [pd.read_csv(path, dtype={'File': str, 'Line': str, 'Done_by': str}, comment='#').assign(sheet=index)
+              for index, path in enumerate(sheet_paths)]
+    sample_sheet = pd.concat(sheets, ignore_index=True)
+    columns = [column for column in SAMPLE_COLUMNS + ['Done_by'] if column in sample_sheet.columns]
+    # A sample listed in more than one sheet takes the rows of the last one
+    last_sheet = sample_sheet.groupby('File')['sheet'].transform('max')
+    sample_sheet = sample_sheet[sample_sheet['sheet'] == last_sheet][['File'] + columns].drop_duplicates()
+    sample_sheet = sample_sheet.set_index('File')
+    return sample_sheet.astype(object).where(sample_sheet.notna(), None)
+def get_sample_codes(df, columns=('File', 'Done_by')):
+    """
+    This Function receives a freq df and the columns that tell its samples apart (by default 'File' and 'Done_by',
+    so two scientists can use the same file name) and returns the sample of every row:
+    sample_codes - an integer code per row
+    samples - a df with one row per sample (its values of the columns), in the order of the codes
+    The codes are built from the codes of the categorical columns, so no string is read per row.
+    """
+    categoricals = [df[column].astype('category') for column in columns]
+    # Missing values get the code -1, so every code is shifted by one
+    dims = [len(categorical.cat.categories) + 1 for categorical in categoricals]
+    combined_codes = np.ravel_multi_index([categorical.cat.codes.to_numpy(dtype='int64') + 1
+                                           for categorical in categoricals], dims)
+    unique_codes, sample_codes = np.unique(combined_codes, return_inverse=True)
+    column_codes = np.unravel_index(unique_codes, dims)
+    samples = pd.DataFrame({column: np.append(categorical.cat.categories.to_numpy(dtype=object), None)[codes - 1]
+                            for column, categorical, codes in zip(columns, categoricals, column_codes)})
+    return sample_codes.reshape(-1), samples
+def build_sample_registry(samples, sample_sheet=None, fix_names=True):
+    """
+    This Function receives a df of samples ('File' and 'Done_by', see get_sample_codes) and optionally a sample sheet
+    (see read_sample_sheet) and returns the sample registry - one row per sample and experiment with the index of the
+    sample ('sample'), its fixed name ('File'), Done_by, Passage, Line, MOI and Experiment (Done_by-MOI-Line).
+    A sample has one row, or one per row the sample sheet lists it on (e.g. a stock shared by several experiments).
+    Every sample name is parsed once, and only for the values the sample sheet does not give
+    (a sample the sheet gives every value of keeps its name as it is).
+    fix_names - bring Shir's names to Carmel's format (see fix_sample_name)
+    return: registry
+    """
+    records = []
+    for sample, (sample_id, done_by) in enumerate(zip(samples['File'], samples['Done_by'])):
+        sheet_rows = [{}]
+        if sample_sheet is not None and sample_id in sample_sheet.index:
+            sheet_rows = [{key: value for key, value in row.items() if value is not None}
+                          for row in sample_sheet.loc[[sample_id]].to_dict('records')]
+        for sheet_row in sheet_rows:
+            sample_done_by = sheet_row.get('Done_by', done_by)
+            from_sheet = not set(SAMPLE_COLUMNS) - set(sheet_row)
+            sample_name = fix_sample_name(sample_id, sample_done_by) if fix_names and not from_sheet else sample_id
+            record = {'sample': sample, 'File': sample_name, 'Done_by': sample_done_by}
+            record.update({} if from_sheet else parse_sample_name(sample_name))
+            record.update({column: sheet_row[column] for column in SAMPLE_COLUMNS if column in sheet_row})
+            records.append(record)
+    registry = pd.DataFrame(records, columns=['sample', 'File', 'Done_by'] + SAMPLE_COLUMNS)
+    missing = registry[registry[SAMPLE_COLUMNS].isna().any(axis=1)]
+    if len(missing):
+        raise ValueError('Could not read the Passage, Line and MOI of the samples: {} (add them to a sample sheet)'
+                         .format(', '.join(missing['File'])))
+    for column in INT_SAMPLE_COLUMNS:
+        registry[column] = registry[column].astype('int64')
+    registry['Line'] = registry['Line'].astype(str)
+    registry['Experiment'] = registry['Done_by'].astype(str) + '-' + registry['MOI'].astype(str) + '-' + \
+                             registry['Line']
+    return registry
+def get_registry_rows(sample_codes, registry_samples):
+    """
+    This Function receives the sample code of every row of a freq df and the sample of every registry row
+    and returns the rows of the df repeated once per registry row of their sample:
+    row_idx - the df row of every output row
+    registry_codes - the registry row of every output row
+    """
+    order = np.argsort(sample_codes, kind='stable')
+    sample_rows = np.split(order, np.cumsum(np.bincount(sample_codes, minlength=registry_samples.max() + 1))[:-1])
+    row_idx = np.concatenate([sample_rows[sample] for sample in registry_samples])
+    registry_codes = np.repeat(np.arange(len(registry_samples)), [len(sample_rows[sample])
+                                                                  for sample in registry_samples])
+    return row_idx, registry_codes
+def attach_sample_metadata(df, sample_sheet=None, columns=None, fix_names=True):
+    """
+    This Function receives a freq df with 'File' and 'Done_by' columns and optionally a sample sheet (a df or the
+    path(s) of the csv, see read_sample_sheet) and returns a copy of the df with the columns of the sample registry
+    (by default File, Done_by, Passage, Line, MOI and Experiment).
+    The registry is built once per sample and joined on the sample code of every row: Passage and MOI as integers,
+    the other columns as categories. The rows of a sample of several experiments are copied once per experiment.
+    return: df_arranged
+    """
+    if sample_sheet is not None and not isinstance(sample_sheet, pd.DataFrame):
+        sample_sheet = read_sample_sheet(sample_sheet)
+    sample_codes, samples = get_sample_codes(df)
+    registry = build_sample_registry(samples, sample_sheet, fix_names)
+    if columns is None:
+        columns = [column for column in registry.columns if column != 'sample']
+    if len(registry) == len(samples):
+        # One registry row per sample, in the order of the sample codes (the columns of the df are not copied,
+        # so memory-mapped columns stay on disk)
+        df_arranged = df.copy(deep=False)
+        registry_codes = sample_codes
+    else:
+        row_idx, registry_codes = get_registry_rows(sample_codes, registry['sample'].to_numpy())
+        df_arranged = df.iloc[row_idx].reset_index(drop=True)
+    for column in columns:
+        if column in INT_SAMPLE_COLUMNS:
+            df_arranged[column] = registry[column].to_numpy()[registry_codes]
+        else:
+            codes, categories = pd.factorize(registry[column])
+            df_arranged[column] = pd.Categorical.from_codes(codes[registry_codes], categories=categories)
+    return df_arranged
@@ -0,0 +1,6 @@
+## Libraries
+import os
+import sys
+
+# The tests import the project's modules from the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
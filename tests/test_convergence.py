@@ -0,0 +1,100 @@
+## Libraries
+import numpy as np
+import pandas as pd
+from freq_loading import BASES
+from freq_tensor import build_freq_tensor
+from convergence import build_convergence_index, find_shared, find_convergent, get_experiment_mask, \
+    pack_bits, unpack_bits, count_bits
+
+## Constants
+# More than 64 experiments, so the bitsets take two words
+N_EXPERIMENTS = 70
+PASSAGES = [0, 5]
+N_POSITIONS = 30
+MIN_COVERAGE = 100
+MIN_FREQUENCY = 0.05
+
+
+## Functions
+def make_freq_df(rng):
+    """
+    This Function returns a random freq df (after arrange_freq_df) of N_EXPERIMENTS experiments at every passage,
+    with a few experiments missing a passage. Every MOI-10 experiment has the same mutation at position 1,
+    which no MOI-1 experiment has.
+    """
+    rows = []
+    ref_bases = rng.integers(0, 4, N_POSITIONS)
+    for experiment in range(N_EXPERIMENTS):
+        for passage in PASSAGES:
+            if rng.random() < 0.1:
+                continue
+            coverage = rng.integers(50, 300, N_POSITIONS)
+            frequency = np.where(rng.random((N_POSITIONS, len(BASES))) < 0.1, rng.uniform(0, 0.2,
+                                                                                         (N_POSITIONS, len(BASES))), 0)
+            frequency[0] = 0
+            if experiment % 2:
+                frequency[0, (ref_bases[0] + 1) % 4] = 0.5
+            base_count = np.round(frequency * coverage[:, None] * 20).astype(int)
+            rows.append(pd.DataFrame({
+                'ref_pos': np.repeat(np.arange(1, N_POSITIONS + 1), len(BASES)).astype(float),
+                'read_base': np.tile(BASES, N_POSITIONS), 'ref_base': np.repeat(np.array(BASES)[ref_bases], len(BASES)),
+                'base_count': base_count.ravel(), 'coverage': np.repeat(coverage, len(BASES)),
+                'frequency': frequency.ravel().astype('float32'), 'File': 'p{}-E{}'.format(passage, experiment),
+                'Done_by': 'Test', 'Passage': passage, 'Line': str(experiment), 'MOI': 10 if experiment % 2 else 1,
+                'Experiment': 'Test-{}'.format(experiment)}))
+    return pd.concat(rows, ignore_index=True)
+def get_brute_force_sets(freq_df):
+    """
+    This Function returns the set of experiments every (passage, mutation) met the cutoffs in, row by row.
+    """
+    passed = freq_df[(freq_df['base_count'] >= MIN_COVERAGE) & (freq_df['frequency'] >= MIN_FREQUENCY) &
+                     (freq_df['base_count'] > 0) & (freq_df['read_base'] != freq_df['ref_base'])]
+    sets = {}
+    for row in passed.itertuples():
+        mutation = '{}{}{}'.format(row.ref_base, row.ref_pos, row.read_base)
+        sets.setdefault((row.Passage, mutation), set()).add(row.Experiment)
+    return sets
+def get_index_sets(convergence_index, selected=None):
+    """
+    This Function returns the set of experiments of every key of a convergence index.
+    """
+    found = unpack_bits(convergence_index['bits'], len(convergence_index['experiments']))
+    selected = np.ones(len(found), dtype=bool) if selected is None else selected
+    return {(convergence_index['passages'][passage], convergence_index['mutations'][mutation]):
+            set(convergence_index['experiments'][row])
+            for passage, mutation, row, keep in zip(convergence_index['key_passage'], convergence_index['key_mutation'],
+                                                    found, selected) if keep}
+def test_pack_bits_round_trip():
+    bool_matrix = np.random.default_rng(0).random((20, 130)) < 0.3
+    bits = pack_bits(bool_matrix)
+    assert bits.shape == (20, 3)
+    assert (unpack_bits(bits, 130) == bool_matrix).all()
+    assert (count_bits(bits) == bool_matrix.sum(axis=1)).all()
+def test_convergence_index_matches_brute_force():
+    freq_df = make_freq_df(np.random.default_rng(1))
+    no_mask = np.zeros(N_POSITIONS + 1, dtype=bool)
+    brute_force = get_brute_force_sets(freq_df)
+    mut_df = freq_df[freq_df['read_base'] != freq_df['ref_base']]
+    mut_df = mut_df.assign(**{'Full Mutation': mut_df['ref_base'] + mut_df['ref_pos'].astype(str) +
+                              mut_df['read_base']})
+    for data in [build_freq_tensor(freq_df), mut_df]:
+        convergence_index = build_convergence_index(data, MIN_COVERAGE, MIN_FREQUENCY, no_mask)
+        assert get_index_sets(convergence_index) == brute_force
+        # Shared by at least 3 experiments
+        assert set(get_index_sets(convergence_index, find_shared(convergence_index, 3))) == \
+               {key for key, experiments in brute_force.items() if len(experiments) >= 3}
+def test_find_convergent_matches_brute_force():
+    freq_df = make_freq_df(np.random.default_rng(2))
+    convergence_index = build_convergence_index(build_freq_tensor(freq_df), MIN_COVERAGE, MIN_FREQUENCY,
+                                                np.zeros(N_POSITIONS + 1, dtype=bool))
+    include, exclude = get_experiment_mask(convergence_index, MOI=10), get_experiment_mask(convergence_index, MOI=1)
+    moi_10 = set(freq_df.loc[freq_df['MOI'] == 10, 'Experiment'])
+    # The MOI-10 experiments that have a sample of every passage
+    sampled = {passage: set(experiments) & moi_10
+               for passage, experiments in freq_df.groupby('Passage')['Experiment'].unique().items()}
+    expected = {key for key, experiments in get_index_sets(convergence_index).items()
+                if sampled[key[0]] <= experiments and not experiments - moi_10}
+    found = set(get_index_sets(convergence_index, find_convergent(convergence_index, include, exclude)))
+    assert found == expected
+    # The planted mutation is found at every passage
+    assert {passage for passage, mutation in found if mutation[1:-1] == '1.0'} == set(PASSAGES)
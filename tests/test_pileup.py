@@ -0,0 +1,89 @@
+## Libraries
+import gzip
+import struct
+import numpy as np
+import pandas as pd
+from pileup import alignment_to_freq_df, CIGAR_OPS
+
+## Constants
+REFERENCE = 'ACGTACGTACGTACGTACGT'
+# (name, flag, 1-based pos, mapq, cigar, seq, qual): an insertion of G after position 4 and a deletion of
+# positions 8-9, a read with a soft clip, a mismatch at position 5 and a low quality base at position 7,
+# and an unmapped read that must be skipped
+RECORDS = [('read1', 0, 1, 60, '4M1I3M2D4M', 'ACGTGACGCGTA', 'IIIIIIIIIIII'),
+           ('read2', 0, 3, 60, '2S6M', 'NNGTTCGT', 'IIIIII#I'),
+           ('read3', 4, 1, 0, '4M', 'ACGT', 'IIII')]
+BAM_NIBBLES = '=ACMGRSVTWYHKDBN'
+
+
+## Functions
+def parse_cigar_text(cigar):
+    """
+    This Function receives a CIGAR string and returns a list of (length, op) pairs.
+    """
+    pairs, number = [], ''
+    for char in cigar:
+        if char.isdigit():
+            number += char
+        else:
+            pairs.append((int(number), char))
+            number = ''
+    return pairs
+def write_sam(path):
+    """
+    This Function saves RECORDS as a SAM file aligned to REFERENCE.
+    """
+    with open(path, 'w') as f:
+        f.write('@SQ\tSN:ref\tLN:{}\n'.format(len(REFERENCE)))
+        for name, flag, pos, mapq, cigar, seq, qual in RECORDS:
+            f.write('\t'.join([name, str(flag), 'ref', str(pos), str(mapq), cigar, '*', '0', '0', seq, qual]) + '\n')
+def write_bam(path):
+    """
+    This Function saves RECORDS as a BAM file (one gzip stream, which is how read_bam_records reads BGZF).
+    """
+    header = '@SQ\tSN:ref\tLN:{}\n'.format(len(REFERENCE)).encode()
+    data = b'BAM\x01' + struct.pack('<i', len(header)) + header + struct.pack('<i', 1)
+    data += struct.pack('<i', 4) + b'ref\x00' + struct.pack('<i', len(REFERENCE))
+    for name, flag, pos, mapq, cigar, seq, qual in RECORDS:
+        name_bytes = name.encode() + b'\x00'
+        cigar_pairs = parse_cigar_text(cigar)
+        codes = [BAM_NIBBLES.index(base) for base in seq] + [0]
+        packed = bytes((codes[i] << 4) | codes[i + 1] for i in range(0, len(seq), 2))
+        body = struct.pack('<iiBBHHHiiii', 0, pos - 1, len(name_bytes), mapq, 0, len(cigar_pairs), flag, len(seq),
+                           -1, -1, 0)
+        body += name_bytes + b''.join(struct.pack('<I', length << 4 | CIGAR_OPS.index(op))
+                                      for length, op in cigar_pairs)
+        body += packed + bytes(ord(char) - 33 for char in qual)
+        data += struct.pack('<i', len(body)) + body
+    with gzip.open(path, 'wb') as f:
+        f.write(data)
+def get_row(freq_df, ref_pos, read_base):
+    """
+    This Function returns the row of a freq table at a position and read base.
+    """
+    return freq_df[(freq_df['ref_pos'] == ref_pos) & (freq_df['read_base'] == read_base)].iloc[0]
+def test_sam_and_bam_give_the_same_freq_table(tmp_path):
+    write_sam(str(tmp_path / 'sample.sam'))
+    write_bam(str(tmp_path / 'sample.bam'))
+    sam_df = alignment_to_freq_df(str(tmp_path / 'sample.sam'), REFERENCE)
+    bam_df = alignment_to_freq_df(str(tmp_path / 'sample.bam'), REFERENCE)
+    pd.testing.assert_frame_equal(sam_df, bam_df)
+def test_pileup_counts_insertions_deletions_and_mismatches(tmp_path):
+    write_sam(str(tmp_path / 'sample.sam'))
+    freq_df = alignment_to_freq_df(str(tmp_path / 'sample.sam'), REFERENCE)
+    # 5 rows per position and one row for the inserted G
+    assert len(freq_df) == len(REFERENCE) * 5 + 1
+    insertion = get_row(freq_df, 4.001, 'G')
+    assert insertion['ref_base'] == '-' and insertion['base_count'] == 1
+    for ref_pos in [8, 9]:
+        deletion = get_row(freq_df, ref_pos, '-')
+        assert deletion['base_count'] == 1 and np.isinf(deletion['avg_qscore'])
+    # Position 5 is A in read1 and T in read2
+    assert get_row(freq_df, 5, 'A')['frequency'] == 0.5
+    assert get_row(freq_df, 5, 'T')['frequency'] == 0.5
+    assert get_row(freq_df, 5, 'T')['avg_qscore'] == 40
+    # The G of read2 at position 7 is below the quality cutoff, only read1 is counted
+    assert get_row(freq_df, 7, 'G')['coverage'] == 1
+    # The soft clipped bases and the unmapped read are not counted
+    assert get_row(freq_df, 1, 'A')['base_count'] == 1
+    assert get_row(freq_df, 16, 'T')['base_count'] == 0
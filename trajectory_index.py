@@ -0,0 +1,49 @@
+## Constants
+INDEX_COLUMNS = ['Full Mutation', 'Experiment', 'Passage', 'frequency', 'ref_pos']
+
+
+## Functions
+def build_trajectory_index(df, mutation_lst=None):
+    """
+    This Function receives a mutants df and optionally a list of mutations and builds an index of the trajectories:
+    the rows are sorted once by (mutation, experiment, passage), so every (experiment, mutation) trajectory
+    and every mutation are a contiguous block that can be taken as a slice.
+    return: trajectory_index - a dictionary holding:
+    df - the sorted rows (Full Mutation, Experiment, Passage, frequency, ref_pos)
+    pairs - (experiment, mutation) -> slice of the rows of that trajectory
+    mutations - mutation -> slice of the rows of that mutation in all experiments
+    experiments - the sorted list of the experiments (including ones where none of the mutations were found)
+    """
+    experiments = sorted(df['Experiment'].unique())
+    if mutation_lst is not None:
+        df = df[df['Full Mutation'].isin(mutation_lst)]
+    columns = [column for column in INDEX_COLUMNS if column in df.columns]
+    sorted_df = df[columns].sort_values(['Full Mutation', 'Experiment', 'Passage'], kind='stable')
+    sorted_df = sorted_df.reset_index(drop=True)
+    pairs = {}
+    for (mutation, experiment), rows in sorted_df.groupby(['Full Mutation', 'Experiment'], sort=False,
+                                                          observed=True).indices.items():
+        pairs[(experiment, mutation)] = slice(rows[0], rows[-1] + 1)
+    mutations = {}
+    for mutation, rows in sorted_df.groupby('Full Mutation', sort=False, observed=True).indices.items():
+        mutations[mutation] = slice(rows[0], rows[-1] + 1)
+    return {'df': sorted_df, 'pairs': pairs, 'mutations': mutations, 'experiments': experiments}
+def get_trajectory(trajectory_index, experiment, mutation):
+    """
+    This Function receives a trajectory index, an experiment and a mutation and returns the (Passage, frequency)
+    rows of that mutation in that experiment, sorted by passage (an empty df if the mutation was not found).
+    """
+    rows = trajectory_index['pairs'].get((experiment, mutation), slice(0, 0))
+    return trajectory_index['df'].iloc[rows]
+def get_mutation_trajectories(trajectory_index, mutation):
+    """
+    This Function receives a trajectory index and a mutation and returns the rows of that mutation in all experiments.
+    """
+    rows = trajectory_index['mutations'].get(mutation, slice(0, 0))
+    return trajectory_index['df'].iloc[rows]
+def count_passages(trajectory_index):
+    """
+    This Function receives a trajectory index and returns a series of mutation -> number of different passages
+    it was found in (computed in one groupby over the index).
+    """
+    return trajectory_index['df'].groupby('Full Mutation', observed=True)['Passage'].nunique()
@@ -0,0 +1,77 @@
+## Libraries
+import numpy as np
+
+## Constants
+KEYS = ['Experiment', 'Full Mutation']
+DEFAULT_FIXATION_THRESHOLD = 0.5
+
+
+## Functions
+def compute_trajectory_table(mut_df, min_frequency, fixation_threshold=DEFAULT_FIXATION_THRESHOLD, mutation_lst=None):
+    """
+    This Function receives a mutants df, the frequency a mutation is considered detected at, the frequency it is
+    considered fixed at and optionally a list of mutations, and returns one tidy row per (Experiment, Full Mutation):
+    n_passages - number of passages the mutation was read in (in that experiment)
+    mutation_passages - number of passages the mutation was read in (in all experiments)
+    first_passage - the first passage it was detected in (frequency >= min_frequency)
+    max_frequency, max_passage - its highest frequency and the passage it was reached in
+    slope - the slope of a linear fit of frequency on passage
+    fixation_passage - the first passage its frequency was >= fixation_threshold
+    time_to_fixation - the number of passages from first detection to fixation
+    n_experiments, n_mois - the number of experiments (lines) and of different MOIs the mutation was detected in
+    shared_across_lines, shared_across_mois - whether it was detected in more than one line / MOI
+    Every metric is computed with whole-column operations and groupby aggregations (no loop over mutations).
+    return: trajectory_table
+    """
+    if mutation_lst is not None:
+        mut_df = mut_df[mut_df['Full Mutation'].isin(mutation_lst)]
+    columns = [column for column in KEYS + ['Passage', 'frequency', 'MOI'] if column in mut_df.columns]
+    df = mut_df[columns].reset_index(drop=True)
+    passage = df['Passage'].to_numpy(dtype=float)
+    frequency = df['frequency'].to_numpy(dtype=float)
+    # Columns for the linear fit: slope = (n*Sxy - Sx*Sy) / (n*Sxx - Sx^2)
+    df['xy'] = passage * frequency
+    df['xx'] = passage * passage
+    df['detected_passage'] = np.where(frequency >= min_frequency, passage, np.nan)
+    df['fixed_passage'] = np.where(frequency >= fixation_threshold, passage, np.nan)
+    grouped = df.groupby(KEYS, observed=True, sort=True)
+    trajectory_table = grouped.agg(n_passages=('Passage', 'nunique'), n=('Passage', 'size'),
+                                   sum_x=('Passage', 'sum'), sum_y=('frequency', 'sum'), sum_xy=('xy', 'sum'),
+                                   sum_xx=('xx', 'sum'), first_passage=('detected_passage', 'min'),
+                                   max_frequency=('frequency', 'max'), fixation_passage=('fixed_passage', 'min'))
+    trajectory_table['max_passage'] = df['Passage'].to_numpy()[grouped['frequency'].idxmax().to_numpy()]
+    n, sum_x, sum_y = trajectory_table['n'], trajectory_table['sum_x'], trajectory_table['sum_y']
+    denominator = n * trajectory_table['sum_xx'] - sum_x ** 2
+    trajectory_table['slope'] = (n * trajectory_table['sum_xy'] - sum_x * sum_y) / denominator.where(denominator != 0)
+    trajectory_table['time_to_fixation'] = trajectory_table['fixation_passage'] - trajectory_table['first_passage']
+    trajectory_table = trajectory_table.drop(columns=['n', 'sum_x', 'sum_y', 'sum_xy', 'sum_xx']).reset_index()
+    # Sharing across experiments - per mutation, over the experiments it was detected in
+    # (the columns can be categoricals of different code widths, so the per-mutation values are looked up by label)
+    mutation_labels = trajectory_table['Full Mutation'].astype(str)
+    mutation_passages = df.groupby('Full Mutation', observed=True)['Passage'].nunique()
+    trajectory_table['mutation_passages'] = mutation_passages.reindex(mutation_labels).to_numpy()
+    detected = trajectory_table['first_passage'].notna()
+    n_experiments = trajectory_table[detected].groupby('Full Mutation', observed=True)['Experiment'].nunique()
+    trajectory_table['n_experiments'] = n_experiments.reindex(mutation_labels, fill_value=0).to_numpy()
+    if 'MOI' in df.columns:
+        experiment_moi = df.drop_duplicates('Experiment').set_index('Experiment')['MOI']
+        trajectory_table['MOI'] = experiment_moi.reindex(trajectory_table['Experiment'].astype(str)).to_numpy()
+        n_mois = trajectory_table[detected].groupby('Full Mutation', observed=True)['MOI'].nunique()
+        trajectory_table['n_mois'] = n_mois.reindex(mutation_labels, fill_value=0).to_numpy()
+        trajectory_table['shared_across_mois'] = trajectory_table['n_mois'] > 1
+    trajectory_table['shared_across_lines'] = trajectory_table['n_experiments'] > 1
+    return trajectory_table
+def select_mutations(trajectory_table, query=None, sort_by=None, ascending=False, top=None):
+    """
+    This Function receives a trajectory table and returns a list of mutations, e.g. for plotting:
+    query - a pandas query the rows must match (e.g. 'max_frequency > 0.2 and shared_across_lines')
+    sort_by - a column to rank the mutations by (each mutation is ranked by its best row)
+    top - keep only the first mutations of the ranking
+    """
+    selected = trajectory_table if query is None else trajectory_table.query(query)
+    if sort_by is None:
+        mutations = sorted(selected['Full Mutation'].unique())
+    else:
+        best = selected.groupby('Full Mutation', observed=True)[sort_by].agg('min' if ascending else 'max')
+        mutations = best.sort_values(ascending=ascending, kind='stable').index.tolist()
+    return mutations[:top] if top is not None else mutations
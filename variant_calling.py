@@ -0,0 +1,159 @@
+## Libraries
+import numpy as np
+import pandas as pd
+from scipy import stats
+from freq_loading import BASE_DTYPE
+from mutation_cutoffs import load_position_mask, is_masked
+
+## Constants
+N_BASES = len(BASE_DTYPE.categories)
+DEFAULT_CHUNK_SIZE = 1_000_000
+# Lowest error rate a site can get, so a site without any error in passage 0 does not make every read significant
+MIN_ERROR_RATE = 1e-5
+# Lowest error rate of the qscore model: reverse transcription and PCR errors are not in the quality scores
+MIN_QSCORE_ERROR_RATE = 1e-3
+# Beta-binomial concentration (alpha + beta): the lower it is, the more the error rate may vary between samples
+DEFAULT_CONCENTRATION = 1000
+
+
+## Functions
+def get_mutation_rows(freq_df):
+    """
+    This Function receives a freq df and returns a boolean array of its mutation rows (read_base != ref_base).
+    """
+    read_codes = freq_df['read_base'].astype(BASE_DTYPE).cat.codes.to_numpy()
+    ref_codes = freq_df['ref_base'].astype(BASE_DTYPE).cat.codes.to_numpy()
+    return read_codes != ref_codes
+def build_error_model(freq_df, error_passage=0, min_error_rate=MIN_ERROR_RATE):
+    """
+    This Function receives a freq df (after df_cleanup, with zero base_count rows kept) and estimates
+    the error rate of every (ref_pos, read_base) from the samples of one passage (passage 0 by default):
+    error_rate = (sum of base_count + 1) / (sum of coverage + 2), pooled over the samples of that passage.
+    return: error_model - a dictionary of positions (sorted ref_pos) and error_rate (positions x 5 bases)
+    """
+    error_df = freq_df[(freq_df['Passage'] == error_passage).to_numpy() & get_mutation_rows(freq_df)]
+    # A stock shared by several experiments has a copy of its rows per experiment, it is counted once
+    key_columns = [column for column in ['File', 'Done_by', 'ref_pos', 'read_base'] if column in error_df.columns]
+    error_df = error_df.drop_duplicates(key_columns)
+    positions = np.unique(error_df['ref_pos'].to_numpy())
+    position_idx = np.searchsorted(positions, error_df['ref_pos'].to_numpy())
+    base_idx = error_df['read_base'].astype(BASE_DTYPE).cat.codes.to_numpy()
+    base_count = np.zeros((len(positions), N_BASES))
+    coverage = np.zeros((len(positions), N_BASES))
+    np.add.at(base_count, (position_idx, base_idx), error_df['base_count'].to_numpy())
+    np.add.at(coverage, (position_idx, base_idx), error_df['coverage'].to_numpy())
+    error_rate = np.maximum((base_count + 1) / (coverage + 2), min_error_rate)
+    return {'positions': positions, 'error_rate': error_rate, 'default_rate': float(np.median(error_rate))}
+def get_qscore_error_rates(avg_qscore):
+    """
+    This Function receives an array of avg_qscore values and returns their sequencing error rates:
+    10^(-Q/10) / 3 (a sequencing error turns the reference base into one of the 3 other bases).
+    Rows without a quality score (deletions are written with an avg_qscore of inf, unread rows with 0) are NaN.
+    """
+    avg_qscore = np.asarray(avg_qscore, dtype=float)
+    has_qscore = np.isfinite(avg_qscore) & (avg_qscore > 0)
+    return np.where(has_qscore, 10 ** (-np.where(has_qscore, avg_qscore, 0) / 10) / 3, np.nan)
+def get_error_rates(chunk_df, error_model=None, min_error_rate=MIN_ERROR_RATE, fallback_rate=None,
+                    min_qscore_rate=MIN_QSCORE_ERROR_RATE):
+    """
+    This Function receives a chunk of a freq df and an error model (see build_error_model) and returns
+    the error rate of every row. Without an error model the rate is taken from each row's avg_qscore
+    (see get_qscore_error_rates): the rows without a quality score get fallback_rate (default: the median rate
+    of the chunk), and no rate is below min_qscore_rate, since the quality scores only hold sequencing errors.
+    """
+    if error_model is None:
+        error_rate = get_qscore_error_rates(chunk_df['avg_qscore'].to_numpy())
+        if fallback_rate is None:
+            fallback_rate = np.nanmedian(error_rate) if np.isfinite(error_rate).any() else min_qscore_rate
+        error_rate = np.where(np.isnan(error_rate), fallback_rate, error_rate)
+        return np.clip(error_rate, max(min_error_rate, min_qscore_rate), 1)
+    ref_pos = chunk_df['ref_pos'].to_numpy()
+    positions = error_model['positions']
+    position_idx = np.searchsorted(positions, ref_pos).clip(max=len(positions) - 1)
+    found = positions[position_idx] == ref_pos
+    base_idx = chunk_df['read_base'].astype(BASE_DTYPE).cat.codes.to_numpy()
+    # Positions that were not read in the error passage get the median error rate
+    return np.where(found, error_model['error_rate'][position_idx, base_idx], error_model['default_rate'])
+def get_p_values(base_count, coverage, error_rate, model='binomial', concentration=DEFAULT_CONCENTRATION):
+    """
+    This Function receives arrays of base counts, coverages and error rates and returns the p-value of seeing
+    at least base_count reads of the base by error alone: P(X >= base_count), X ~ Binomial(coverage, error_rate),
+    or X ~ BetaBinomial(coverage, a, b) with a = error_rate * concentration and b = (1 - error_rate) * concentration.
+    """
+    if model == 'binomial':
+        p_values = stats.binom.sf(base_count - 1, coverage, error_rate)
+    elif model == 'betabinomial':
+        p_values = stats.betabinom.sf(base_count - 1, coverage, error_rate * concentration,
+                                      (1 - error_rate) * concentration)
+    else:
+        raise ValueError('Unknown model: {}'.format(model))
+    return np.where(base_count > 0, p_values, 1.0)
+def get_q_values(p_values, n_tests=None):
+    """
+    This Function receives an array of p-values and returns their Benjamini-Hochberg q-values.
+    n_tests - the total number of tests (the default is the number of p-values). Rows with a p-value of 1
+    can be left out of p_values and only counted in n_tests, as their q-value is always 1.
+    """
+    if n_tests is None:
+        n_tests = len(p_values)
+    order = np.argsort(p_values, kind='stable')
+    ranked = p_values[order] * n_tests / np.arange(1, len(p_values) + 1)
+    # q-value of rank i = min over ranks j >= i of p_j * n / j
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q_values = np.empty(len(p_values), dtype=p_values.dtype)
+    q_values[order] = np.minimum(ranked, 1)
+    return q_values
+def call_variants(freq_df, error_model=None, model='binomial', alpha=0.01, concentration=DEFAULT_CONCENTRATION,
+                  chunk_size=DEFAULT_CHUNK_SIZE, position_mask=None):
+    """
+    This Function receives a freq df (after df_cleanup) and scores every mutation row against an error model
+    (see build_error_model, or None to use each row's avg_qscore) with a binomial or beta-binomial test.
+    The mutation rows are taken from the freq df in chunks of chunk_size, so only a chunk of the df is ever copied,
+    and the p-values are kept as float32 for the Benjamini-Hochberg correction over the whole table.
+    A row is called ('call') when its q-value is <= alpha and it is not in a masked position
+    (position_mask - see mutation_cutoffs.load_position_mask, the default is the MS2 mask).
+    return: called_df - a row per mutation row of the freq df: its row number in the freq df ('row'), ref_pos,
+            ref_base, read_base, error_rate, p_value, q_value and call (freq_df.iloc[called_df['row']] gives the rest)
+    """
+    if position_mask is None:
+        position_mask = load_position_mask()
+    rows = np.flatnonzero(get_mutation_rows(freq_df))
+    fallback_rate = None
+    if error_model is None:
+        # Rows without a quality score get the median rate of the whole table
+        fallback_rate = np.nanmedian(get_qscore_error_rates(freq_df['avg_qscore'].to_numpy()[rows])) \
+            if len(rows) else MIN_QSCORE_ERROR_RATE
+        if np.isnan(fallback_rate):
+            fallback_rate = MIN_QSCORE_ERROR_RATE
+    error_rate = np.empty(len(rows), dtype='float32')
+    p_values = np.ones(len(rows), dtype='float32')
+    for start in range(0, len(rows), chunk_size):
+        chunk_df = freq_df.iloc[rows[start:start + chunk_size]]
+        chunk_error_rate = get_error_rates(chunk_df, error_model, fallback_rate=fallback_rate)
+        error_rate[start:start + chunk_size] = chunk_error_rate
+        p_values[start:start + chunk_size] = get_p_values(chunk_df['base_count'].to_numpy(),
+                                                          chunk_df['coverage'].to_numpy(), chunk_error_rate,
+                                                          model, concentration)
+    # Only rows that were read can be significant, the rest keep a q-value of 1
+    q_values = np.ones(len(rows), dtype='float32')
+    tested = p_values < 1
+    q_values[tested] = get_q_values(p_values[tested], len(rows))
+    ref_pos = freq_df['ref_pos'].to_numpy()[rows]
+    called_df = pd.DataFrame({'row': rows, 'ref_pos': ref_pos,
+                              'ref_base': freq_df['ref_base'].iloc[rows].reset_index(drop=True),
+                              'read_base': freq_df['read_base'].iloc[rows].reset_index(drop=True),
+                              'error_rate': error_rate, 'p_value': p_values, 'q_value': q_values})
+    called_df['call'] = (q_values <= alpha) & ~is_masked(ref_pos, position_mask)
+    return called_df
+def get_called_mutations(called_df):
+    """
+    This Function receives the result of call_variants and returns a sorted list of the mutations called
+    in at least one sample (the variant calling counterpart of mut_cutoffs).
+    """
+    called_df = called_df[called_df['call']]
+    if 'Full Mutation' in called_df.columns:
+        mutations = called_df['Full Mutation'].astype(str)
+    else:
+        mutations = called_df['ref_base'].astype(str) + called_df['ref_pos'].astype(str) + \
+                    called_df['read_base'].astype(str)
+    return sorted(pd.unique(mutations))